@@ -0,0 +1,97 @@
+import os
+import random
+import time
+from datetime import date, timedelta
+
+from django.db import connection
+from django.test import TestCase
+
+from management.models import Contact
+
+# A table the size of a few years of sign ups. Set BENCHMARK_CONTACTS to try other sizes.
+CONTACTS = int(os.environ.get("BENCHMARK_CONTACTS", 1000000))
+LOOKUPS = 200
+INSERT_BATCH_SIZE = 10000
+NAMES = ["Aarav", "Diya", "Ishaan", "Kavya", "Roland", "Sai", "Your Child"]
+FIRST_BIRTH = date(2015, 1, 1)
+
+
+def phone_number(i):
+    # Every tenth number has signed up two children
+    return "91{:010d}".format(i - i % 10 // 9)
+
+
+def report(name, lookups, seconds):
+    print("{}: {} lookups in {:.3f}s ({:.3f}ms each)".format(name, lookups, seconds, seconds * 1000 / lookups))
+
+
+class ContactLookupBenchmark(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Insert rows straight from a template contact's column values: building a million model
+        # instances would take longer than the benchmark, and the reminder signals aren't being measured
+        fields = [field for field in Contact._meta.concrete_fields if not field.primary_key]
+        template = Contact()
+        template_values = {field.attname: field.get_db_prep_save(getattr(template, field.attname), connection)
+                           for field in fields}
+        sql = "INSERT INTO {} ({}) VALUES ({})".format(
+            connection.ops.quote_name(Contact._meta.db_table),
+            ", ".join(connection.ops.quote_name(field.column) for field in fields),
+            ", ".join(["%s"] * len(fields)))
+        rng = random.Random(0)
+        with connection.cursor() as cursor:
+            for start in range(0, CONTACTS, INSERT_BATCH_SIZE):
+                rows = []
+                for i in range(start, min(start + INSERT_BATCH_SIZE, CONTACTS)):
+                    values = dict(template_values,
+                                  name=rng.choice(NAMES),
+                                  phone_number=phone_number(i),
+                                  date_of_birth=FIRST_BIRTH + timedelta(days=rng.randrange(5 * 365)),
+                                  cancelled=rng.random() < 0.7)
+                    rows.append([values[field.attname] for field in fields])
+                cursor.executemany(sql, rows)
+            cursor.execute("ANALYZE")
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.samples = [(rng.choice(NAMES), phone_number(rng.randrange(CONTACTS))) for _ in range(LOOKUPS)]
+        self.days = [FIRST_BIRTH + timedelta(days=rng.randrange(5 * 365)) for _ in range(LOOKUPS // 10)]
+
+    def time_lookups(self):
+        timings = {}
+        start = time.time()
+        for _, number in self.samples:
+            list(Contact.objects.filter(phone_number=number))
+        timings["Contact.objects.filter(phone_number=...)"] = (len(self.samples), time.time() - start)
+
+        start = time.time()
+        for name, number in self.samples:
+            Contact.objects.filter(name=name, phone_number=number).first()
+        timings["Contact.objects.filter(name=..., phone_number=...)"] = (len(self.samples), time.time() - start)
+
+        start = time.time()
+        for day in self.days:
+            # The shape of TextReminder.due_on's query: a handful of target dates of birth
+            list(Contact.objects.filter(cancelled=False,
+                                        date_of_birth__in=[day + timedelta(weeks=weeks) for weeks in range(5)])
+                                .values_list('id', flat=True))
+        timings["Contact.objects.filter(cancelled=False, date_of_birth__in=...)"] = (len(self.days), time.time() - start)
+        return timings
+
+    def drop_indexes(self):
+        with connection.schema_editor() as schema_editor:
+            for index in Contact._meta.indexes:
+                schema_editor.remove_index(Contact, index)
+            if connection.vendor == "postgresql":
+                schema_editor.execute("DROP INDEX IF EXISTS contact_active_date_of_birth")
+
+    def test_lookup_latency(self):
+        indexed = self.time_lookups()
+        self.drop_indexes()
+        unindexed = self.time_lookups()
+        print("\n{} contacts".format(CONTACTS))
+        for name, (lookups, seconds) in sorted(indexed.items()):
+            report(name + ", indexed", lookups, seconds)
+            report(name + ", not indexed", *unindexed[name])
+        for name, (_, seconds) in indexed.items():
+            self.assertLess(seconds, unindexed[name][1])
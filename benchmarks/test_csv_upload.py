@@ -0,0 +1,118 @@
+import csv
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.db import connection
+from django.test import TestCase
+
+from management.models import Contact
+from modules.upload_contacts_from_file import assign_groups_to_contact, contact_entries, csv_upload, \
+                                              make_contact_dict, phone_number_is_valid, resolve_columns
+
+# A large partner upload, built from the rows of the example MAPS file. Set BENCHMARK_CSV_ROWS to try other sizes.
+ROWS = int(os.environ.get("BENCHMARK_CSV_ROWS", 100000))
+# Writing rows one at a time is slow enough that the upload is timed on the first BENCHMARK_UPLOAD_ROWS
+UPLOAD_ROWS = int(os.environ.get("BENCHMARK_UPLOAD_ROWS", 5000))
+EXAMPLE_FILE = "tests/data/example-m.csv"
+SOURCE = "MAPS"
+
+
+def report(name, rows, seconds):
+    print("{}: {} rows in {:.2f}s ({:.0f} rows/s)".format(name, rows, seconds, rows / seconds))
+
+
+class CsvUploadBenchmark(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super(CsvUploadBenchmark, cls).setUpClass()
+        with open(EXAMPLE_FILE) as csvfile:
+            reader = csv.DictReader(csvfile)
+            fieldnames = reader.fieldnames
+            examples = list(reader)
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, "partner.csv")
+        with open(cls.path, "w") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for i in range(ROWS):
+                writer.writerow(examples[i % len(examples)])
+        cls.upload_path = os.path.join(cls.directory, "upload.csv")
+        with open(cls.upload_path, "w") as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+            writer.writeheader()
+            for i in range(UPLOAD_ROWS):
+                # A new phone number per row, so every row is a new contact
+                writer.writerow(dict(examples[i % len(examples)],
+                                     **{"Mobile No of  Pregnant/ Mother/ Father": "9{:09d}".format(i)}))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+        super(CsvUploadBenchmark, cls).tearDownClass()
+
+    def parse(self, resolve):
+        start = time.time()
+        with open(self.path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            headers = resolve_columns(reader.fieldnames) if resolve else None
+            for row in reader:
+                make_contact_dict(row, SOURCE, headers=headers)
+        return time.time() - start
+
+    def test_header_resolution(self):
+        unresolved = self.parse(resolve=False)
+        resolved = self.parse(resolve=True)
+        report("make_contact_dict matching headers on every row", ROWS, unresolved)
+        report("make_contact_dict with columns resolved once", ROWS, resolved)
+        self.assertLess(resolved, unresolved)
+
+    def parse_with(self, processes):
+        start = time.time()
+        with open(self.path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            for _ in contact_entries(reader, SOURCE, headers=resolve_columns(reader.fieldnames), processes=processes):
+                pass
+        return time.time() - start
+
+    def test_parsing_processes(self):
+        processes = multiprocessing.cpu_count()
+        in_process = self.parse_with(processes=1)
+        pooled = self.parse_with(processes=max(processes, 2))
+        report("contact_entries in this process", ROWS, in_process)
+        report("contact_entries in {} processes".format(max(processes, 2)), ROWS, pooled)
+        if processes > 1:
+            self.assertLess(pooled, in_process)
+
+    def upload_row_by_row(self):
+        # How csv_upload wrote contacts before it wrote them in chunks
+        with open(self.upload_path) as csvfile:
+            reader = csv.DictReader(csvfile)
+            headers = resolve_columns(reader.fieldnames)
+            for row in reader:
+                new_dict = make_contact_dict(row, SOURCE, headers=headers)
+                if phone_number_is_valid(new_dict["phone_number"]):
+                    contact, _ = Contact.objects.update_or_create(name=new_dict["name"],
+                        phone_number=new_dict["phone_number"], defaults=new_dict)
+                    assign_groups_to_contact(contact, row.get("Groups"))
+
+    def time_upload(self, upload):
+        Contact.objects.all().delete()
+        start = time.time()
+        upload()
+        seconds = time.time() - start
+        self.assertEqual(Contact.objects.count(), UPLOAD_ROWS)
+        return seconds
+
+    def test_upload(self):
+        row_by_row = self.time_upload(self.upload_row_by_row)
+        chunked = self.time_upload(lambda: csv_upload(self.upload_path, SOURCE))
+        report("update_or_create on every row", UPLOAD_ROWS, row_by_row)
+        report("csv_upload in chunks", UPLOAD_ROWS, chunked)
+        self.assertLess(chunked, row_by_row)
+        if connection.vendor == "postgresql":
+            copied = self.time_upload(lambda: csv_upload(self.upload_path, SOURCE, engine="copy"))
+            report("csv_upload staged with COPY", UPLOAD_ROWS, copied)
+            self.assertLess(copied, chunked)
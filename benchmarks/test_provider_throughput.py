@@ -0,0 +1,84 @@
+import time
+from unittest import skipUnless
+
+import six
+from django.test import TestCase
+
+from cshsms.settings import SMS_SEND_CONCURRENCY
+from modules.http_client import ConnectionPool
+from modules.texter import Texter
+from modules.textlocalwrapper import TextLocal
+from tests.fixtures import FakeProviderServer
+
+if six.PY3:
+    import asyncio
+    from modules.async_textlocalwrapper import AsyncTextLocal
+    from modules.async_texter import AsyncTexter
+
+# Enough requests to smooth out noise, against a provider that takes PROVIDER_LATENCY seconds to answer
+SENDS = 100
+PROVIDER_LATENCY = 0.02
+
+
+def report(name, requests, seconds):
+    print("{}: {} requests in {:.2f}s ({:.0f} requests/s)".format(name, requests, seconds, requests / seconds))
+
+
+@skipUnless(six.PY3, "asyncio clients are Python 3 only")
+class ProviderThroughputBenchmark(TestCase):
+    def setUp(self):
+        self.messages = [("Benchmark {}".format(i), "91{:010d}".format(i)) for i in range(SENDS)]
+
+    def textlocal_kwargs(self, server):
+        return {'apikey': 'mock_key', 'primary_id': 'mock_id', 'sendername': 'mock_sendername',
+                'api_url': server.api_url}
+
+    def blocking_sends(self, server):
+        texter = Texter(textlocal=TextLocal(http=ConnectionPool(), **self.textlocal_kwargs(server)))
+        start = time.time()
+        for message, phone_number in self.messages:
+            texter.send(message=message, phone_number=phone_number)
+        elapsed = time.time() - start
+        texter.textlocal.http.close()
+        return elapsed
+
+    def async_sends(self, server):
+        texter = AsyncTexter(textlocal=AsyncTextLocal(**self.textlocal_kwargs(server)),
+                             concurrency=SMS_SEND_CONCURRENCY)
+        loop = asyncio.new_event_loop()
+        start = time.time()
+        loop.run_until_complete(texter.send_many(self.messages))
+        elapsed = time.time() - start
+        texter.close()
+        loop.run_until_complete(asyncio.sleep(0, loop=loop))
+        loop.close()
+        return elapsed
+
+    def test_send_throughput(self):
+        with FakeProviderServer(delay=PROVIDER_LATENCY) as server:
+            blocking = self.blocking_sends(server)
+            asynchronous = self.async_sends(server)
+        report("Blocking Texter.send", SENDS, blocking)
+        report("AsyncTexter.send_many (concurrency {})".format(SMS_SEND_CONCURRENCY), SENDS, asynchronous)
+        self.assertLess(asynchronous, blocking)
+
+    def test_inbox_and_outbox_read_latency(self):
+        with FakeProviderServer(response={'messages': []}, delay=PROVIDER_LATENCY) as server:
+            texter = Texter(textlocal=TextLocal(http=ConnectionPool(), **self.textlocal_kwargs(server)))
+            start = time.time()
+            texter.read_inbox()
+            texter.read_api_outbox()
+            blocking = time.time() - start
+            texter.textlocal.http.close()
+
+            async_texter = AsyncTexter(textlocal=AsyncTextLocal(**self.textlocal_kwargs(server)))
+            loop = asyncio.new_event_loop()
+            start = time.time()
+            loop.run_until_complete(async_texter.read_inbox_and_outbox())
+            asynchronous = time.time() - start
+            async_texter.close()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            loop.close()
+        report("Blocking inbox then outbox read", 2, blocking)
+        report("AsyncTexter.read_inbox_and_outbox", 2, asynchronous)
+        self.assertLess(asynchronous, blocking)
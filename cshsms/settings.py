@@ -16,15 +16,18 @@ import os
 
 
 if not os.getenv('IS_TRAVIS', False):
+    from cshsms import settings_secret
     from cshsms.settings_secret import SECRET_KEY, DATABASES, REMOTE, TEXTLOCAL_API, \
                                        TEXTLOCAL_PRIMARY_ID, TEXTLOCAL_PHONENUMBER, \
                                        HSPSMS_API, HSPSMS_USERNAME, HSPSMS_SENDERNAME, \
                                        TEXTLOCAL_SENDERNAME
+    # Optional: without it the TextLocal webhook is off, and texts are only read by the inbox poll
+    TEXTLOCAL_WEBHOOK_TOKEN = getattr(settings_secret, 'TEXTLOCAL_WEBHOOK_TOKEN', None)
 else:
     from cshsms.settings_travis import SECRET_KEY, DATABASES, REMOTE, TEXTLOCAL_API, \
                                        TEXTLOCAL_PRIMARY_ID, TEXTLOCAL_PHONENUMBER, \
                                        HSPSMS_API, HSPSMS_USERNAME, HSPSMS_SENDERNAME, \
-                                       TEXTLOCAL_SENDERNAME
+                                       TEXTLOCAL_SENDERNAME, TEXTLOCAL_WEBHOOK_TOKEN
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -134,8 +137,36 @@ else:
     logger.addHandler(logging_handler_out)
 
 
+# SMS provider HTTP connections (kept open and shared by the TextLocal and Hspsms wrappers)
+SMS_HTTP_POOL_SIZE = 8      # Idle keep-alive connections kept per provider host
+SMS_HTTP_TIMEOUT = 30       # Seconds
+SMS_SEND_CONCURRENCY = 8    # Sends in flight at once during the daily reminder run
+
+# Send requests per second each SMS provider accepts, and how many may go out back to back
+SMS_RATE_LIMITS = {
+    "textlocal": {"rate": 10, "burst": 10},
+    "hspsms": {"rate": 5, "burst": 5},
+}
+
+# Inbound texts. When PROCESS_INBOUND_IN_WORKERS is on, the inbox job and the webhook only store
+# texts, and `python manage.py process_inbound` workers process them
+PROCESS_INBOUND_IN_WORKERS = False
+INBOUND_WORKER_BATCH_SIZE = 10      # Messages a worker claims and processes in one transaction
+INBOUND_WORKER_POLL_INTERVAL = 5    # Seconds an idle worker waits before looking again
+INBOUND_MAX_ATTEMPTS = 3            # Failed attempts before a message is left for someone to look at
+
+# `python manage.py archive_messages` moves messages older than this out of the Message table
+MESSAGE_ARCHIVE_AFTER_DAYS = 180
+MESSAGE_ARCHIVE_BATCH_SIZE = 500    # Messages moved per transaction
+
+# Contact uploads. With more than one process, rows are parsed by a process pool, a batch at a time,
+# while the uploading process writes the parsed rows in file order
+CSV_UPLOAD_PROCESSES = 1
+CSV_PARSE_BATCH_SIZE = 1000         # Rows sent to a parsing process at a time
+
+
 # Cronjobs
 CRONJOBS = [
-    ('*/10 * * * *', 'jobs.text_processor_job.check_and_process_registrations'),  # Check for new registrations every 10 min
+    ('*/10 * * * *', 'jobs.text_processor_job.check_and_process_registrations'),  # Pick up any registrations the inbound webhook missed, every 10 min
     ('0 16 * * *', 'jobs.text_reminder_job.remind_all')                           # Remind people daily at 4pm
 ]
@@ -24,3 +24,4 @@ HSPSMS_USERNAME = "travis"
 HSPSMS_SENDERNAME = "travis"
 TEXTLOCAL_SENDERNAME = "travis"
 TEXTLOCAL_PHONENUMBER = "1111111111"
+TEXTLOCAL_WEBHOOK_TOKEN = "travis"
@@ -1,20 +1,28 @@
 import logging
+from modules import providers
+from modules.contact_cache import ContactCache
 from modules.texter import Texter
-from modules.text_processor import TextProcessor
-from management.models import Message
+from modules.text_processor import TextProcessor, unseen_messages
+from management.models import Message, InboxCursor
+
+# Name of the InboxCursor tracking how far into the TextLocal primary inbox we have read
+PRIMARY_INBOX_CURSOR = "textlocal_primary_inbox"
 
 def check_and_process_registrations():
     logging.info("Checking and processing registrations...")
-    messages = Texter().read_inbox()
+    cursor, _ = InboxCursor.objects.get_or_create(name=PRIMARY_INBOX_CURSOR)
+    messages = unseen_messages(Texter().read_inbox(cursor=cursor))
     num_numbers = len(messages)
     num_messages = sum(list(map(lambda i: len(i[1]), messages.items())))
-    logging.info("...Processing {} messages from {} numbers.".format(num_messages, num_numbers))
+    logging.info("...Processing {} new messages from {} numbers.".format(num_messages, num_numbers))
 
+    # Load every sender's contacts, with their groups and outgoing messages, up front rather than number by number
+    contacts = ContactCache(messages.keys(), prefetch=True)
     for phone_number, texts in messages.items():
-        t = TextProcessor(phone_number)
+        t = TextProcessor(phone_number, contacts=contacts)
         for text in texts:
-            message = t.write_to_database(message=text[0], date=text[1])
-            if not message.is_processed:
-                t.process(message)
+            t.receive(message=text[0], date=text[1])
+    # Only move the high-water mark once everything read has been stored (and processed, unless workers do that)
+    cursor.save()
 
-    logging.info("...Completed.")
+    logging.info("...Completed. Provider usage: {}".format(providers.stats()))
@@ -1,10 +1,11 @@
 import logging
-from management.models import Contact
-from modules.text_reminder import TextReminder
+from datetime import datetime
+from modules import providers
+from modules.text_reminder import TextReminder, contacts_due_reminders, send_reminders
 
 def remind_all():
-    logging.info("Checking {} contacts for reminders...".format(Contact.objects.count()))
-    reminds = 0
-    for contact in Contact.objects.all():
-        reminds += TextReminder(contact).remind()
-    logging.info("...Completed. Send {} reminders.".format(reminds))
+    today = datetime.now().date()
+    due_reminders = TextReminder.due_on(today, contacts=contacts_due_reminders(today))
+    logging.info("Checking {} contacts for reminders...".format(len(due_reminders)))
+    reminds = send_reminders(due_reminders)
+    logging.info("...Completed. Send {} reminders. Provider usage: {}".format(reminds, providers.stats()))
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ManagementConfig(AppConfig):
     name = 'management'
+
+    def ready(self):
+        # Connects the signal handlers that keep the reminder schedule up to date.
+        import modules.text_reminder
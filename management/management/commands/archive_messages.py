@@ -0,0 +1,20 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from cshsms.settings import MESSAGE_ARCHIVE_AFTER_DAYS, MESSAGE_ARCHIVE_BATCH_SIZE
+from modules.message_archive import archive_messages
+
+
+class Command(BaseCommand):
+    help = "Moves old messages out of the Message table into the message archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=MESSAGE_ARCHIVE_AFTER_DAYS,
+                            help="Archive messages created more than this many days ago")
+        parser.add_argument('--batch-size', type=int, default=MESSAGE_ARCHIVE_BATCH_SIZE,
+                            help="Messages moved per transaction")
+
+    def handle(self, *args, **options):
+        archived = archive_messages(days=options['days'], batch_size=options['batch_size'])
+        logging.info("Archived {} messages".format(archived))
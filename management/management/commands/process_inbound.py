@@ -0,0 +1,48 @@
+import logging
+import multiprocessing
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+
+from cshsms.settings import INBOUND_WORKER_BATCH_SIZE, INBOUND_WORKER_POLL_INTERVAL
+from modules.inbound_queue import run_worker
+
+
+class Command(BaseCommand):
+    help = "Runs workers that process the queue of incoming texts"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Worker processes to run")
+        parser.add_argument('--batch-size', type=int, default=INBOUND_WORKER_BATCH_SIZE,
+                            help="Messages each worker claims at a time")
+        parser.add_argument('--poll-interval', type=float, default=INBOUND_WORKER_POLL_INTERVAL,
+                            help="Seconds an idle worker waits before looking for more messages")
+        parser.add_argument('--once', action='store_true',
+                            help="Exit once the queue is empty instead of waiting for more messages")
+
+    def handle(self, *args, **options):
+        worker_options = {'batch_size': options['batch_size'],
+                          'poll_interval': options['poll_interval'],
+                          'once': options['once']}
+        if options['workers'] > 1 and not connection.features.has_select_for_update_skip_locked:
+            # Without SKIP LOCKED every worker would claim the same messages
+            raise CommandError("Running more than one worker needs a database with "
+                               "SELECT ... FOR UPDATE SKIP LOCKED, such as PostgreSQL")
+        if options['workers'] == 1:
+            handled = run_worker(**worker_options)
+            logging.info("Processed {} incoming messages".format(handled))
+            return
+
+        # Each process must open its own database connection rather than share the parent's
+        connections.close_all()
+        workers = [multiprocessing.Process(target=run_worker, kwargs=worker_options)
+                   for _ in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
@@ -0,0 +1,26 @@
+import logging
+
+from django.core.management.base import BaseCommand
+
+from cshsms.settings import CSV_UPLOAD_PROCESSES
+from modules.resumable_upload import resumable_upload
+from modules.upload_contacts_from_file import CSV_UPLOAD_CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Uploads the contacts in a csv file, resuming where an interrupted upload of the file stopped"
+
+    def add_arguments(self, parser):
+        parser.add_argument('filepath', help="The csv file to upload")
+        parser.add_argument('source', help="Who the file came from, e.g. TR, MAPS, HANSA or WARDHA")
+        parser.add_argument('--chunk-size', type=int, default=CSV_UPLOAD_CHUNK_SIZE,
+                            help="Rows written per transaction")
+        parser.add_argument('--processes', type=int, default=CSV_UPLOAD_PROCESSES,
+                            help="Processes parsing rows")
+        parser.add_argument('--restart', action='store_true',
+                            help="Upload the whole file again, even if an earlier upload of it got further")
+
+    def handle(self, *args, **options):
+        uploaded = resumable_upload(options['filepath'], options['source'], restart=options['restart'],
+                                    chunk_size=options['chunk_size'], processes=options['processes'])
+        logging.info("Uploaded {} rows from {}".format(uploaded, options['filepath']))
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-17 12:10
+from __future__ import unicode_literals
+
+from collections import OrderedDict
+
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+import django.db.models.deletion
+
+# A copy of modules.text_reminder's offsets and reminder_due_dates as they were when this was written
+REMINDER_OFFSETS = [
+    ("six_week_reminder_seven_days", relativedelta(weeks=6), 7),
+    ("six_week_reminder_one_day", relativedelta(weeks=6), 1),
+    ("ten_week_reminder_seven_days", relativedelta(weeks=10), 7),
+    ("ten_week_reminder_one_day", relativedelta(weeks=10), 1),
+    ("fourteen_week_reminder_seven_days", relativedelta(weeks=14), 7),
+    ("fourteen_week_reminder_one_day", relativedelta(weeks=14), 1),
+    ("nine_month_reminder_seven_days", relativedelta(months=9), 7),
+    ("nine_month_reminder_one_day", relativedelta(months=9), 1),
+    ("sixteen_month_reminder_seven_days", relativedelta(months=16), 7),
+    ("sixteen_month_reminder_one_day", relativedelta(months=16), 1),
+    ("five_year_reminder_seven_days", relativedelta(years=5), 7),
+    ("five_year_reminder_one_day", relativedelta(years=5), 1)
+]
+PREGNANCY_CHECK_OFFSETS = [
+    ("verify_pregnant_signup_birthdate", relativedelta(weeks=2), 0),
+    ("verify_pregnant_signup_birthdate", relativedelta(weeks=4), 0)
+]
+
+
+def reminder_due_dates(date_of_birth, preg_signup):
+    offsets = REMINDER_OFFSETS + (PREGNANCY_CHECK_OFFSETS if preg_signup else [])
+    due = OrderedDict()
+    for kind, time_after_dob, days_before in offsets:
+        estimate = date_of_birth + time_after_dob - relativedelta(days=days_before)
+        spread = 3 if time_after_dob.months or time_after_dob.years else 0
+        for shift in range(-spread, spread + 1):
+            day = estimate + relativedelta(days=shift)
+            if day - time_after_dob + relativedelta(days=days_before) == date_of_birth:
+                due.setdefault(day, kind)
+    return [(kind, day) for day, kind in due.items()]
+
+
+def schedule_existing_contacts(apps, schema_editor):
+    Contact = apps.get_model('management', 'Contact')
+    ScheduledReminder = apps.get_model('management', 'ScheduledReminder')
+    for contact in Contact.objects.all().iterator():
+        ScheduledReminder.objects.bulk_create(
+            [ScheduledReminder(contact=contact, due_date=due_date, kind=kind)
+             for kind, due_date in reminder_due_dates(contact.date_of_birth, contact.preg_signup)])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0031_auto_20171109_0605'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduledReminder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('due_date', models.DateField(db_index=True)),
+                ('kind', models.CharField(max_length=50)),
+                ('contact', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='scheduled_reminders', to='management.Contact')),
+            ],
+            options={
+                'ordering': ('due_date',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='scheduledreminder',
+            unique_together=set([('contact', 'due_date', 'kind')]),
+        ),
+        migrations.RunPython(schedule_existing_contacts, migrations.RunPython.noop),
+    ]
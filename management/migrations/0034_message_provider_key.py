@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-17 14:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0033_inboxcursor'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='provider_key',
+            field=models.CharField(blank=True, max_length=40, null=True, unique=True),
+        ),
+    ]
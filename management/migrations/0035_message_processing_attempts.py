@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-17 15:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0034_message_provider_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='processing_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-17 13:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+# Reminders only go to contacts who haven't cancelled, and most contacts eventually do, so index the
+# dates of birth of the rest. Django 1.11 can't declare partial indexes and SQLite is only used in tests.
+ACTIVE_DATE_OF_BIRTH_INDEX = "contact_active_date_of_birth"
+
+
+def create_active_date_of_birth_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("CREATE INDEX {} ON management_contact (date_of_birth) "
+                              "WHERE NOT cancelled".format(ACTIVE_DATE_OF_BIRTH_INDEX))
+
+
+def drop_active_date_of_birth_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(ACTIVE_DATE_OF_BIRTH_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0035_message_processing_attempts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['phone_number', 'name'], name='contact_phone_number_name'),
+        ),
+        migrations.AddIndex(
+            model_name='contact',
+            index=models.Index(fields=['date_of_birth'], name='contact_date_of_birth'),
+        ),
+        migrations.RunPython(create_active_date_of_birth_index, drop_active_date_of_birth_index),
+    ]
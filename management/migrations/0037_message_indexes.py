@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-17 13:15
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models
+import six
+
+# The inbound queue (modules.inbound_queue) takes unprocessed incoming texts oldest first. They're a
+# sliver of the table, so a partial index stays small. PostgreSQL only, like contact_active_date_of_birth.
+INBOUND_QUEUE_INDEX = "message_inbound_queue"
+
+
+# A copy of management.models.message_body_key as it was when this was written
+def message_body_key(body):
+    body = body or u""
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    return hashlib.md5(body).hexdigest()
+
+
+def set_body_keys(apps, schema_editor):
+    Message = apps.get_model('management', 'Message')
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("UPDATE management_message SET body_key = md5(body)")
+        return
+    # Most bodies are reminders sent to many contacts, so there are far fewer bodies than messages
+    for body in Message.objects.order_by().values_list('body', flat=True).distinct().iterator():
+        Message.objects.filter(body=body).update(body_key=message_body_key(body))
+
+
+def create_inbound_queue_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("CREATE INDEX {} ON management_message (received_at, id) "
+                              "WHERE direction = 'Incoming' AND NOT is_processed".format(INBOUND_QUEUE_INDEX))
+
+
+def drop_inbound_queue_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute("DROP INDEX IF EXISTS {}".format(INBOUND_QUEUE_INDEX))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0036_contact_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='body_key',
+            field=models.CharField(blank=True, editable=False, max_length=32),
+        ),
+        migrations.RunPython(set_body_keys, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['contact', 'direction', 'created_at'], name='message_contact_direction_time'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['contact', 'direction', 'body_key'], name='message_contact_direction_body'),
+        ),
+        migrations.RunPython(create_inbound_queue_index, drop_inbound_queue_index),
+    ]
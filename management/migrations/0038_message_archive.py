@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-17 13:18
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('management', '0037_message_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedMessage',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('body', models.CharField(max_length=300)),
+                ('body_key', models.CharField(blank=True, max_length=32)),
+                ('direction', models.CharField(max_length=10)),
+                ('is_processed', models.BooleanField(default=False)),
+                ('created_at', models.DateTimeField()),
+                ('received_at', models.DateTimeField(blank=True, null=True)),
+                ('sent_at', models.DateTimeField(blank=True, null=True)),
+                ('provider_key', models.CharField(blank=True, max_length=40, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('contact', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='management.Contact')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MessageSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('incoming_count', models.PositiveIntegerField(default=0)),
+                ('outgoing_count', models.PositiveIntegerField(default=0)),
+                ('first_message_at', models.DateTimeField(blank=True, null=True)),
+                ('last_message_at', models.DateTimeField(blank=True, null=True)),
+                ('contact', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='message_summary', to='management.Contact')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedmessage',
+            index=models.Index(fields=['contact', 'direction', 'body_key'], name='archived_contact_direction_key'),
+        ),
+    ]
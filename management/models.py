@@ -2,8 +2,19 @@ from django.db import models
 from django.core.validators import RegexValidator
 from django.utils import timezone
 import datetime
+import hashlib
+import six
 from django.utils.encoding import python_2_unicode_compatible
 
+
+def message_body_key(body):
+    """The md5 of a message body, the same as PostgreSQL's md5(body)."""
+    body = body or u""
+    if isinstance(body, six.text_type):
+        body = body.encode('utf-8')
+    return hashlib.md5(body).hexdigest()
+
+
 @python_2_unicode_compatible
 class Contact(models.Model):
     # Vitals
@@ -77,8 +88,14 @@ class Contact(models.Model):
 
     class Meta:
         ordering = ('name',)
+        indexes = [
+            # Leads with phone_number, so it also serves lookups by number alone
+            models.Index(fields=['phone_number', 'name'], name='contact_phone_number_name'),
+            models.Index(fields=['date_of_birth'], name='contact_date_of_birth'),
+        ]
 
 
+@python_2_unicode_compatible
 class Group(models.Model):
     """
     List of Pre-existing groups in Telerivet
@@ -141,6 +158,128 @@ class Message(models.Model):
                                     auto_now_add=False,
                                     blank=True,
                                     null=True)
+    # Identifies an incoming text as read from the provider, so reading it again doesn't store it twice
+    provider_key = models.CharField(max_length=40, unique=True, blank=True, null=True)
+    # Times an inbound worker has failed to process this message (see modules.inbound_queue)
+    processing_attempts = models.PositiveSmallIntegerField(default=0)
+    # Set from the body on save, so checking whether a text was already sent is an index lookup
+    body_key = models.CharField(max_length=32, blank=True, editable=False)
+
+    def save(self, *args, **kwargs):
+        self.body_key = message_body_key(self.body)
+        super(Message, self).save(*args, **kwargs)
+
+    def __str__(self):
+        return self.body
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['contact', 'direction', 'created_at'], name='message_contact_direction_time'),
+            models.Index(fields=['contact', 'direction', 'body_key'], name='message_contact_direction_body'),
+        ]
+
+
+class ScheduledReminder(models.Model):
+    """
+    One row per reminder a contact is due to receive, keyed by the date it is due.
+    Rows are (re)built from the contact's date of birth whenever it changes, so the
+    daily reminder job only has to read the rows due today.
+    """
+    contact = models.ForeignKey(Contact, on_delete=models.CASCADE, related_name="scheduled_reminders")
+    due_date = models.DateField(db_index=True)
+    # Name of the reminder function in modules.i18n, e.g. "six_week_reminder_seven_days"
+    kind = models.CharField(max_length=50)
+
+    def __str__(self):
+        return "%s, %s, %s" % (self.contact_id, self.due_date, self.kind)
+
+    class Meta:
+        ordering = ('due_date',)
+        unique_together = ('contact', 'due_date', 'kind')
+
+
+@python_2_unicode_compatible
+class InboxCursor(models.Model):
+    """
+    High-water mark of the messages already read from a provider inbox, so each run of
+    the inbox job only fetches and parses the messages that arrived since the last one.
+    Messages are ordered by the time they were received, then by the provider's id.
+    """
+    name = models.CharField(max_length=50, unique=True)
+    last_received_at = models.DateTimeField(blank=True, null=True)
+    last_message_id = models.BigIntegerField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def has_read(self, received_at, message_id):
+        if self.last_received_at is None:
+            return False
+        return (received_at, message_id) <= (self.last_received_at, self.last_message_id or 0)
+
+    def mark_read(self, received_at, message_id):
+        if not self.has_read(received_at, message_id):
+            self.last_received_at = received_at
+            self.last_message_id = message_id
+
+    def __str__(self):
+        return "%s, %s, %s" % (self.name, self.last_received_at, self.last_message_id)
+
+
+@python_2_unicode_compatible
+class ArchivedMessage(models.Model):
+    """
+    A message moved out of the Message table once it was old enough (see
+    `python manage.py archive_messages`), keeping the id it had there. Only the duplicate
+    subscription check reads these, for contacts whose MessageSummary counts any.
+    """
+    contact = models.ForeignKey(Contact, on_delete=models.CASCADE, null=True)
+    body = models.CharField(max_length=300)
+    body_key = models.CharField(max_length=32, blank=True)
+    direction = models.CharField(max_length=10)
+    is_processed = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    received_at = models.DateTimeField(blank=True, null=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+    provider_key = models.CharField(max_length=40, blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.body
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['contact', 'direction', 'body_key'], name='archived_contact_direction_key'),
+        ]
+
+
+class MessageSummary(models.Model):
+    """
+    Totals of a contact's archived messages, so their history can be told without reading the archive.
+    """
+    contact = models.OneToOneField(Contact, on_delete=models.CASCADE, related_name="message_summary")
+    incoming_count = models.PositiveIntegerField(default=0)
+    outgoing_count = models.PositiveIntegerField(default=0)
+    first_message_at = models.DateTimeField(blank=True, null=True)
+    last_message_at = models.DateTimeField(blank=True, null=True)
+
+    def __str__(self):
+        return "%s, %s in, %s out" % (self.contact_id, self.incoming_count, self.outgoing_count)
+
+
+@python_2_unicode_compatible
+class UploadCheckpoint(models.Model):
+    """
+    How far `python manage.py upload_contacts` got through a contact file, keyed by the hash of
+    the file's contents and its source. It is saved in the same transaction as each chunk of
+    contacts, so an interrupted upload of the same file resumes after the last chunk committed.
+    """
+    file_hash = models.CharField(max_length=64)
+    source = models.CharField(max_length=20)
+    rows_done = models.PositiveIntegerField(default=0)
+    finished_at = models.DateTimeField(blank=True, null=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return "%s, %s, %s rows" % (self.file_hash, self.source, self.rows_done)
+
+    class Meta:
+        unique_together = ('file_hash', 'source')
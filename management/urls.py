@@ -8,4 +8,5 @@ app_name = 'management'
 urlpatterns = [
     url(r'^$', views.IndexView.as_view(), name='index'),
     url(r'^(?P<pk>[0-9]+)/$', views.DetailView.as_view(), name='detail'),
+    url(r'^inbound/textlocal/(?P<token>[\w-]+)/$', views.textlocal_inbound, name='textlocal_inbound'),
 ]
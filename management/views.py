@@ -1,8 +1,17 @@
+import logging
+
 from django.shortcuts import get_object_or_404, render
-from django.http import HttpResponseRedirect
+from django.http import Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, HttpResponseRedirect
 from django.urls import reverse
+from django.utils.crypto import constant_time_compare
 from django.views import generic
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
 
+from cshsms.settings import TEXTLOCAL_WEBHOOK_TOKEN
+from modules.date_helper import datetime_from_date_string, datetime_string_ymd_to_datetime
+from modules import providers
+from modules.text_processor import TextProcessor
 from .models import Contact, Group
 
 # Create your views here.
@@ -20,4 +29,36 @@ class IndexView(generic.ListView):
 
 class DetailView(generic.DetailView):
     model = Contact
-    template_name = 'management/detail.html'
\ No newline at end of file
+    template_name = 'management/detail.html'
+
+
+@csrf_exempt
+@require_POST
+def textlocal_inbound(request, token):
+    """
+    TextLocal posts each text sent to our number here as soon as it arrives, so it is
+    stored and answered straight away instead of on the next inbox poll. Texts that
+    the poll reads again later are recognised as already stored and skipped. Turned off
+    unless TEXTLOCAL_WEBHOOK_TOKEN is set.
+    """
+    if not TEXTLOCAL_WEBHOOK_TOKEN:
+        raise Http404("The TextLocal webhook is turned off")
+    if not constant_time_compare(token, TEXTLOCAL_WEBHOOK_TOKEN):
+        return HttpResponseForbidden()
+    phone_number = request.POST.get('sender')
+    body = request.POST.get('content')
+    received = request.POST.get('rcvd')
+    # Without TextLocal's received time the text can't be matched to the inbox poll's copy
+    if not phone_number or body is None or not received:
+        return HttpResponseBadRequest("sender, content and rcvd are required")
+
+    try:
+        datetime_from_date_string(received, "%Y-%m-%d %H:%M:%S")
+    except ValueError:
+        return HttpResponseBadRequest("rcvd must be a YYYY-MM-DD HH:MM:SS time")
+    received_at = datetime_string_ymd_to_datetime(received)
+    # Correct the body the same way the inbox poll does, so both store the same text
+    body = providers.textlocal().correct_corrupted_unicode_matches(body)
+    logging.info("Received text from {} via webhook".format(phone_number))
+    TextProcessor(phone_number).receive(message=body, date=received_at)
+    return HttpResponse("OK")
@@ -0,0 +1,160 @@
+"""asyncio counterpart of modules.http_client. Python 3 only, so only import it from code
+that runs under Python 3."""
+import asyncio
+import ssl
+from http.client import RemoteDisconnected
+from urllib import parse
+
+from cshsms.settings import SMS_HTTP_POOL_SIZE, SMS_HTTP_TIMEOUT
+from modules.http_client import IDEMPOTENT_METHODS, USER_AGENT, StaleConnection
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+class AsyncConnectionPool(object):
+    """Keeps up to `pool_size` idle keep-alive connections open per host for one event loop,
+        so many requests can be in flight at once without a thread each."""
+    def __init__(self, pool_size=SMS_HTTP_POOL_SIZE, timeout=SMS_HTTP_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle_connections = {}
+        self.requests_made = 0
+        self.connections_opened = 0
+
+    async def get(self, url, params=None):
+        if params:
+            url = url + parse.urlencode(params)
+        return await self.request("GET", url)
+
+    async def post(self, url, params):
+        return await self.request("POST", url, body=parse.urlencode(params).encode('utf-8'),
+                                  headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+    async def request(self, method, url, body=None, headers=None):
+        """Returns the body of the response as bytes."""
+        split_url = parse.urlsplit(url)
+        host = (split_url.scheme, split_url.hostname, split_url.port or DEFAULT_PORTS[split_url.scheme])
+        path = (split_url.path or "/") + ("?" + split_url.query if split_url.query else "")
+        request_headers = {'Host': split_url.netloc, 'User-Agent': USER_AGENT}
+        request_headers.update(headers or {})
+        request_bytes = self.request_bytes(method, path, body, request_headers)
+
+        self.requests_made += 1
+        connection, reused = await self.take_connection(host)
+        try:
+            status, will_close, data = await self.send(connection, method, request_bytes)
+        except StaleConnection as e:
+            self.close_connection(connection)
+            if not reused:
+                raise e.error
+            # The provider closed the idle connection, so retry once on a new one
+            connection = await self.new_connection(host)
+            try:
+                status, will_close, data = await self.send(connection, method, request_bytes)
+            except StaleConnection as e:
+                self.close_connection(connection)
+                raise e.error
+            except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+                self.close_connection(connection)
+                raise
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError, ValueError):
+            # Anything else, such as a timeout or a response cut short, may come after the
+            # provider took the request, so sending it again could send a text twice
+            self.close_connection(connection)
+            raise
+
+        if will_close:
+            self.close_connection(connection)
+        else:
+            self.return_connection(host, connection)
+        if status >= 400:
+            raise IOError("{} {} returned HTTP status {}".format(method, split_url.hostname, status))
+        return data
+
+    def request_bytes(self, method, path, body, headers):
+        headers = dict(headers)
+        headers['Content-Length'] = str(len(body or b''))
+        lines = ["{} {} HTTP/1.1".format(method, path)]
+        lines.extend("{}: {}".format(name, value) for name, value in headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode('latin1') + (body or b'')
+
+    async def send(self, connection, method, request_bytes):
+        """Returns (status, will_close, body) for the response to one request."""
+        reader, writer = connection
+        try:
+            writer.write(request_bytes)
+            await asyncio.wait_for(writer.drain(), self.timeout)
+        except (ConnectionResetError, BrokenPipeError, ConnectionAbortedError) as e:
+            raise StaleConnection(e)
+        try:
+            return await asyncio.wait_for(self.read_response(reader), self.timeout)
+        except RemoteDisconnected as e:
+            # The whole request was written, so the provider may have taken a send before closing it
+            if method in IDEMPOTENT_METHODS:
+                raise StaleConnection(e)
+            raise
+
+    async def read_response(self, reader):
+        status_line = await reader.readline()
+        if not status_line:
+            raise RemoteDisconnected("Connection closed before a response was received")
+        version, status = status_line.decode('latin1').split()[:2]
+
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        will_close = headers.get('connection', '').lower() == 'close' or version == 'HTTP/1.0'
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            data = await self.read_chunked(reader)
+        elif 'content-length' in headers:
+            data = await reader.readexactly(int(headers['content-length']))
+        else:
+            data = await reader.read()
+            will_close = True
+        return int(status), will_close, data
+
+    async def read_chunked(self, reader):
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if size == 0:
+                # Skip any trailers up to the blank line ending the response
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                return b''.join(chunks)
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+
+    async def take_connection(self, host):
+        idle = self.idle_connections.get(host)
+        if idle:
+            return idle.pop(), True
+        return await self.new_connection(host), False
+
+    def return_connection(self, host, connection):
+        idle = self.idle_connections.setdefault(host, [])
+        if len(idle) < self.pool_size:
+            idle.append(connection)
+            return
+        self.close_connection(connection)
+
+    async def new_connection(self, host):
+        scheme, hostname, port = host
+        self.connections_opened += 1
+        ssl_context = ssl.create_default_context() if scheme == "https" else None
+        return await asyncio.wait_for(asyncio.open_connection(hostname, port, ssl=ssl_context), self.timeout)
+
+    def close_connection(self, connection):
+        _, writer = connection
+        writer.close()
+
+    def close(self):
+        idle_connections, self.idle_connections = self.idle_connections, {}
+        for idle in idle_connections.values():
+            for connection in idle:
+                self.close_connection(connection)
@@ -0,0 +1,45 @@
+"""asyncio facade over AsyncTextLocal, so a job can overlap inbox reads, outbox history reads
+and sends in one event loop instead of waiting on each request in turn. Python 3 only."""
+import asyncio
+
+from cshsms.settings import TEXTLOCAL_API, TEXTLOCAL_PRIMARY_ID, TEXTLOCAL_SENDERNAME, SMS_SEND_CONCURRENCY
+from modules import providers
+from modules.async_textlocalwrapper import AsyncTextLocal
+
+
+class AsyncTexter(object):
+    def __init__(self, textlocal=None, concurrency=SMS_SEND_CONCURRENCY):
+        self.textlocal = textlocal or AsyncTextLocal(apikey=TEXTLOCAL_API,
+                                                     primary_id=TEXTLOCAL_PRIMARY_ID,
+                                                     sendername=TEXTLOCAL_SENDERNAME,
+                                                     rate_limiter=providers.rate_limiter("textlocal"))
+        self.concurrency = concurrency
+
+    async def read_inbox(self, cursor=None):
+        if cursor is not None:
+            return await self.textlocal.new_messages_by_number_after(cursor)
+        return await self.textlocal.new_messages_by_number()
+
+    async def read_api_outbox(self):
+        return await self.textlocal.new_api_send_messages_by_number()
+
+    async def read_inbox_and_outbox(self):
+        """Reads both at once. Returns (inbox, outbox) message dicts."""
+        return tuple(await asyncio.gather(self.read_inbox(), self.read_api_outbox()))
+
+    async def send(self, message, phone_number):
+        return await self.textlocal.send_message(message=message, phone_numbers=phone_number)
+
+    async def send_many(self, messages):
+        """Sends (message, phone_number) pairs, at most `concurrency` requests at a time.
+            Returns the send statuses in the same order."""
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send_one(message, phone_number):
+            async with semaphore:
+                return await self.send(message=message, phone_number=phone_number)
+
+        return await asyncio.gather(*[send_one(message, phone_number) for message, phone_number in messages])
+
+    def close(self):
+        self.textlocal.http.close()
@@ -0,0 +1,44 @@
+"""asyncio variant of the TextLocal wrapper. Python 3 only."""
+import asyncio
+import json
+
+from modules.async_http_client import AsyncConnectionPool
+from modules.textlocalwrapper import TextLocal
+
+
+class AsyncTextLocal(TextLocal):
+    """TextLocal whose requests are coroutines. The request building and message parsing are
+        inherited, so `get_primary_inbox`, `get_api_send_history`, `send_message` and
+        `send_bulk_messages` must all be awaited."""
+    def __init__(self, apikey, primary_id, sendername, api_url="https://api.textlocal.in/", http=None, rate_limiter=None):
+        super(AsyncTextLocal, self).__init__(apikey=apikey,
+                                             primary_id=primary_id,
+                                             sendername=sendername,
+                                             api_url=api_url,
+                                             http=http or AsyncConnectionPool(),
+                                             rate_limiter=rate_limiter)
+
+    async def get_url_response(self, request_url, params):
+        return json.loads((await self.http.get(request_url, params)).decode('latin1'))
+
+    async def post_url_response(self, request_url, params):
+        if self.rate_limiter:
+            # Wait without blocking the event loop
+            await asyncio.sleep(self.rate_limiter.reserve())
+        return json.loads((await self.http.post(request_url, params)).decode('latin1'))
+
+    async def get_primary_inbox_messages(self, min_time=None):
+        return (await self.get_primary_inbox(min_time=min_time))['messages']
+
+    async def get_api_send_history_messages(self):
+        return (await self.get_api_send_history())['messages']
+
+    async def new_messages_by_number(self):
+        return self.inbox_messages_by_number(await self.get_primary_inbox_messages())
+
+    async def new_messages_by_number_after(self, cursor):
+        return self.inbox_messages_after(await self.get_primary_inbox_messages(min_time=self.inbox_min_time(cursor)),
+                                         cursor)
+
+    async def new_api_send_messages_by_number(self):
+        return self.api_send_messages_by_number(await self.get_api_send_history_messages())
@@ -0,0 +1,132 @@
+from django.db.models import Prefetch
+
+from management.models import ArchivedMessage, Contact, Message, MessageSummary, message_body_key
+from modules.utils import add_to_groups, groups_by_name
+
+# Most phone numbers looked up in one query, keeping under SQLite's limit on query parameters
+PHONE_NUMBER_CHUNK_SIZE = 500
+
+
+class ContactCache(object):
+    """The contacts touched by one processing run. Each phone number's contacts are loaded once,
+        and the same instances are handed out for the rest of the run, so a step sees the changes
+        earlier steps made without going back to the database. TextProcessor writes a text's changes
+        together, when it stores the text or its reply. With `prefetch`, each contact's groups and
+        outgoing messages are loaded alongside it, for runs that subscribe many numbers at once."""
+    def __init__(self, phone_numbers=(), prefetch=False):
+        self.prefetch = prefetch
+        self.loaded_numbers = set()
+        self.by_number = {}
+        self.by_pk = {}
+        self.groups = {}
+        self.created_pks = set()
+        self.load(phone_numbers)
+
+    def contacts(self):
+        contacts = Contact.objects.select_related('message_summary')
+        if self.prefetch:
+            contacts = contacts.prefetch_related(
+                Prefetch('group_set', to_attr='cached_groups'),
+                Prefetch('message_set', queryset=Message.objects.filter(direction="Outgoing")
+                                                                .only('contact', 'body', 'direction'),
+                         to_attr='cached_outgoing_messages'))
+        return contacts
+
+    def load(self, phone_numbers):
+        missing = list(set(phone_numbers) - self.loaded_numbers)
+        for start in range(0, len(missing), PHONE_NUMBER_CHUNK_SIZE):
+            for contact in self.contacts().filter(phone_number__in=missing[start:start + PHONE_NUMBER_CHUNK_SIZE]):
+                self.add(contact)
+        self.loaded_numbers.update(missing)
+
+    def load_for_messages(self, messages):
+        """Loads every contact sharing a number with the messages' contacts in one query,
+            and points each message at its cached contact."""
+        contact_ids = set(message.contact_id for message in messages) - set(self.by_pk)
+        if contact_ids:
+            senders = Contact.objects.filter(pk__in=contact_ids).values('phone_number')
+            for contact in self.contacts().filter(phone_number__in=senders):
+                self.add(contact)
+                self.loaded_numbers.add(contact.phone_number)
+        for message in messages:
+            message.contact = self.get(message.contact_id)
+
+    def for_number(self, phone_number):
+        """The number's contacts, ordered by name like Contact's default ordering."""
+        self.load([phone_number])
+        return self.by_number.get(phone_number, [])
+
+    def find(self, name, phone_number):
+        return next((contact for contact in self.for_number(phone_number) if contact.name == name), None)
+
+    def get(self, pk):
+        if pk not in self.by_pk:
+            self.add(self.contacts().get(pk=pk))
+        return self.by_pk[pk]
+
+    def add(self, contact):
+        """Starts handing out `contact`, which must be saved, unless it's already cached."""
+        if contact.pk in self.by_pk:
+            return self.by_pk[contact.pk]
+        self.by_pk[contact.pk] = contact
+        contacts = self.by_number.setdefault(contact.phone_number, [])
+        contacts.append(contact)
+        contacts.sort(key=lambda cached: (cached.name, cached.pk))
+        return contact
+
+    def created(self, contact):
+        """Starts handing out a contact saved during the run, which has no groups or messages yet."""
+        if self.prefetch:
+            contact.cached_groups = []
+            contact.cached_outgoing_messages = []
+        self.created_pks.add(contact.pk)
+        return self.add(contact)
+
+    def reload(self, phone_number):
+        """Forgets the number's contacts, e.g. after rolling back changes made to them."""
+        for contact in self.by_number.pop(phone_number, []):
+            del self.by_pk[contact.pk]
+        self.loaded_numbers.discard(phone_number)
+        # The rollback may also have undone creating a group
+        self.groups = {}
+
+    def groups_named(self, group_names):
+        missing = [name for name in group_names if name not in self.groups]
+        if missing:
+            self.groups.update(groups_by_name(missing))
+        return [self.groups[name] for name in group_names]
+
+    def add_to_groups(self, contact, group_names):
+        groups = self.groups_named(group_names)
+        cached_groups = getattr(contact, 'cached_groups', None)
+        if cached_groups is not None:
+            groups = [group for group in groups if group not in cached_groups]
+            cached_groups.extend(groups)
+        add_to_groups([(contact, group) for group in groups])
+        return groups
+
+    def was_sent(self, contact, body):
+        """Whether `contact` has been sent a text saying `body`, even one since archived."""
+        outgoing = getattr(contact, 'cached_outgoing_messages', None)
+        if outgoing is None:
+            sent = Message.objects.filter(contact=contact, direction="Outgoing",
+                                          body_key=message_body_key(body), body=body).exists()
+        else:
+            sent = any(message.body == body for message in outgoing)
+        return sent or (self.has_archived_outgoing(contact) and
+                        ArchivedMessage.objects.filter(contact=contact, direction="Outgoing",
+                                                       body_key=message_body_key(body), body=body).exists())
+
+    def has_archived_outgoing(self, contact):
+        if contact.pk in self.created_pks:
+            return False
+        try:
+            return contact.message_summary.outgoing_count > 0
+        except MessageSummary.DoesNotExist:
+            return False
+
+    def sent(self, message):
+        """Records an outgoing message to a cached contact, keeping the prefetched messages current."""
+        outgoing = getattr(message.contact, 'cached_outgoing_messages', None)
+        if outgoing is not None:
+            outgoing.append(message)
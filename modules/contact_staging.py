@@ -0,0 +1,137 @@
+"""The PostgreSQL engine for contact uploads. Parsed rows are streamed into a temporary staging table
+with COPY, then merged into the contact table, their groups and their reminders with a few set based
+statements, all in one transaction. The staging and merge tables are dropped once the merge is done."""
+from itertools import chain
+
+import six
+from django.db import connection, transaction
+
+from management.models import Contact, Group, ScheduledReminder
+from modules.text_reminder import reminder_due_dates
+from modules.utils import chunks, groups_by_name
+
+# Rows sent to the database per COPY
+COPY_CHUNK_SIZE = 10000
+
+
+def copy_value(value):
+    """Formats a value for COPY's text format."""
+    if value is None:
+        return "\\N"
+    return six.text_type(value).replace("\\", "\\\\").replace("\t", "\\t") \
+                               .replace("\n", "\\n").replace("\r", "\\r")
+
+
+def staging_rows(fields, entries):
+    """One COPY line per (contact dict, groups string) entry, numbered so later rows win."""
+    for row_number, (new_dict, groups_string) in enumerate(entries):
+        values = [field.get_db_prep_save(field.to_python(new_dict[field.name]), connection) for field in fields]
+        yield "\t".join(copy_value(value) for value in values + [row_number, groups_string]) + "\n"
+
+
+def copy_upsert(entries):
+    """Creates or updates the contact for each (contact dict, groups string) entry, matched on name
+        and phone number like upsert_contacts, and adds it to the groups. Returns how many rows were staged."""
+    entries = iter(entries)
+    first = next(entries, None)
+    if first is None:
+        return 0
+    fields = [Contact._meta.get_field(name) for name in sorted(first[0])]
+    columns = [connection.ops.quote_name(field.column) for field in fields]
+    group_names = set()
+
+    def grouped(entries):
+        for new_dict, groups_string in entries:
+            if groups_string:
+                group_names.update(groups_string.split(", "))
+            yield new_dict, groups_string
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE contact_staging ON COMMIT DROP AS "
+                       "SELECT {} FROM {} WITH NO DATA".format(", ".join(columns), Contact._meta.db_table))
+        cursor.execute("ALTER TABLE contact_staging ADD COLUMN row_number bigint, ADD COLUMN groups text")
+        staged = 0
+        for chunk in chunks(staging_rows(fields, grouped(chain([first], entries))), COPY_CHUNK_SIZE):
+            cursor.copy_expert("COPY contact_staging ({}, row_number, groups) FROM STDIN".format(", ".join(columns)),
+                               six.StringIO(u"".join(chunk)))
+            staged += len(chunk)
+        cursor.execute("ANALYZE contact_staging")
+
+        merge_contacts(cursor, fields, columns)
+        reschedule_merged_contacts(cursor)
+        if group_names:
+            add_staged_contacts_to_groups(cursor, group_names)
+        # ON COMMIT DROP only covers an upload that is not inside an outer transaction
+        cursor.execute("DROP TABLE contact_merge, contact_staging")
+    return staged
+
+
+def merge_contacts(cursor, fields, columns):
+    # The last staged row for each name and phone number, matched to the oldest contact with them
+    cursor.execute("""
+        CREATE TEMPORARY TABLE contact_merge ON COMMIT DROP AS
+        SELECT DISTINCT ON (s.name, s.phone_number) s.*, c.id AS contact_id, c.id IS NULL AS created,
+               (c.date_of_birth, c.preg_signup) IS DISTINCT FROM (s.date_of_birth, s.preg_signup) AS reschedule
+        FROM contact_staging s
+        LEFT JOIN {contact} c ON c.name = s.name AND c.phone_number = s.phone_number
+        ORDER BY s.name, s.phone_number, s.row_number DESC, c.id
+    """.format(contact=Contact._meta.db_table))
+    cursor.execute("UPDATE contact_merge SET contact_id = nextval(pg_get_serial_sequence(%s, 'id')) WHERE created",
+                   [Contact._meta.db_table])
+
+    cursor.execute("""
+        UPDATE {contact} c SET {assignments}
+        FROM contact_merge m
+        WHERE c.id = m.contact_id AND NOT m.created AND ({current}) IS DISTINCT FROM ({staged})
+    """.format(contact=Contact._meta.db_table,
+               assignments=", ".join("{0} = m.{0}".format(column) for column in columns),
+               current=", ".join("c." + column for column in columns),
+               staged=", ".join("m." + column for column in columns)))
+
+    # New contacts get the model's defaults for the fields the upload does not set
+    template = Contact()
+    defaults = [field for field in Contact._meta.concrete_fields if not field.primary_key and field not in fields]
+    cursor.execute("""
+        INSERT INTO {contact} (id, {columns})
+        SELECT contact_id, {staged} FROM contact_merge WHERE created
+    """.format(contact=Contact._meta.db_table,
+               columns=", ".join(columns + [connection.ops.quote_name(field.column) for field in defaults]),
+               staged=", ".join(columns + ["%s"] * len(defaults))),
+                   [field.get_db_prep_save(field.pre_save(template, True), connection) for field in defaults])
+
+
+def reschedule_merged_contacts(cursor):
+    # The contacts that were created, or whose date of birth or pregnancy sign up changed
+    cursor.execute("""
+        DELETE FROM {reminder} WHERE contact_id IN (SELECT contact_id FROM contact_merge WHERE reschedule AND NOT created)
+    """.format(reminder=ScheduledReminder._meta.db_table))
+    cursor.execute("SELECT contact_id, date_of_birth, preg_signup FROM contact_merge WHERE reschedule")
+    # Most children in a large upload share their birthday with others
+    due_dates = {}
+    for chunk in chunks(cursor.fetchall(), COPY_CHUNK_SIZE):
+        lines = []
+        for pk, date_of_birth, preg_signup in chunk:
+            if date_of_birth is None:
+                continue
+            if (date_of_birth, preg_signup) not in due_dates:
+                due_dates[(date_of_birth, preg_signup)] = reminder_due_dates(date_of_birth, preg_signup)
+            lines.extend(u"{}\t{}\t{}\n".format(pk, due_date, kind)
+                         for kind, due_date in due_dates[(date_of_birth, preg_signup)])
+        cursor.copy_expert("COPY {} (contact_id, due_date, kind) FROM STDIN".format(ScheduledReminder._meta.db_table),
+                           six.StringIO(u"".join(lines)))
+
+
+def add_staged_contacts_to_groups(cursor, group_names):
+    groups_by_name(group_names)
+    through = Group.contacts.through
+    cursor.execute("""
+        INSERT INTO {through} ({group_id}, {contact_id})
+        SELECT DISTINCT g.id, m.contact_id
+        FROM contact_staging s
+        CROSS JOIN LATERAL unnest(string_to_array(s.groups, ', ')) AS group_name
+        JOIN {group} g ON g.name = group_name
+        JOIN contact_merge m ON m.name = s.name AND m.phone_number = s.phone_number
+        WHERE NOT EXISTS (SELECT 1 FROM {through} t WHERE t.{group_id} = g.id AND t.{contact_id} = m.contact_id)
+    """.format(through=through._meta.db_table, group=Group._meta.db_table,
+               group_id=Group.contacts.field.m2m_column_name(),
+               contact_id=Group.contacts.field.m2m_reverse_name()))
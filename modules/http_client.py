@@ -0,0 +1,137 @@
+import errno
+import socket
+import threading
+
+from six.moves import http_client
+from six.moves.urllib import parse
+
+from cshsms.settings import SMS_HTTP_POOL_SIZE, SMS_HTTP_TIMEOUT
+
+# Avoid triggering bot errors by setting a user agent
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.95 Safari/537.36'
+
+# Socket errors writing a request to a keep-alive connection the provider has already closed
+CLOSED_CONNECTION_ERRNOS = (errno.ECONNRESET, errno.EPIPE, errno.ECONNABORTED)
+# Requests that are safe to send again even if the provider may have taken them
+IDEMPOTENT_METHODS = ("GET", "HEAD")
+
+
+class StaleConnection(Exception):
+    """Raised by ConnectionPool.send when a request is safe to send again on a new connection:
+        the provider had closed the connection before it could take the request, or the
+        request is idempotent and the connection closed without a response."""
+    def __init__(self, error):
+        super(StaleConnection, self).__init__(str(error))
+        self.error = error
+
+
+class ConnectionPool(object):
+    """Keeps up to `pool_size` keep-alive connections open per host, so the TCP and TLS
+        handshakes are paid once per run rather than once per request."""
+    def __init__(self, pool_size=SMS_HTTP_POOL_SIZE, timeout=SMS_HTTP_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.idle_connections = {}
+        self.requests_made = 0
+        self.connections_opened = 0
+
+    def get(self, url, params=None):
+        if params:
+            url = url + parse.urlencode(params)
+        return self.request("GET", url)
+
+    def post(self, url, params):
+        return self.request("POST", url, body=parse.urlencode(params).encode('utf-8'),
+                            headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+    def request(self, method, url, body=None, headers=None):
+        """Returns the body of the response as bytes."""
+        split_url = parse.urlsplit(url)
+        host = (split_url.scheme, split_url.hostname, split_url.port)
+        path = (split_url.path or "/") + ("?" + split_url.query if split_url.query else "")
+        request_headers = {'User-Agent': USER_AGENT}
+        request_headers.update(headers or {})
+
+        with self.lock:
+            self.requests_made += 1
+        connection, reused = self.take_connection(host)
+        try:
+            response = self.send(connection, method, path, body, request_headers)
+        except StaleConnection as e:
+            connection.close()
+            if not reused:
+                raise e.error
+            # The provider closed the idle connection, so retry once on a new one
+            connection = self.new_connection(host)
+            try:
+                response = self.send(connection, method, path, body, request_headers)
+            except StaleConnection as e:
+                connection.close()
+                raise e.error
+            except (http_client.HTTPException, socket.error):
+                connection.close()
+                raise
+        except (http_client.HTTPException, socket.error):
+            # Anything else, such as a timeout waiting for the response, may come after the
+            # provider took the request, so sending it again could send a text twice
+            connection.close()
+            raise
+        data = response.read()
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.return_connection(host, connection)
+        if response.status >= 400:
+            raise IOError("{} {} returned HTTP status {}".format(method, split_url.hostname, response.status))
+        return data
+
+    def send(self, connection, method, path, body, headers):
+        try:
+            connection.request(method, path, body=body, headers=headers)
+        except socket.error as e:
+            if e.errno in CLOSED_CONNECTION_ERRNOS:
+                raise StaleConnection(e)
+            raise
+        try:
+            return connection.getresponse()
+        except http_client.BadStatusLine as e:
+            # Including Python 3's RemoteDisconnected: the connection closed without a byte of response.
+            # The whole request was written, so the provider may have taken a send before closing it.
+            if method in IDEMPOTENT_METHODS:
+                raise StaleConnection(e)
+            raise
+
+    def take_connection(self, host):
+        with self.lock:
+            idle = self.idle_connections.get(host)
+            if idle:
+                return idle.pop(), True
+        return self.new_connection(host), False
+
+    def return_connection(self, host, connection):
+        with self.lock:
+            idle = self.idle_connections.setdefault(host, [])
+            if len(idle) < self.pool_size:
+                idle.append(connection)
+                return
+        connection.close()
+
+    def new_connection(self, host):
+        scheme, hostname, port = host
+        with self.lock:
+            self.connections_opened += 1
+        if scheme == "https":
+            return http_client.HTTPSConnection(hostname, port, timeout=self.timeout)
+        return http_client.HTTPConnection(hostname, port, timeout=self.timeout)
+
+    def close(self):
+        with self.lock:
+            idle_connections, self.idle_connections = self.idle_connections, {}
+        for idle in idle_connections.values():
+            for connection in idle:
+                connection.close()
+
+
+shared_pool = ConnectionPool()
@@ -0,0 +1,70 @@
+"""Unprocessed incoming messages double as a work queue. Workers claim batches of them with
+SELECT ... FOR UPDATE SKIP LOCKED, so any number of workers can share the queue without two
+of them processing the same text, and one slow provider call only holds up its own batch."""
+import logging
+import time
+
+from django.db import close_old_connections, transaction
+from django.db.models import F
+
+from cshsms.settings import INBOUND_WORKER_BATCH_SIZE, INBOUND_WORKER_POLL_INTERVAL, INBOUND_MAX_ATTEMPTS
+from management.models import Message
+from modules.contact_cache import ContactCache
+from modules.text_processor import TextProcessor
+from modules.utils import quote
+
+
+def queued_messages():
+    return Message.objects.filter(direction="Incoming",
+                                  is_processed=False,
+                                  processing_attempts__lt=INBOUND_MAX_ATTEMPTS)
+
+
+def process_batch(batch_size=INBOUND_WORKER_BATCH_SIZE):
+    """Claims up to `batch_size` queued messages, oldest first, and processes them in one transaction.
+        Returns how many were processed or failed."""
+    handled = 0
+    with transaction.atomic():
+        batch = list(queued_messages().select_for_update(skip_locked=True)
+                                      .order_by('received_at', 'id')[:batch_size])
+        contacts = ContactCache()
+        contacts.load_for_messages(batch)
+        for message in batch:
+            if waiting_on_earlier_message(message):
+                continue
+            process_message(message, contacts)
+            handled += 1
+    return handled
+
+
+def waiting_on_earlier_message(message):
+    # Texts from a number are answered in the order they arrived, so a JOIN is handled before its END
+    return queued_messages().filter(contact__phone_number=message.contact.phone_number,
+                                    received_at__lt=message.received_at).exists()
+
+
+def process_message(message, contacts=None):
+    try:
+        with transaction.atomic():
+            TextProcessor(message.contact.phone_number, contacts=contacts).process(message)
+    except Exception as e:
+        if contacts:
+            # The rollback undid any changes to the number's cached contacts
+            contacts.reload(message.contact.phone_number)
+        logging.error("Failed to process message " + quote(message.body) + " from " +
+                      quote(message.contact.phone_number) + ": " + str(e))
+        Message.objects.filter(pk=message.pk).update(processing_attempts=F('processing_attempts') + 1)
+
+
+def run_worker(batch_size=INBOUND_WORKER_BATCH_SIZE, poll_interval=INBOUND_WORKER_POLL_INTERVAL, once=False):
+    """Processes batches until stopped, waiting `poll_interval` seconds whenever the queue is empty.
+        With `once`, returns as soon as the queue is empty instead. Returns how many messages were handled."""
+    total = 0
+    while True:
+        close_old_connections()
+        handled = process_batch(batch_size=batch_size)
+        total += handled
+        if not handled:
+            if once:
+                return total
+            time.sleep(poll_interval)
@@ -0,0 +1,54 @@
+"""Keeps the Message table to recent texts. Older ones move to ArchivedMessage, and each contact's
+MessageSummary keeps count of what was moved, so the queries made while processing texts stay small."""
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count, Max, Min
+from django.utils import timezone
+
+from cshsms.settings import MESSAGE_ARCHIVE_AFTER_DAYS, MESSAGE_ARCHIVE_BATCH_SIZE
+from management.models import ArchivedMessage, Message, MessageSummary
+
+ARCHIVED_FIELDS = ('id', 'contact_id', 'body', 'body_key', 'direction', 'is_processed',
+                   'created_at', 'received_at', 'sent_at', 'provider_key')
+
+
+def archivable_messages(cutoff):
+    # Incoming texts still waiting to be processed stay where the inbound queue looks for them
+    return Message.objects.filter(created_at__lt=cutoff) \
+                          .exclude(direction="Incoming", is_processed=False)
+
+
+def archive_messages(days=MESSAGE_ARCHIVE_AFTER_DAYS, batch_size=MESSAGE_ARCHIVE_BATCH_SIZE):
+    """Moves messages created more than `days` days ago to the archive, `batch_size` at a time,
+        each batch in its own transaction. Returns how many were moved."""
+    cutoff = timezone.now() - timedelta(days=days)
+    archived = 0
+    while True:
+        with transaction.atomic():
+            batch = list(archivable_messages(cutoff).order_by('id').values(*ARCHIVED_FIELDS)[:batch_size])
+            if not batch:
+                return archived
+            ArchivedMessage.objects.bulk_create([ArchivedMessage(**message) for message in batch])
+            add_to_summaries(batch)
+            Message.objects.filter(pk__in=[message['id'] for message in batch]).delete()
+        archived += len(batch)
+
+
+def add_to_summaries(batch):
+    ids = [message['id'] for message in batch]
+    totals = list(Message.objects.filter(pk__in=ids, contact__isnull=False)
+                                 .order_by().values('contact_id', 'direction')
+                                 .annotate(count=Count('id'), first=Min('created_at'), last=Max('created_at')))
+    summaries = {summary.contact_id: summary for summary in
+                 MessageSummary.objects.filter(contact_id__in=set(total['contact_id'] for total in totals))}
+    for total in totals:
+        summary = summaries.setdefault(total['contact_id'], MessageSummary(contact_id=total['contact_id']))
+        if total['direction'] == "Incoming":
+            summary.incoming_count += total['count']
+        else:
+            summary.outgoing_count += total['count']
+        summary.first_message_at = min(filter(None, [summary.first_message_at, total['first']]))
+        summary.last_message_at = max(filter(None, [summary.last_message_at, total['last']]))
+    for summary in summaries.values():
+        summary.save()
@@ -0,0 +1,63 @@
+"""Process-wide SMS provider clients. Each provider wrapper is created once, on first use,
+together with its own connection pool and rate limiter, and then shared by every caller in the process."""
+import threading
+
+from cshsms.settings import TEXTLOCAL_API, TEXTLOCAL_PRIMARY_ID, TEXTLOCAL_SENDERNAME, \
+                            HSPSMS_API, HSPSMS_USERNAME, HSPSMS_SENDERNAME, SMS_RATE_LIMITS
+from modules.http_client import ConnectionPool
+from modules.rate_limiter import TokenBucket
+from modules.textlocalwrapper import TextLocal
+from modules.hspsmswrapper import Hspsms
+
+# Reentrant, since creating a client also creates its rate limiter
+lock = threading.RLock()
+clients = {}
+rate_limiters = {}
+
+
+def get_client(name, create):
+    with lock:
+        if name not in clients:
+            clients[name] = create()
+        return clients[name]
+
+
+def rate_limiter(name):
+    """The provider's token bucket, shared by its blocking and asyncio clients."""
+    with lock:
+        if name not in rate_limiters:
+            rate_limiters[name] = TokenBucket(**SMS_RATE_LIMITS[name])
+        return rate_limiters[name]
+
+
+def textlocal():
+    return get_client("textlocal", lambda: TextLocal(apikey=TEXTLOCAL_API,
+                                                     primary_id=TEXTLOCAL_PRIMARY_ID,
+                                                     sendername=TEXTLOCAL_SENDERNAME,
+                                                     http=ConnectionPool(),
+                                                     rate_limiter=rate_limiter("textlocal")))
+
+
+def hspsms():
+    return get_client("hspsms", lambda: Hspsms(apikey=HSPSMS_API,
+                                               username=HSPSMS_USERNAME,
+                                               sendername=HSPSMS_SENDERNAME,
+                                               http=ConnectionPool(),
+                                               rate_limiter=rate_limiter("hspsms")))
+
+
+def stats():
+    with lock:
+        return {name: {"requests_made": client.http.requests_made,
+                       "connections_opened": client.http.connections_opened,
+                       "rate_limit_waits": client.rate_limiter.waits,
+                       "seconds_waited_for_rate_limit": round(client.rate_limiter.seconds_waited, 3)}
+                for name, client in clients.items()}
+
+
+def close_all():
+    with lock:
+        for client in clients.values():
+            client.http.close()
+        clients.clear()
+        rate_limiters.clear()
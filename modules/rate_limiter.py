@@ -0,0 +1,41 @@
+import threading
+import time
+
+# time.time can jump (and is frozen by freezegun in tests), so prefer the monotonic clock where there is one
+clock = getattr(time, 'monotonic', time.time)
+
+
+class TokenBucket(object):
+    """Allows `rate` requests per second on average, and up to `burst` at once. Thread-safe, so
+        one bucket can be shared by every sender using a provider."""
+    def __init__(self, rate, burst=None, clock=clock, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = burst or rate
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.tokens = float(self.burst)
+        self.updated_at = clock()
+        self.waits = 0
+        self.seconds_waited = 0.0
+
+    def reserve(self, tokens=1):
+        """Takes the tokens, going into debt if there aren't enough, and returns how many seconds the
+            caller must wait before using them. Callers that can't block, like coroutines, wait themselves."""
+        with self.lock:
+            now = self.clock()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= tokens
+            wait = max(0.0, -self.tokens / self.rate)
+            if wait:
+                self.waits += 1
+                self.seconds_waited += wait
+        return wait
+
+    def acquire(self, tokens=1):
+        """Blocks until the tokens are available. Returns the seconds waited."""
+        wait = self.reserve(tokens)
+        if wait:
+            self.sleep(wait)
+        return wait
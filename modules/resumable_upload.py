@@ -0,0 +1,81 @@
+"""Contact uploads that can be interrupted and run again. Each chunk of rows is committed together
+with the file's UploadCheckpoint, so running the same file again carries on after the last chunk
+that was committed rather than redoing the whole file."""
+import csv
+import hashlib
+import logging
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from cshsms.settings import CSV_UPLOAD_PROCESSES
+from management.models import UploadCheckpoint
+from modules.upload_contacts_from_file import CSV_UPLOAD_CHUNK_SIZE, csv_upload
+
+HASH_BLOCK_SIZE = 1024 * 1024
+PROGRESS_INTERVAL = 10      # Seconds between progress reports
+
+
+def file_hash(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as contents:
+        for block in iter(lambda: contents.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_rows(filepath):
+    # Counted the way csv.DictReader reads them: quoted newlines stay in their row and blank lines are skipped
+    with open(filepath) as csvfile:
+        return max(sum(1 for row in csv.reader(csvfile) if row) - 1, 0)
+
+
+class UploadProgress(object):
+    """Logs how many rows are done, the rate of this run and the time left, at most every `interval` seconds."""
+    def __init__(self, total, start_row=0, interval=PROGRESS_INTERVAL, clock=time.time):
+        self.total = total
+        self.start_row = start_row
+        self.interval = interval
+        self.clock = clock
+        self.started = self.last_report = clock()
+
+    def report(self, rows_done, force=False):
+        now = self.clock()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        rate = (rows_done - self.start_row) / max(now - self.started, 0.001)
+        remaining = timedelta(seconds=int((self.total - rows_done) / rate)) if rate else "unknown"
+        logging.info("Uploaded {} of {} rows ({:.1f}%), {:.0f} rows/s, {} left".format(
+            rows_done, self.total, 100.0 * rows_done / max(self.total, 1), rate, remaining))
+
+
+def resumable_upload(filepath, source, restart=False, chunk_size=CSV_UPLOAD_CHUNK_SIZE,
+                     processes=CSV_UPLOAD_PROCESSES):
+    """Uploads a contact file, resuming an earlier interrupted upload of the same file and source
+        unless `restart`. Returns how many rows this run uploaded."""
+    checkpoint, _ = UploadCheckpoint.objects.get_or_create(file_hash=file_hash(filepath), source=source)
+    if restart:
+        checkpoint.rows_done = 0
+        checkpoint.finished_at = None
+    elif checkpoint.finished_at:
+        logging.info("{} was already uploaded at {}".format(filepath, checkpoint.finished_at))
+        return 0
+    start_row = checkpoint.rows_done
+    total = count_rows(filepath)
+    if start_row:
+        logging.info("Resuming {} at row {} of {}".format(filepath, start_row, total))
+    progress = UploadProgress(total, start_row=start_row)
+
+    def on_chunk(rows_done):
+        checkpoint.rows_done = rows_done
+        checkpoint.save()
+        progress.report(rows_done)
+
+    csv_upload(filepath, source, chunk_size=chunk_size, processes=processes, start_row=start_row, on_chunk=on_chunk)
+    checkpoint.rows_done = total
+    checkpoint.finished_at = timezone.now()
+    checkpoint.save()
+    progress.report(total, force=True)
+    return total - start_row
@@ -1,25 +1,65 @@
+import hashlib
 import logging
 import string
 
+from collections import OrderedDict
 from datetime import datetime
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from django.core.exceptions import MultipleObjectsReturned
 
+from cshsms.settings import PROCESS_INBOUND_IN_WORKERS
 from management.models import Contact, Group, Message
+from modules.contact_cache import ContactCache
 from modules.texter import Texter
-from modules.utils import quote, add_contact_to_group, keywords_without_word
+from modules.utils import quote, keywords_without_word
 from modules.date_helper import date_is_valid, date_string_to_date
 from modules.i18n import msg_subscribe, msg_unsubscribe, msg_placeholder_child, msg_failure, \
                          msg_failed_date, subscribe_keywords, msg_already_sub, hindi_born
 
+# Most provider keys looked up in one query, keeping under SQLite's limit on query parameters
+PROVIDER_KEY_CHUNK_SIZE = 500
+
+
+def incoming_message_key(phone_number, body, received_at):
+    """The inbox doesn't hand us the provider's own message ids, so identify a text by who sent
+        it, when the provider received it and what it says."""
+    text = u"{}|{}|{}".format(phone_number, received_at.isoformat(), body)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def unseen_messages(messages_by_number):
+    """Drops the texts that are already stored and processed from a {phone_number: [(body, received_at)]}
+        inbox dict. A text that was stored but failed while processing is kept, so it is retried."""
+    keys = {incoming_message_key(phone_number, body, received_at)
+            for phone_number, texts in messages_by_number.items()
+            for body, received_at in texts}
+    keys = list(keys)
+    seen = set()
+    for start in range(0, len(keys), PROVIDER_KEY_CHUNK_SIZE):
+        seen.update(Message.objects.filter(provider_key__in=keys[start:start + PROVIDER_KEY_CHUNK_SIZE],
+                                           is_processed=True)
+                                   .values_list('provider_key', flat=True))
+    unseen = {}
+    for phone_number, texts in messages_by_number.items():
+        for body, received_at in texts:
+            if incoming_message_key(phone_number, body, received_at) not in seen:
+                unseen.setdefault(phone_number, []).append((body, received_at))
+    return unseen
+
+
 class TextProcessor(object):
-    def __init__(self, phone_number):
+    def __init__(self, phone_number, contacts=None):
         self.phone_number = phone_number
+        # Pass one ContactCache to every processor in a run to load each number's contacts once
+        self.contact_cache = contacts or ContactCache([phone_number])
+        # Changes to cached contacts, written by save_changes() with one UPDATE per contact
+        self.changed_fields = OrderedDict()
         self.set_language(default=None)
 
     def set_language(self, default):
-        if self.get_contacts().exists():
-            self.language = self.contacts.first().language_preference or default
+        contacts = self.number_contacts()
+        if contacts:
+            self.language = contacts[0].language_preference or default
         else:
             self.language = None
 
@@ -31,27 +71,40 @@ class TextProcessor(object):
             return inferred_language
         return language
 
-    # self.get_contacts() is preferred to self.contact due to triggering a Django DB reload.
     def get_contacts(self):
+        """Queries the database afresh; processing reads the run's contacts through number_contacts()."""
         self.contacts = Contact.objects.filter(phone_number=self.phone_number)
         return self.contacts
 
+    def number_contacts(self):
+        return self.contact_cache.for_number(self.phone_number)
+
+    def change(self, contact, **fields):
+        """Sets fields on a saved contact, to be written by the next save_changes()."""
+        for field, value in fields.items():
+            setattr(contact, field, value)
+        self.changed_fields.setdefault(contact.pk, (contact, set()))[1].update(fields)
+
+    def save_changes(self):
+        changed_fields, self.changed_fields = self.changed_fields, OrderedDict()
+        for contact, fields in changed_fields.values():
+            contact.save(update_fields=sorted(fields))
+
+    def rolled_back(self):
+        """Forgets the number's cached contacts and their unsaved changes after a rollback undid them."""
+        self.changed_fields = OrderedDict()
+        self.contact_cache.reload(self.phone_number)
+
 
     def create_contact(self, child_name, phone_number, date_of_birth, language, preg_update=False):
-        contact = Contact.objects.filter(name=child_name, phone_number=self.phone_number).first()
+        contact = self.contact_cache.find(child_name, self.phone_number)
         if contact:
             if contact.cancelled or preg_update:
                 # Update and resubscribe
-                contact.cancelled = False
-                contact.language_preference = language
-                contact.date_of_birth = date_of_birth
-                contact.functional_date_of_birth = date_of_birth
-                contact.preg_update = preg_update
-                contact.save()
+                self.change(contact, cancelled=False, language_preference=language, date_of_birth=date_of_birth,
+                            functional_date_of_birth=date_of_birth, preg_update=preg_update)
                 return True
-            elif Message.objects.filter(contact=contact,
-                                        direction="Outgoing",
-                                        body=msg_subscribe(language).format(name=contact.name)).exists():
+            elif self.contact_cache.was_sent(contact, msg_subscribe(language).format(name=contact.name)):
                 # Already exists (error)
                 logging.error("Contact for {name} at {phone} was subscribed but already exists!".format(name=child_name, phone=self.phone_number))
                 return False
@@ -62,21 +115,22 @@ class TextProcessor(object):
                        "date_of_birth": date_of_birth,
                        "functional_date_of_birth": date_of_birth,
                        "method_of_sign_up": "Text"}
-        contact, _ = Contact.objects.update_or_create(name=child_name,
-                                                      phone_number=phone_number,
-                                                      defaults=update_dict)
-        for group_name in ["Text Sign Ups",
-                           "Text Sign Ups - " + self.language.title(),
-                           "Everyone - " + self.language.title()]:
-            add_contact_to_group(contact, group_name)
-        self.get_contacts()
+        contact = self.contact_cache.find(child_name, phone_number)
+        if contact is None:
+            contact = Contact(name=child_name, phone_number=phone_number, **update_dict)
+            contact.save()
+            self.contact_cache.created(contact)
+        else:
+            self.change(contact, **update_dict)
+        self.contact_cache.add_to_groups(contact, ["Text Sign Ups",
+                                                   "Text Sign Ups - " + self.language.title(),
+                                                   "Everyone - " + self.language.title()])
         return True
 
 
     def cancel_contacts(self):
-        for contact in self.contacts:
-            contact.cancelled = True
-            contact.save()
+        for contact in self.number_contacts():
+            self.change(contact, cancelled=True)
         return True
 
 
@@ -92,8 +146,8 @@ class TextProcessor(object):
 
 
     def process_unsubscribe(self, child_name, date_of_birth, preg_update=False):
-        if self.contacts.exists():
-            contact = self.get_contacts().first()
+        if self.number_contacts():
+            contact = self.number_contacts()[0]
             if contact.name is None or contact.date_of_birth is None or contact.language_preference is None:
                 logging.error(quote(self.phone_number) + " asked to be unsubscribed but some data is missing on the existing contact object.")
             self.cancel_contacts()
@@ -137,30 +191,52 @@ class TextProcessor(object):
                                             inferred_language=inferred_language,
                                             keyword=keyword)
 
-        if not child_name and self.get_contacts():
-            contact = self.get_contacts().first()
-            child_name = contact.name
+        if not child_name and self.number_contacts():
+            child_name = self.number_contacts()[0].name
 
         if child_name:
             child_name = child_name.title()
 
-        incoming = self.create_message_object(child_name=child_name,
-                                              phone_number=self.phone_number,
-                                              language=language,
-                                              body=message,
-                                              direction="Incoming")
-
-        contact = Contact.objects.get(pk=incoming.contact.id)
-        contact.last_heard_from = incoming.created_at
-        incoming.received_at = date
-        incoming.save()
-        contact.save()
-        self.get_contacts()
+        provider_key = incoming_message_key(self.phone_number, message, date) if date else None
+        try:
+            with transaction.atomic():
+                incoming = self.create_message_object(child_name=child_name,
+                                                      phone_number=self.phone_number,
+                                                      language=language,
+                                                      body=message,
+                                                      direction="Incoming",
+                                                      provider_key=provider_key,
+                                                      received_at=date)
+        except IntegrityError:
+            # Already stored, by an overlapping run
+            self.rolled_back()
+            return Message.objects.get(provider_key=provider_key)
+        return incoming
+
+    def receive(self, message, date):
+        """Stores an incoming text, and processes it now unless the inbound workers
+            (`python manage.py process_inbound`) are processing them."""
+        if PROCESS_INBOUND_IN_WORKERS:
+            return self.write_to_database(message=message, date=date)
+        return self.write_and_process(message=message, date=date)
+
+    def write_and_process(self, message, date):
+        """Stores an incoming text and processes it, unless it was already stored and processed."""
+        incoming = self.write_to_database(message=message, date=date)
+        try:
+            with transaction.atomic():
+                # Lock the row, so the webhook and the inbox poll can't both answer the same text
+                incoming = Message.objects.select_for_update().get(pk=incoming.pk)
+                if not incoming.is_processed:
+                    self.process(incoming)
+        except Exception:
+            self.rolled_back()
+            raise
         return incoming
 
     def process(self, message):
         """This is the main function that is run on an message to process it."""
-        contact = Contact.objects.get(pk=message.contact.id)
+        contact = self.contact_cache.get(message.contact_id)
         keyword, child_name, date = self.get_data_from_message(message.body)
         preg_update = False
         if keyword in subscribe_keywords("English"):
@@ -210,32 +286,37 @@ class TextProcessor(object):
                                               language=self.language,
                                               body=response_text_message,
                                               direction="Outgoing")
-        contact = Contact.objects.get(pk=outgoing.contact.id)
-        contact.last_contacted = outgoing.created_at
-        contact.save()
-        self.get_contacts()
         Texter().send(message=response_text_message,
                       phone_number=self.phone_number)
         outgoing.is_processed = True
         outgoing.sent_at = datetime.now().replace(tzinfo=timezone.get_default_timezone())
-        outgoing.save()
+        outgoing.save(update_fields=['is_processed', 'sent_at'])
         message.is_processed = True
-        message.save()
+        message.save(update_fields=['is_processed'])
         return response_text_message
 
-    def create_message_object(self, child_name, phone_number, language, body, direction):
+    def create_message_object(self, child_name, phone_number, language, body, direction, provider_key=None,
+                              received_at=None):
+        """Stores a message to or from the contact, and writes the contact's changes made while
+            processing the text, along with its language and when we last heard from or contacted it."""
         if not child_name or len(child_name) > 50:
             if not language:
                 language = "English"
             child_name = msg_placeholder_child(language)
-        try:
-            contact, _ = Contact.objects.get_or_create(name=child_name,
-                                                       phone_number=phone_number)
-        except MultipleObjectsReturned:
-            contact = Contact.objects.filter(name=child_name,
-                                             phone_number=phone_number).first()
-
-        contact.language_preference = language
-        contact.save()
-        return Message.objects.create(contact=contact, direction=direction, body=body)
+        contact = self.contact_cache.find(child_name, phone_number)
+        if contact is None:
+            contact = Contact(name=child_name, phone_number=phone_number, language_preference=language)
+            contact.save()
+            self.contact_cache.created(contact)
+        elif contact.language_preference != language:
+            self.change(contact, language_preference=language)
+        message = Message.objects.create(contact=contact, direction=direction, body=body, provider_key=provider_key,
+                                         received_at=received_at)
+        if direction == "Outgoing":
+            self.contact_cache.sent(message)
+            self.change(contact, last_contacted=message.created_at)
+        else:
+            self.change(contact, last_heard_from=message.created_at)
+        self.save_changes()
+        return message
         
@@ -1,9 +1,16 @@
 import logging
-from datetime import datetime
+from collections import OrderedDict
+from datetime import date, datetime
+from functools import partial
+from multiprocessing.pool import ThreadPool
 from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
 from django.utils import timezone
 
-from management.models import Message, Contact
+from cshsms.settings import SMS_SEND_CONCURRENCY
+from management.models import Message, Contact, ScheduledReminder, message_body_key
 from modules.texter import Texter
 from modules.utils import quote
 from modules.i18n import six_week_reminder_seven_days, six_week_reminder_one_day, \
@@ -14,9 +21,202 @@ from modules.i18n import six_week_reminder_seven_days, six_week_reminder_one_day
                          five_year_reminder_seven_days, five_year_reminder_one_day, \
                          verify_pregnant_signup_birthdate
 
+# Most reminders sent in one provider request, and so written to the database together
+REMINDER_CHUNK_SIZE = 500
+
+# (reminder, time after birth of the appointment, days before the appointment to remind)
+REMINDER_OFFSETS = [
+    (six_week_reminder_seven_days, relativedelta(weeks=6), 7),
+    (six_week_reminder_one_day, relativedelta(weeks=6), 1),
+    (ten_week_reminder_seven_days, relativedelta(weeks=10), 7),
+    (ten_week_reminder_one_day, relativedelta(weeks=10), 1),
+    (fourteen_week_reminder_seven_days, relativedelta(weeks=14), 7),
+    (fourteen_week_reminder_one_day, relativedelta(weeks=14), 1),
+    (nine_month_reminder_seven_days, relativedelta(months=9), 7),
+    (nine_month_reminder_one_day, relativedelta(months=9), 1),
+    (sixteen_month_reminder_seven_days, relativedelta(months=16), 7),
+    (sixteen_month_reminder_one_day, relativedelta(months=16), 1),
+    (five_year_reminder_seven_days, relativedelta(years=5), 7),
+    (five_year_reminder_one_day, relativedelta(years=5), 1)
+]
+PREGNANCY_CHECK_OFFSETS = [
+    (verify_pregnant_signup_birthdate, relativedelta(weeks=2), 0),
+    (verify_pregnant_signup_birthdate, relativedelta(weeks=4), 0)
+]
+
+
+def reminder_due_dates(date_of_birth, preg_signup=False):
+    """Returns a (kind, due date) pair for every day reminder_targets picks a reminder for a child
+        born on `date_of_birth`, so the schedule agrees with the daily check. Pregnancy sign ups
+        also get asked to confirm the birth date."""
+    offsets = REMINDER_OFFSETS + (PREGNANCY_CHECK_OFFSETS if preg_signup else [])
+    due = OrderedDict()
+    for reminder, time_after_dob, days_before in offsets:
+        estimate = date_of_birth + time_after_dob - relativedelta(days=days_before)
+        # Subtracting months clamps to the end of the shorter month, so the days reminder_targets
+        # maps to this date of birth can be up to three days either side of the estimate, or none
+        spread = 3 if time_after_dob.months or time_after_dob.years else 0
+        for shift in range(-spread, spread + 1):
+            day = estimate + relativedelta(days=shift)
+            if day - time_after_dob + relativedelta(days=days_before) == date_of_birth:
+                # Earlier entries win, as in reminder_targets
+                due.setdefault(day, reminder.__name__)
+    return [(kind, day) for day, kind in due.items()]
+
+
+def schedule_reminders(contact):
+    ScheduledReminder.objects.filter(contact=contact).delete()
+    if not isinstance(contact.date_of_birth, date):
+        return []
+    return ScheduledReminder.objects.bulk_create(
+        [ScheduledReminder(contact=contact, due_date=due_date, kind=kind)
+         for kind, due_date in reminder_due_dates(contact.date_of_birth, contact.preg_signup)])
+
+
+def schedule_created_contacts(contacts):
+    """Schedules the reminders of contacts created with bulk_create, which skips post_save, in one insert."""
+    return ScheduledReminder.objects.bulk_create(
+        [ScheduledReminder(contact=contact, due_date=due_date, kind=kind)
+         for contact in contacts if isinstance(contact.date_of_birth, date)
+         for kind, due_date in reminder_due_dates(contact.date_of_birth, contact.preg_signup)])
+
+
+def reminder_targets(day):
+    """Maps each date of birth that is due a reminder on `day` to that reminder. Returns
+        the regular reminders and the pregnancy sign up checks separately, since the
+        latter only apply to contacts that have not confirmed the birth yet."""
+    targets = []
+    for offsets in [REMINDER_OFFSETS, PREGNANCY_CHECK_OFFSETS]:
+        target_dates = {}
+        for reminder, time_after_dob, days_before in offsets:
+            # Earlier entries win, matching the order reminders are checked in
+            target_dates.setdefault(day - time_after_dob + relativedelta(days=days_before), reminder)
+        targets.append(target_dates)
+    return tuple(targets)
+
+
+def contacts_due_reminders(day):
+    """Contacts with at least one scheduled reminder on `day`, in one indexed query."""
+    return Contact.objects.filter(scheduled_reminders__due_date=day,
+                                  cancelled=False).distinct()
+
+
+def send_reminders(due_reminders, chunk_size=REMINDER_CHUNK_SIZE, concurrency=SMS_SEND_CONCURRENCY):
+    """Sends the (contact, reminder) pairs from TextReminder.due_on and records them in bulk.
+        Reminders with identical text go to all their numbers at once and the remaining
+        personalised reminders go out in bulk sends, `chunk_size` numbers per request, with
+        up to `concurrency` requests in flight. Each acknowledged request is recorded with
+        one insert for the outgoing messages and one update for the contacts' last_contacted,
+        in a single transaction, from this thread only."""
+    reminds = 0
+    errors = []
+    pool = ThreadPool(concurrency)
+    try:
+        for outgoing_messages, error in pool.imap_unordered(send_reminder_batch,
+                                                            reminder_batches(due_reminders, chunk_size)):
+            # Record whatever was sent, even if another request failed
+            record_sent_reminders(outgoing_messages)
+            reminds += len(outgoing_messages)
+            if error:
+                errors.append(error)
+    finally:
+        pool.close()
+        pool.join()
+    if errors:
+        raise errors[0]
+    return reminds
+
+
+def reminder_batches(due_reminders, chunk_size):
+    """Splits the due reminders into one batch per provider request: (send function, list of
+        (reminder message, contact) pairs the request sends)."""
+    texter = Texter()
+    contacts_by_message = OrderedDict()
+    for contact, reminder in due_reminders:
+        reminder_msg = TextReminder(contact, reminder=reminder).get_reminder_msg()
+        contacts_by_message.setdefault(reminder_msg, []).append(contact)
+
+    batches = []
+    personalised = []
+    for reminder_msg, contacts in contacts_by_message.items():
+        if len(contacts) == 1:
+            personalised.append((reminder_msg, contacts[0]))
+            continue
+        for start in range(0, len(contacts), chunk_size):
+            batch = [(reminder_msg, contact) for contact in contacts[start:start + chunk_size]]
+            batches.append((partial(texter.send_to_many, message=reminder_msg,
+                                    phone_numbers=[contact.phone_number for _, contact in batch]), batch))
+    for start in range(0, len(personalised), chunk_size):
+        batch = personalised[start:start + chunk_size]
+        batches.append((partial(texter.send_bulk, messages=[(reminder_msg, contact.phone_number)
+                                                            for reminder_msg, contact in batch]), batch))
+    return batches
+
+
+def send_reminder_batch(batch):
+    """Runs on a sending thread. Returns the unsaved outgoing messages, stamped as sent once
+        the provider has accepted the request, or the error if it did not."""
+    send, sent_reminders = batch
+    try:
+        rejections = rejected_sends(send())
+        if rejections:
+            raise IOError("TextLocal rejected the send: " + "; ".join(rejections))
+    except Exception as error:
+        logging.error("Failed to send {} reminders: {}".format(len(sent_reminders), error))
+        return [], error
+    return list(sent_reminder_messages(sent_reminders)), None
+
+
+def rejected_sends(send_statuses):
+    """TextLocal answers a rejected send with HTTP 200 and a "failure" status, for the whole request
+        or, in a bulk send, for single messages. Returns the errors of any rejections in the
+        responses from Texter.send_to_many or Texter.send_bulk."""
+    rejections = []
+    for send_status in send_statuses or []:
+        if not isinstance(send_status, dict):
+            continue
+        for status in [send_status] + list(send_status.get("messages") or []):
+            if isinstance(status, dict) and status.get("status") == "failure":
+                rejections.append(str(status.get("errors", status)))
+    return rejections
+
+
+def sent_reminder_messages(sent_reminders):
+    sent_at = datetime.now().replace(tzinfo=timezone.get_default_timezone())
+    for reminder_msg, contact in sent_reminders:
+        logging.info("Sent reminder to " + quote(contact.phone_number))
+        # bulk_create doesn't call Message.save, which sets the body key
+        yield Message(contact=contact, direction="Outgoing", body=reminder_msg, sent_at=sent_at,
+                      body_key=message_body_key(reminder_msg))
+
+
+def record_sent_reminders(outgoing_messages):
+    if not outgoing_messages:
+        return
+    with transaction.atomic():
+        Message.objects.bulk_create(outgoing_messages)
+        Contact.objects.filter(pk__in=[message.contact_id for message in outgoing_messages]) \
+                       .update(last_contacted=outgoing_messages[-1].created_at)
+
+
+@receiver(post_init, sender=Contact)
+def remember_scheduled_fields(sender, instance, **kwargs):
+    # Read from __dict__ so deferred fields are not loaded just to track them.
+    instance._scheduled_for = (instance.__dict__.get("date_of_birth"),
+                               instance.__dict__.get("preg_signup"))
+
+
+@receiver(post_save, sender=Contact)
+def reschedule_reminders(sender, instance, created, raw=False, **kwargs):
+    scheduled_for = (instance.date_of_birth, instance.preg_signup)
+    if raw or (not created and scheduled_for == instance._scheduled_for):
+        return
+    schedule_reminders(instance)
+    instance._scheduled_for = scheduled_for
+
 
 class TextReminder(object):
-    def __init__(self, contact):
+    def __init__(self, contact, reminder=None):
         self.contact = contact
         self.child_name = contact.name
         self.date_of_birth = contact.date_of_birth
@@ -24,10 +224,27 @@ class TextReminder(object):
         self.language = contact.language_preference
         self.preg_signup = contact.preg_signup
         self.preg_update = contact.preg_update
+        # Set by TextReminder.due_on, which has already loaded the contact and matched the date
+        self.reminder = reminder
+
+    @classmethod
+    def due_on(cls, day, contacts=None):
+        """Returns (contact, reminder) pairs for every non-cancelled contact due a reminder
+            on `day`, selected with a single query over their dates of birth."""
+        reminders, pregnancy_checks = reminder_targets(day)
+        contacts = Contact.objects.all() if contacts is None else contacts
+        contacts = contacts.filter(cancelled=False,
+                                   date_of_birth__in=list(reminders) + list(pregnancy_checks))
+        due = []
+        for contact in contacts:
+            reminder = cls(contact).reminder_from_targets(reminders, pregnancy_checks)
+            if reminder:
+                due.append((contact, reminder))
+        return due
 
     # self.get_contact() is preferred to self.contact due to triggering a Django DB refresh.
     def get_contact(self):
-        if self.contact:
+        if self.contact and self.reminder is None:
             self.contact.refresh_from_db()
         return self.contact
 
@@ -40,47 +257,27 @@ class TextReminder(object):
         target_date = (datetime.now() - time_after_dob + time_before_appointment).date()
         return self.date_of_birth == target_date
 
-    def get_reminder_msg(self):
-        if self.correct_date_for_reminder(weeks_after_birth=6, days_before_appointment=7):
-            reminder = six_week_reminder_seven_days
-        elif self.correct_date_for_reminder(weeks_after_birth=6, days_before_appointment=1):
-            reminder = six_week_reminder_one_day
-        elif self.correct_date_for_reminder(weeks_after_birth=10, days_before_appointment=7):
-            reminder = ten_week_reminder_seven_days
-        elif self.correct_date_for_reminder(weeks_after_birth=10, days_before_appointment=1):
-            reminder = ten_week_reminder_one_day
-        elif self.correct_date_for_reminder(weeks_after_birth=14, days_before_appointment=7):
-            reminder = fourteen_week_reminder_seven_days
-        elif self.correct_date_for_reminder(weeks_after_birth=14, days_before_appointment=1):
-            reminder = fourteen_week_reminder_one_day
-        elif self.correct_date_for_reminder(months_after_birth=9, days_before_appointment=7):
-            reminder = nine_month_reminder_seven_days
-        elif self.correct_date_for_reminder(months_after_birth=9, days_before_appointment=1):
-            reminder = nine_month_reminder_one_day
-        elif self.correct_date_for_reminder(months_after_birth=16, days_before_appointment=7):
-            reminder = sixteen_month_reminder_seven_days
-        elif self.correct_date_for_reminder(months_after_birth=16, days_before_appointment=1):
-            reminder = sixteen_month_reminder_one_day
-        elif self.correct_date_for_reminder(years_after_birth=5, days_before_appointment=7):
-            reminder = five_year_reminder_seven_days
-        elif self.correct_date_for_reminder(years_after_birth=5, days_before_appointment=1):
-            reminder = five_year_reminder_one_day
+    def reminder_from_targets(self, reminders, pregnancy_checks):
+        if self.date_of_birth in reminders:
+            return reminders[self.date_of_birth]
         elif self.preg_signup_check():
-            if self.correct_date_for_reminder(weeks_after_birth=2, days_before_appointment=0):
-                reminder = verify_pregnant_signup_birthdate
-            elif self.correct_date_for_reminder(weeks_after_birth=4, days_before_appointment=0):
-                reminder = verify_pregnant_signup_birthdate
-            else:
-                reminder = None
-        else:
-            reminder = None
+            return pregnancy_checks.get(self.date_of_birth)
+        return None
+
+    def get_reminder(self):
+        if self.reminder:
+            return self.reminder
+        return self.reminder_from_targets(*reminder_targets(datetime.now().date()))
+
+    def get_reminder_msg(self):
+        reminder = self.get_reminder()
         return reminder(self.language).format(name=self.child_name) if reminder else None
 
     def why_not_remind_reasons(self):
         reasons = []
         if self.get_contact().cancelled:
             reasons.append("Contact is cancelled.")
-        if self.get_reminder_msg() is None:
+        if self.get_reminder() is None:
             reasons.append("Contact has no reminders for today's date.")
         return reasons
         
@@ -90,12 +287,14 @@ class TextReminder(object):
     def remind(self):
         if self.should_remind_today():
             logging.info("Sent reminder to " + quote(self.phone_number))
-            contact = self.get_contact()
+            # should_remind_today() has just refreshed the contact
+            contact = self.contact
+            reminder_msg = self.get_reminder_msg()
             outgoing_message = Message.objects.create(contact=contact, direction="Outgoing",
-                body=self.get_reminder_msg())
+                body=reminder_msg)
             contact.last_contacted = outgoing_message.created_at
             contact.save()
-            Texter().send(message=self.get_reminder_msg(),
+            Texter().send(message=reminder_msg,
                           phone_number=self.phone_number)
             outgoing_message.sent_at = datetime.now().replace(tzinfo=timezone.get_default_timezone())
             outgoing_message.save()
@@ -1,22 +1,40 @@
-from cshsms.settings import TEXTLOCAL_API, TEXTLOCAL_PRIMARY_ID, HSPSMS_API, HSPSMS_USERNAME, HSPSMS_SENDERNAME, TEXTLOCAL_SENDERNAME
-from modules.textlocalwrapper import TextLocal
-from modules.hspsmswrapper import Hspsms
+from modules import providers
+from modules.textlocalwrapper import MAX_NUMBERS_PER_SEND
 
 class Texter(object):
-    def read_inbox(self):
-        textlocal = TextLocal(apikey=TEXTLOCAL_API, primary_id=TEXTLOCAL_PRIMARY_ID, sendername=TEXTLOCAL_SENDERNAME)
-        num_message_dict = textlocal.new_messages_by_number()
+    def __init__(self, textlocal=None):
+        # Share the process-wide client, and its open connections, unless given one
+        self.textlocal = textlocal or providers.textlocal()
+
+    def read_inbox(self, cursor=None):
+        """With an InboxCursor, only reads the messages after it, moving it past them. The caller saves
+            the cursor once the messages are safely processed."""
+        if cursor is not None:
+            return self.textlocal.new_messages_by_number_after(cursor)
+        num_message_dict = self.textlocal.new_messages_by_number()
         return num_message_dict
 
     def send(self, message, phone_number):
-        textlocal = TextLocal(apikey=TEXTLOCAL_API,
-                        primary_id=TEXTLOCAL_PRIMARY_ID,
-                        sendername=TEXTLOCAL_SENDERNAME)
-        send_status = textlocal.send_message(message=message,
-                                            phone_numbers=phone_number)
+        send_status = self.textlocal.send_message(message=message,
+                                                  phone_numbers=phone_number)
         return send_status
 
+    def send_to_many(self, message, phone_numbers):
+        """Sends the same message to all the phone numbers, as few requests as the provider allows."""
+        send_statuses = []
+        for start in range(0, len(phone_numbers), MAX_NUMBERS_PER_SEND):
+            send_statuses.append(self.send(message=message,
+                                           phone_number=",".join(phone_numbers[start:start + MAX_NUMBERS_PER_SEND])))
+        return send_statuses
+
+    def send_bulk(self, messages):
+        """Sends (message, phone_number) pairs with a different message per number, as many
+            per request as the provider allows."""
+        send_statuses = []
+        for start in range(0, len(messages), MAX_NUMBERS_PER_SEND):
+            send_statuses.append(self.textlocal.send_bulk_messages(messages=messages[start:start + MAX_NUMBERS_PER_SEND]))
+        return send_statuses
+
     def read_api_outbox(self):
-        textlocal = TextLocal(apikey=TEXTLOCAL_API, primary_id=TEXTLOCAL_PRIMARY_ID, sendername=TEXTLOCAL_SENDERNAME)
-        num_message_dict = textlocal.new_api_send_messages_by_number()
-        return num_message_dict
\ No newline at end of file
+        num_message_dict = self.textlocal.new_api_send_messages_by_number()
+        return num_message_dict
@@ -1,48 +1,57 @@
+import calendar
 import json
 import re
 import string
 
-from six import unichr, u
-from six.moves.urllib import request, parse
+from six import unichr, u, string_types
 from datetime import timedelta, datetime
 from django.utils import timezone
 
 from cshsms.settings import TEXTLOCAL_API, TEXTLOCAL_PRIMARY_ID, TEXTLOCAL_SENDERNAME
 from modules.date_helper import datetime_string_ymd_to_datetime
+from modules.http_client import shared_pool
 from modules.utils import is_not_ascii
 
+# Most numbers the send endpoint is given in one request
+MAX_NUMBERS_PER_SEND = 1000
+
 
 class TextLocal(object):
-    def __init__(self, apikey, primary_id, sendername):
+    def __init__(self, apikey, primary_id, sendername, api_url="https://api.textlocal.in/", http=None, rate_limiter=None):
         self.apikey = apikey
         self.primary_id = primary_id
         self.sendername = sendername
+        self.api_url = api_url
+        self.http = http or shared_pool
+        self.rate_limiter = rate_limiter
 
 
     def get_all_inboxes(self):
         params = {'apikey': self.apikey}
-        inboxes_url = 'https://api.textlocal.in/get_inboxes/?'
+        inboxes_url = self.api_url + 'get_inboxes/?'
         return self.get_url_response(request_url=inboxes_url, params=params)
 
 
-    def get_primary_inbox(self):
+    def get_primary_inbox(self, min_time=None):
         params = {'apikey': self.apikey, 'inbox_id': self.primary_id}
-        messages_url = 'https://api.textlocal.in/get_messages/?'
+        if min_time is not None:
+            # Unix timestamp; only messages received at or after it are returned
+            params['min_time'] = min_time
+        messages_url = self.api_url + 'get_messages/?'
         return self.get_url_response(request_url=messages_url, params=params)
 
     def get_api_send_history(self):
         params = {'apikey': self.apikey}
-        api_send_history_url = 'https://api.textlocal.in/get_history_api/?'
+        api_send_history_url = self.api_url + 'get_history_api/?'
         return self.get_url_response(request_url=api_send_history_url, params=params)
 
 
     def get_url_response(self, request_url, params):
-        f = request.urlopen(request_url + parse.urlencode(params))
-        return json.loads(f.read().decode('latin1'))
+        return json.loads(self.http.get(request_url, params).decode('latin1'))
 
 
-    def get_primary_inbox_messages(self):
-        return self.get_primary_inbox()['messages']
+    def get_primary_inbox_messages(self, min_time=None):
+        return self.get_primary_inbox(min_time=min_time)['messages']
 
     def get_api_send_history_messages(self):
         return self.get_api_send_history()['messages']
@@ -80,44 +89,88 @@ class TextLocal(object):
         return num_message_dict
 
     def new_messages_by_number(self):
-        all_messages = self.get_primary_inbox_messages()
-        corrected_messages = self.correct_unicode(messages=all_messages, key_name="message")
-        num_message_dict = {}
-        for message in corrected_messages:
-            if self.is_message_new(message=message, date_key_name="date"):
-                num_message_dict = self.add_to_num_message_dict(num_message_dict=num_message_dict,
-                                                                message=message,
-                                                                message_key_name="message",
-                                                                date_key_name="date")
-        return num_message_dict
+        return self.inbox_messages_by_number(self.get_primary_inbox_messages())
 
     def new_api_send_messages_by_number(self):
-        all_messages = self.get_api_send_history_messages()
-        corrected_messages = self.correct_unicode(messages=all_messages, key_name="content")
+        return self.api_send_messages_by_number(self.get_api_send_history_messages())
+
+    def new_messages_by_number_after(self, cursor):
+        """Like new_messages_by_number, but only asks for the messages after the cursor's high-water
+            mark, and moves the cursor (without saving it) past the ones returned."""
+        return self.inbox_messages_after(self.get_primary_inbox_messages(min_time=self.inbox_min_time(cursor)),
+                                         cursor)
+
+    def inbox_min_time(self, cursor):
+        if cursor.last_received_at is None:
+            # Nothing read yet, so start from the same 24 hours new_messages_by_number reads
+            return calendar.timegm((datetime.utcnow() - timedelta(hours=24)).utctimetuple())
+        return calendar.timegm(cursor.last_received_at.utctimetuple())
+
+    def inbox_messages_after(self, all_messages, cursor):
+        if cursor.last_received_at is None:
+            all_messages = [message for message in all_messages
+                            if self.is_message_new(message=message, date_key_name="date")]
+        marks = [(datetime_string_ymd_to_datetime(message['date']), int(message.get('id') or 0))
+                 for message in all_messages]
+        # Compare everything against where the cursor started, since the provider returns newest first
+        unread = [(message, mark) for message, mark in zip(all_messages, marks) if not cursor.has_read(*mark)]
+        for _, mark in unread:
+            cursor.mark_read(*mark)
+        return self.messages_by_number([message for message, _ in unread],
+                                       message_key_name="message",
+                                       date_key_name="date")
+
+    def inbox_messages_by_number(self, all_messages):
+        return self.new_messages_by_number_from(all_messages, message_key_name="message", date_key_name="date")
+
+    def api_send_messages_by_number(self, all_messages):
+        return self.new_messages_by_number_from(all_messages, message_key_name="content", date_key_name="datetime")
+
+    def new_messages_by_number_from(self, all_messages, message_key_name, date_key_name):
+        new_messages = [message for message in all_messages
+                        if self.is_message_new(message=message, date_key_name=date_key_name)]
+        return self.messages_by_number(new_messages, message_key_name=message_key_name, date_key_name=date_key_name)
+
+    def messages_by_number(self, messages, message_key_name, date_key_name):
+        corrected_messages = self.correct_unicode(messages=messages, key_name=message_key_name)
         num_message_dict = {}
         for message in corrected_messages:
-            if self.is_message_new(message=message, date_key_name="datetime"):
-                num_message_dict = self.add_to_num_message_dict(num_message_dict=num_message_dict,
-                                                                message=message,
-                                                                message_key_name="content",
-                                                                date_key_name="datetime")
+            num_message_dict = self.add_to_num_message_dict(num_message_dict=num_message_dict,
+                                                            message=message,
+                                                            message_key_name=message_key_name,
+                                                            date_key_name=date_key_name)
         return num_message_dict
 
     def send_message(self, message, phone_numbers):
-        send_url = "https://api.textlocal.in/send/?"
+        send_url = self.api_url + "send/?"
         unicode_used = 'false'
         if not isinstance(message, str):
             message = message.encode('utf-8')
         if is_not_ascii(message):
             unicode_used = 'true'
-        data = parse.urlencode({'numbers': phone_numbers,
-                                'message': message,
-                                'sender': self.sendername,
-                                'apikey': self.apikey,
-                                'unicode': unicode_used})
-        data = data.encode('utf-8')
-        # Avoid triggering bot errors by setting a user agent
-        user_agent = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_12_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/55.0.2883.95 Safari/537.36'}
-        requester = request.Request(send_url, headers=user_agent)
-        f = request.urlopen(requester, data)
-        return json.loads(f.read().decode('latin1'))
\ No newline at end of file
+        if not isinstance(phone_numbers, string_types):
+            phone_numbers = ",".join(phone_numbers)
+        return self.post_url_response(request_url=send_url,
+                                      params={'numbers': phone_numbers,
+                                              'message': message,
+                                              'sender': self.sendername,
+                                              'apikey': self.apikey,
+                                              'unicode': unicode_used})
+
+    def send_bulk_messages(self, messages):
+        """Sends a different message to each number in one request. `messages` is a list of
+            (message, phone_number) pairs."""
+        send_url = self.api_url + "bulk_json/?"
+        bulk_messages = [{'number': phone_number, 'text': message} for message, phone_number in messages]
+        data = {'sender': self.sendername,
+                'messages': bulk_messages,
+                'unicode': any(is_not_ascii(message) for message, _ in messages)}
+        return self.post_url_response(request_url=send_url,
+                                      params={'apikey': self.apikey,
+                                              'data': json.dumps(data)})
+
+    def post_url_response(self, request_url, params):
+        # Only sends are posted, and only sends count towards the provider's rate limit
+        if self.rate_limiter:
+            self.rate_limiter.acquire()
+        return json.loads(self.http.post(request_url, params).decode('latin1'))
@@ -2,31 +2,141 @@ import csv
 import re
 import datetime
 import logging
+import multiprocessing
+from collections import OrderedDict, deque
+from itertools import islice
+from django.db import connection, transaction
 from django.utils import timezone
-from modules.utils import add_contact_to_group, phone_number_is_valid, prepare_phone_number
+from cshsms.settings import CSV_PARSE_BATCH_SIZE, CSV_UPLOAD_PROCESSES
+from modules.utils import add_contacts_to_groups, chunks, phone_number_is_valid, prepare_phone_number
 from modules.date_helper import try_parsing_partner_date, try_parsing_gen_date, datetime_string_mdy_to_datetime, \
                                 add_or_subtract_days, add_or_subtract_months
 from modules.i18n import hindi_placeholder_name, gujarati_placeholder_name
 from modules.csv_columns import column_headers
+from modules.contact_staging import copy_upsert
+from modules.text_reminder import schedule_created_contacts
 from management.models import Contact
 
-def csv_upload(filepath, source):
+# Rows written to the database per transaction
+CSV_UPLOAD_CHUNK_SIZE = 500
+# How rows are written: "orm" upserts them in chunks with the ORM. "copy" stages the whole file with
+# PostgreSQL's COPY and merges it in one transaction; other databases fall back to "orm"
+CSV_UPLOAD_ENGINES = ("orm", "copy")
+
+def csv_upload(filepath, source, chunk_size=CSV_UPLOAD_CHUNK_SIZE, engine="orm", processes=CSV_UPLOAD_PROCESSES,
+               start_row=0, on_chunk=None):
+    """Uploads the contacts in a csv file. The "orm" engine writes `chunk_size` rows per transaction,
+        calling `on_chunk` inside each one with how many rows of the file are done. Rows before
+        `start_row` are skipped without being parsed."""
+    if engine not in CSV_UPLOAD_ENGINES:
+        raise ValueError("Unknown upload engine: {}".format(engine))
     with open(filepath) as csvfile:
         reader = csv.DictReader(csvfile)
-        for row in reader:
-            new_dict = make_contact_dict(row, source)
-            if phone_number_is_valid(new_dict["phone_number"]):
-                new_contact, created = Contact.objects.update_or_create(name=new_dict["name"],
-                    phone_number=new_dict["phone_number"], defaults=new_dict)
-
-                assign_groups_to_contact(new_contact, row.get("Groups"))
-            else:
-                logging.error("Entry: {name} - {date_of_birth} has invalid phone number: {phone}".format(
-                    name=new_dict["name"], phone=new_dict["phone_number"], date_of_birth=new_dict["date_of_birth"]))
-
-def make_contact_dict(row, source):
+        headers = resolve_columns(reader.fieldnames or [])
+        rows = islice(reader, start_row, None)
+        if engine == "copy" and connection.vendor == "postgresql":
+            copy_upsert(contact_entries(rows, source, headers=headers, processes=processes))
+            return
+        rows_done = start_row
+        for chunk in chunks(parsed_rows(rows, source, headers=headers, processes=processes), chunk_size):
+            with transaction.atomic():
+                upsert_contacts(list(valid_entries(chunk)))
+                rows_done += len(chunk)
+                if on_chunk:
+                    on_chunk(rows_done)
+
+def contact_entries(reader, source, headers=None, processes=1):
+    """Yields a (contact dict, groups string) entry for each row with a valid phone number, in file
+        order. With more than one process, the rows are parsed by a pool of that many processes."""
+    return valid_entries(parsed_rows(reader, source, headers=headers, processes=processes))
+
+def parsed_rows(reader, source, headers=None, processes=1):
+    if processes > 1:
+        return parse_in_processes(reader, source, headers, processes)
+    return (parse_row(row, source, headers) for row in reader)
+
+def valid_entries(parsed):
+    for new_dict, groups_string in parsed:
+        if phone_number_is_valid(new_dict["phone_number"]):
+            yield new_dict, groups_string
+        else:
+            logging.error("Entry: {name} - {date_of_birth} has invalid phone number: {phone}".format(
+                name=new_dict["name"], phone=new_dict["phone_number"], date_of_birth=new_dict["date_of_birth"]))
+
+def parse_row(row, source, headers=None):
+    return make_contact_dict(row, source, headers=headers), row.get("Groups")
+
+def parse_rows(rows, source, headers=None):
+    return [parse_row(row, source, headers) for row in rows]
+
+def parse_in_processes(reader, source, headers, processes, batch_size=CSV_PARSE_BATCH_SIZE):
+    """Parses the rows in batches in a pool of `processes` processes and yields them in file order.
+        Only a couple of batches per process are read ahead, so the file is never all in memory.
+        The processes don't use the database; writes stay in this process."""
+    pool = multiprocessing.Pool(processes)
+    try:
+        pending = deque()
+        for rows in chunks(reader, batch_size):
+            pending.append(pool.apply_async(parse_rows, (rows, source, headers)))
+            if len(pending) > 2 * processes:
+                for parsed in pending.popleft().get():
+                    yield parsed
+        while pending:
+            for parsed in pending.popleft().get():
+                yield parsed
+    finally:
+        pool.terminate()
+        pool.join()
+
+def upsert_contacts(entries):
+    """Creates or updates the contact for each (contact dict, groups string) entry, matched on name
+        and phone number like update_or_create, and adds it to the groups. Existing contacts are
+        read in one query and new ones inserted in one, all in one transaction; only contacts
+        that changed are saved."""
+    if not entries:
+        return
+    with transaction.atomic():
+        contacts = {}
+        for contact in Contact.objects.filter(phone_number__in=set(new_dict["phone_number"] for new_dict, _ in entries)) \
+                                      .order_by('pk'):
+            contacts.setdefault((contact.name, contact.phone_number), contact)
+
+        created = OrderedDict()
+        changed = OrderedDict()
+        for new_dict, _ in entries:
+            key = (new_dict["name"], new_dict["phone_number"])
+            contact = contacts.get(key)
+            if contact is None:
+                contacts[key] = created[key] = Contact(**new_dict)
+            elif contact_changed(contact, new_dict):
+                for field, value in new_dict.items():
+                    setattr(contact, field, value)
+                if key not in created:
+                    changed[key] = contact
+
+        Contact.objects.bulk_create(created.values())
+        if any(contact.pk is None for contact in created.values()):
+            # Not every database returns the ids of bulk created rows. No contact had a created key before
+            for contact in Contact.objects.filter(phone_number__in=set(phone for _, phone in created)).order_by('pk'):
+                key = (contact.name, contact.phone_number)
+                if key in created and created[key].pk is None:
+                    contacts[key] = created[key] = contact
+        schedule_created_contacts(created.values())
+        for contact in changed.values():
+            contact.save()
+
+        add_contacts_to_groups([(contacts[(new_dict["name"], new_dict["phone_number"])], group_name)
+                                for new_dict, groups_string in entries if groups_string
+                                for group_name in groups_string.split(", ")])
+
+def contact_changed(contact, new_dict):
+    # Compare as stored: the parsed dict holds datetimes for some date fields
+    return any(getattr(contact, field) != Contact._meta.get_field(field).to_python(value)
+               for field, value in new_dict.items())
+
+def make_contact_dict(row, source, headers=None):
     new_dict = {}
-    headers = column_headers()
+    headers = headers or column_headers()
     new_dict["language_preference"] = determine_language(row=row, headers=headers["language_preference"])
     new_dict["name"] = determine_name(row=row, headers=headers["name"], language=new_dict["language_preference"]) 
     new_dict["phone_number"] = prepare_phone_number(check_all_headers(row=row, headers=headers["phone_number"]))
@@ -78,13 +188,41 @@ def make_contact_dict(row, source):
 def assign_groups_to_contact(contact, groups_string):
     if not groups_string:
         return None
-    for group_name in groups_string.split(", "):
-        add_contact_to_group(contact, group_name)
+    add_contacts_to_groups([(contact, group_name) for group_name in groups_string.split(", ")])
+
+class ResolvedColumns(list):
+    """The columns of one file that check_all_headers reads a field from, in the order it tries them."""
+
+
+def resolve_columns(fieldnames, headers=None):
+    """Matches the column_headers() of every field against a file's `fieldnames` once, rather than
+        trying every spelling of every header on every row. Pass the result to make_contact_dict."""
+    fieldnames = set(fieldnames)
+    resolved = {}
+    for field, field_headers in (headers or column_headers()).items():
+        columns = ResolvedColumns()
+        for column in candidate_columns(field_headers):
+            if column in fieldnames and column not in columns:
+                columns.append(column)
+        resolved[field] = columns
+    return resolved
+
+def candidate_columns(headers):
+    # The same keys, in the same order, as check_all_headers and matching_permutation try
+    for header in headers:
+        yield header
+    for header in headers:
+        for perm in header_permutations(header):
+            for key in [perm, perm.capitalize(), perm.title(), perm.upper(), perm.lower()]:
+                yield key
+
+def header_permutations(header):
+    return [header, header + " ", " " + header + " ",
+            header + ",", header + ".", "The " + header,
+            header[0:-1], header[1:]]
 
 def matching_permutation(row, header):
-    permutations = [header, header + " ", " " + header + " ",
-                    header + ",", header + ".", "The " + header,
-                    header[0:-1], header[1:]]
+    permutations = header_permutations(header)
 
     for perm in permutations:
         if row.get(perm):
@@ -101,6 +239,9 @@ def matching_permutation(row, header):
     return None
 
 def check_all_headers(row, headers):
+    if isinstance(headers, ResolvedColumns):
+        return next((row[column] for column in headers if row.get(column)), None)
+
     for header in headers:
         if row.get(header):
             return row.get(header)
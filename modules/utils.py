@@ -1,16 +1,78 @@
 import re
+from itertools import islice
+from django.db import IntegrityError, transaction
 from management.models import Group
 from modules.i18n import subscribe_keywords
 
+# Most contacts looked up in one query, keeping under SQLite's limit on query parameters
+GROUP_MEMBERSHIP_CHUNK_SIZE = 500
+
+def chunks(iterable, size):
+    """Yields lists of up to `size` items from `iterable`, without reading ahead of the current list."""
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
 def quote(word):
     return u"`{}`".format(word)
 
 
 def add_contact_to_group(contact, group_name):
-    group, _ = Group.objects.get_or_create(name=group_name)
-    group.contacts.add(contact)
-    group.save()
-    return group
+    return add_contacts_to_groups([(contact, group_name)])[group_name]
+
+
+def add_contacts_to_groups(memberships):
+    """Adds the contact of each (contact, group_name) pair to the named group, creating any
+        missing groups. Takes a handful of queries however many pairs there are.
+        Returns {group_name: Group}."""
+    groups = groups_by_name(set(group_name for _, group_name in memberships))
+    add_to_groups([(contact, groups[group_name]) for contact, group_name in memberships])
+    return groups
+
+
+def groups_by_name(group_names):
+    """Returns {name: Group} for `group_names`, creating the missing groups in one insert."""
+    groups = {group.name: group for group in Group.objects.filter(name__in=group_names)}
+    missing = set(group_names) - set(groups)
+    if missing:
+        try:
+            with transaction.atomic():
+                Group.objects.bulk_create([Group(name=name) for name in missing])
+        except IntegrityError:
+            # Another run created some of them first
+            pass
+        # Not every database returns the ids of bulk created rows
+        groups.update({group.name: group for group in Group.objects.filter(name__in=missing)})
+    return groups
+
+
+def add_to_groups(memberships):
+    """Adds the contact of each (contact, group) pair to the group, inserting only the memberships
+        that don't exist yet."""
+    Membership = Group.contacts.through
+    wanted = set((group.pk, contact.pk) for contact, group in memberships)
+    if not wanted:
+        return
+    contact_ids = list(set(contact_id for _, contact_id in wanted))
+    group_ids = set(group_id for group_id, _ in wanted)
+    existing = set()
+    for start in range(0, len(contact_ids), GROUP_MEMBERSHIP_CHUNK_SIZE):
+        existing.update(Membership.objects.filter(contact_id__in=contact_ids[start:start + GROUP_MEMBERSHIP_CHUNK_SIZE],
+                                                  group_id__in=group_ids)
+                                          .values_list('group_id', 'contact_id'))
+    if not wanted - existing:
+        return
+    try:
+        with transaction.atomic():
+            Membership.objects.bulk_create([Membership(group_id=group_id, contact_id=contact_id)
+                                            for group_id, contact_id in wanted - existing])
+    except IntegrityError:
+        # Another run added some of them first, so add them one at a time, skipping those
+        for contact, group in memberships:
+            group.contacts.add(contact)
 
 
 def phone_number_is_valid(phone_number):
@@ -1,4 +1,10 @@
 from __future__ import absolute_import # I don't know why this is necessary to get these imports to work in Python 2 (only in this file!!!), but it is. :(
+import json
+import threading
+import time
+from six.moves import BaseHTTPServer, socketserver
+from six.moves.urllib import parse
+
 from management.models import Contact
 from modules.text_reminder import TextReminder
 from modules.date_helper import date_string_to_date
@@ -23,3 +29,69 @@ def contact_object(name=None, phone_number="1-111-1111", date_of_birth=None, lan
 def text_reminder_object(date_of_birth, language="English", preg_update=False, preg_signup=False):
     return TextReminder(contact_object(date_of_birth=date_of_birth, language=language,
                                         preg_signup=preg_signup, preg_update=preg_update))
+
+
+class FakeProviderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Stands in for an SMS provider's HTTP API, recording each request it receives."""
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, so don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.respond(parse.parse_qs(parse.urlsplit(self.path).query))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+        self.respond(parse.parse_qs(body))
+
+    def respond(self, params):
+        self.server.requests.append((self.path, params, self.client_address))
+        time.sleep(self.server.delay)
+        response = json.dumps(self.server.response).encode('latin1')
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingHTTPServer(socketserver.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    # Keep-alive connections hold a handler thread each, so don't wait for them on shutdown
+    daemon_threads = True
+    # Concurrent clients connect all at once, and a dropped SYN costs a second's retransmit
+    request_queue_size = 64
+
+
+class FakeProviderServer(object):
+    def __init__(self, response=None, status=200, delay=0):
+        self.response = {'status': 'success'} if response is None else response
+        self.status = status
+        # Seconds to wait before each response, standing in for the provider's latency
+        self.delay = delay
+
+    def __enter__(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeProviderHandler)
+        self.server.requests = []
+        self.server.response = self.response
+        self.server.status = self.status
+        self.server.delay = self.delay
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.api_url = 'http://127.0.0.1:{}/'.format(self.server.server_address[1])
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def requests(self):
+        return [(path, params) for path, params, _ in self.server.requests]
+
+    @property
+    def client_ports(self):
+        return [client_address[1] for _, _, client_address in self.server.requests]
@@ -1,10 +1,12 @@
 import mock
 from mock import patch, call
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 from datetime import datetime
 
-from management.models import Contact, Message
+from management.models import Contact, Message, InboxCursor
 from modules.i18n import msg_subscribe, msg_unsubscribe, hindi_remind
 from jobs import text_processor_job
 
@@ -79,3 +81,73 @@ class TextProcessorJobTests(TestCase):
         self.assertEqual(contacts[0].language_preference, "English")
         self.assertTrue(contacts[1].cancelled)
         self.assertEqual(contacts[1].language_preference, "Hindi")
+
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    @patch("modules.textlocalwrapper.TextLocal.get_primary_inbox_messages")
+    def test_messages_are_only_processed_once(self, mocked_inbox, mocked_texter_send, mocked_logger):
+        received = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        mocked_inbox.return_value = [{'id': '7', 'number': '1-111-1111', 'message': 'JOIN ROLAND 29/5/2017', 'date': received}]
+        text_processor_job.check_and_process_registrations()
+        text_processor_job.check_and_process_registrations()
+
+        self.assertEqual(Message.objects.filter(direction="Incoming").count(), 1)
+        self.assertEqual(mocked_texter_send.call_count, 1)
+        cursor = InboxCursor.objects.get(name=text_processor_job.PRIMARY_INBOX_CURSOR)
+        self.assertEqual(cursor.last_message_id, 7)
+        # The second run only asks for messages from the first one onwards
+        self.assertEqual(mocked_inbox.call_args_list[1], call(min_time=mocked_inbox.call_args_list[1][1]['min_time']))
+        self.assertGreater(mocked_inbox.call_args_list[1][1]['min_time'], mocked_inbox.call_args_list[0][1]['min_time'])
+
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    @patch("jobs.text_processor_job.Texter.read_inbox")
+    def test_overlapping_reads_are_only_processed_once(self, mocked_texter_read, mocked_texter_send, mocked_logger):
+        received_at = datetime(2017, 8, 1, 15, 20, 20).replace(tzinfo=timezone.get_default_timezone())
+        mocked_texter_read.return_value = {'1-111-1111': [("JOIN ROLAND 29/5/2017", received_at)]}
+        text_processor_job.check_and_process_registrations()
+        mocked_texter_read.return_value = {'1-111-1111': [("JOIN ROLAND 29/5/2017", received_at),
+                                                          ("END", received_at.replace(hour=16))]}
+        text_processor_job.check_and_process_registrations()
+
+        self.assertEqual(Message.objects.filter(direction="Incoming").count(), 2)
+        self.assertEqual(mocked_texter_send.call_count, 2)
+        self.assertTrue(Contact.objects.get(phone_number="1-111-1111").cancelled)
+
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    @patch("jobs.text_processor_job.Texter.read_inbox")
+    def test_texts_that_fail_while_processing_are_retried(self, mocked_texter_read, mocked_texter_send, mocked_logger):
+        received_at = datetime(2017, 8, 1, 15, 20, 20).replace(tzinfo=timezone.get_default_timezone())
+        mocked_texter_read.return_value = {'1-111-1111': [("JOIN ROLAND 29/5/2017", received_at)]}
+        mocked_texter_send.side_effect = IOError("TextLocal is down")
+        with self.assertRaises(IOError):
+            text_processor_job.check_and_process_registrations()
+        self.assertFalse(Message.objects.get(direction="Incoming").is_processed)
+
+        mocked_texter_send.side_effect = None
+        text_processor_job.check_and_process_registrations()
+        self.assertEqual(Message.objects.filter(direction="Incoming").count(), 1)
+        self.assertTrue(Message.objects.get(direction="Incoming").is_processed)
+        self.assertEqual(mocked_texter_send.call_count, 2)
+
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    @patch("jobs.text_processor_job.Texter.read_inbox")
+    def test_contacts_and_groups_are_loaded_once_per_run(self, mocked_texter_read, mocked_texter_send, mocked_logger):
+        received_at = datetime(2017, 8, 1, 15, 20, 20).replace(tzinfo=timezone.get_default_timezone())
+        for i in range(5):
+            Contact.objects.create(name="Roland", phone_number="1-111-111{}".format(i), cancelled=True)
+        mocked_texter_read.return_value = {"1-111-111{}".format(i): [("JOIN ROLAND 29/5/2017", received_at)]
+                                           for i in range(10)}
+        with CaptureQueriesContext(connection) as context:
+            text_processor_job.check_and_process_registrations()
+
+        selects = [query['sql'] for query in context.captured_queries if query['sql'].startswith('SELECT')]
+        self.assertEqual(len([sql for sql in selects if 'FROM "management_contact"' in sql]), 1)
+        # The contacts' groups, then the sign up groups by name, before and after creating them
+        self.assertEqual(len([sql for sql in selects if 'FROM "management_group"' in sql]), 1 + 2)
+        self.assertEqual(len([sql for sql in selects if 'FROM "management_message"' in sql and
+                                                         '"direction" = \'Outgoing\'' in sql]), 1)
+        self.assertEqual(Contact.objects.filter(cancelled=False).count(), 10)
+        self.assertEqual(mocked_texter_send.call_count, 10)
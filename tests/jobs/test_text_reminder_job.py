@@ -13,8 +13,8 @@ FAKE_NOW = datetime(2017, 7, 17, 0, 0)
 class TextReminderJobTests(TestCase):
     @freeze_time(FAKE_NOW)
     @patch("logging.info")
-    @patch("modules.text_reminder.Texter.send")
-    def test_remind_two_people(self, mocked_send_text, mocked_logger):
+    @patch("modules.text_reminder.Texter.send_bulk")
+    def test_remind_two_people(self, mocked_send_bulk, mocked_logger):
         c1 = contact_object(name="Roland",
                             phone_number="1-111-1111",
                             date_of_birth="12/6/2017") # 7 days before 6 week appointment
@@ -23,17 +23,15 @@ class TextReminderJobTests(TestCase):
                             date_of_birth="12/6/2017",
                             language="Hindi")
         text_reminder_job.remind_all()
-        calls = [call(message=TextReminder(c1).get_reminder_msg(),
-                      phone_number=c1.phone_number),
-                 call(message=TextReminder(c2).get_reminder_msg(),
-                      phone_number=c2.phone_number)]
-        mocked_send_text.assert_has_calls(calls, any_order=True)
-        self.assertEqual(mocked_send_text.call_count, 2)
+        messages = [(TextReminder(c1).get_reminder_msg(), c1.phone_number),
+                    (TextReminder(c2).get_reminder_msg(), c2.phone_number)]
+        self.assertEqual(mocked_send_bulk.call_count, 1)
+        self.assertEqual(sorted(mocked_send_bulk.call_args[1]["messages"]), sorted(messages))
 
     @freeze_time(FAKE_NOW)
     @patch("logging.info")
-    @patch("modules.text_reminder.Texter.send")
-    def test_remind_two_people_but_not_the_cancelled_one(self, mocked_send_text, mocked_logger):
+    @patch("modules.text_reminder.Texter.send_bulk")
+    def test_remind_two_people_but_not_the_cancelled_one(self, mocked_send_bulk, mocked_logger):
         c1 = contact_object(name="Roland",
                             phone_number="1-111-1111",
                             date_of_birth="12/6/2017") # 7 days before 6 week appointment
@@ -47,9 +45,34 @@ class TextReminderJobTests(TestCase):
         c3.cancelled = True
         c3.save()
         text_reminder_job.remind_all()
-        calls = [call(message=TextReminder(c1).get_reminder_msg(),
-                      phone_number=c1.phone_number),
-                 call(message=TextReminder(c2).get_reminder_msg(),
-                      phone_number=c2.phone_number)]
-        mocked_send_text.assert_has_calls(calls, any_order=True)
-        self.assertEqual(mocked_send_text.call_count, 2)
+        messages = [(TextReminder(c1).get_reminder_msg(), c1.phone_number),
+                    (TextReminder(c2).get_reminder_msg(), c2.phone_number)]
+        self.assertEqual(mocked_send_bulk.call_count, 1)
+        self.assertEqual(sorted(mocked_send_bulk.call_args[1]["messages"]), sorted(messages))
+
+    @freeze_time(datetime(2020, 9, 25, 0, 0))
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send_bulk")
+    def test_remind_across_month_end(self, mocked_send_bulk, mocked_logger):
+        contact = contact_object(name="Roland",
+                                 phone_number="1-111-1111",
+                                 date_of_birth="1/1/2020") # 7 days before 9 month appointment
+        text_reminder_job.remind_all()
+        self.assertEqual(mocked_send_bulk.call_args[1]["messages"],
+                         [(TextReminder(contact).get_reminder_msg(), contact.phone_number)])
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_remind_same_message_in_one_send(self, mocked_send_text, mocked_logger):
+        c1 = contact_object(name="Roland",
+                            phone_number="1-111-1111",
+                            date_of_birth="12/6/2017")
+        c2 = contact_object(name="Roland",
+                            phone_number="1-112-1111",
+                            date_of_birth="12/6/2017")
+        text_reminder_job.remind_all()
+        self.assertEqual(mocked_send_text.call_count, 1)
+        self.assertEqual(mocked_send_text.call_args[1]["message"], TextReminder(c1).get_reminder_msg())
+        self.assertEqual(sorted(mocked_send_text.call_args[1]["phone_number"].split(",")),
+                         [c1.phone_number, c2.phone_number])
@@ -4,8 +4,13 @@ from django.urls import reverse
 import datetime
 from freezegun import freeze_time
 from dateutil.relativedelta import relativedelta
+from mock import patch
 
-from management.models import Contact
+from management.models import Contact, InboxCursor, Message, message_body_key
+from modules.date_helper import datetime_string_ymd_to_datetime
+from modules.i18n import msg_subscribe
+from modules.text_processor import unseen_messages
+from jobs import text_processor_job
 
 FAKE_NOW = datetime.datetime(2017, 7, 24, 0, 0)
 
@@ -48,6 +53,40 @@ class ContactModelTests(TestCase):
 		self.assertIs(past_contact.has_been_born(), True)
 
 
+class InboxCursorModelTests(TestCase):
+    def setUp(self):
+        self.received_at = timezone.make_aware(datetime.datetime(2017, 9, 6, 12, 0, 0))
+
+    def test_new_cursor_has_read_nothing(self):
+        self.assertFalse(InboxCursor(name="inbox").has_read(self.received_at, 1))
+
+    def test_has_read_up_to_the_high_water_mark(self):
+        cursor = InboxCursor(name="inbox", last_received_at=self.received_at, last_message_id=5)
+        self.assertTrue(cursor.has_read(self.received_at - datetime.timedelta(seconds=1), 9))
+        self.assertTrue(cursor.has_read(self.received_at, 5))
+        self.assertFalse(cursor.has_read(self.received_at, 6))
+        self.assertFalse(cursor.has_read(self.received_at + datetime.timedelta(seconds=1), 1))
+
+    def test_mark_read_only_moves_forward(self):
+        cursor = InboxCursor(name="inbox")
+        cursor.mark_read(self.received_at, 5)
+        cursor.mark_read(self.received_at - datetime.timedelta(hours=1), 9)
+        self.assertEqual((cursor.last_received_at, cursor.last_message_id), (self.received_at, 5))
+
+
+class MessageModelTests(TestCase):
+    def test_save_sets_body_key(self):
+        contact = Contact.objects.create(name="Roland", phone_number="1-111-1111")
+        message = Message.objects.create(contact=contact, direction="Outgoing", body="Hello")
+        self.assertEqual(message.body_key, "8b1a9953c4611296a827abf8c47804d7")
+        message.body = u"\u0928\u092e\u0938\u094d\u0924\u0947"
+        message.save()
+        self.assertEqual(Message.objects.get(pk=message.pk).body_key, message_body_key(message.body))
+
+    def test_body_key_of_blank_body(self):
+        self.assertEqual(message_body_key(None), message_body_key(u""))
+
+
 class ContactIndexViewTests(TestCase):
     def test_no_contacts(self):
         """
@@ -97,3 +136,73 @@ class ContactDetailViewTests(TestCase):
         url = reverse('management:detail', args=(contact_that_has_been_born.id,))
         response = self.client.get(url)
         self.assertContains(response, contact_that_has_been_born.name)
+
+
+@patch("modules.text_processor.Texter.send")
+class TextLocalInboundViewTests(TestCase):
+    def post(self, token="travis", **params):
+        url = reverse('management:textlocal_inbound', args=(token,))
+        return self.client.post(url, params)
+
+    def test_stores_and_answers_the_text(self, mocked_send):
+        response = self.post(sender="911111111111", content="JOIN ROLAND 29/5/2017", rcvd="2017-08-01 15:20:20")
+        self.assertEqual(response.status_code, 200)
+        incoming = Message.objects.get(direction="Incoming")
+        self.assertEqual(incoming.body, "JOIN ROLAND 29/5/2017")
+        self.assertEqual(incoming.contact.phone_number, "911111111111")
+        self.assertEqual(incoming.received_at, datetime_string_ymd_to_datetime("2017-08-01 15:20:20"))
+        self.assertTrue(incoming.is_processed)
+        mocked_send.assert_called_once_with(message=msg_subscribe("English").format(name="Roland"),
+                                            phone_number="911111111111")
+
+    def test_repeated_callback_is_answered_once(self, mocked_send):
+        for _ in range(2):
+            self.post(sender="911111111111", content="JOIN ROLAND 29/5/2017", rcvd="2017-08-01 15:20:20")
+        self.assertEqual(Message.objects.filter(direction="Incoming").count(), 1)
+        self.assertEqual(mocked_send.call_count, 1)
+
+    def test_inbox_poll_skips_texts_received_by_webhook(self, mocked_send):
+        self.post(sender="911111111111", content="JOIN ROLAND 29/5/2017", rcvd="2017-08-01 15:20:20")
+        inbox = {"911111111111": [("JOIN ROLAND 29/5/2017", datetime_string_ymd_to_datetime("2017-08-01 15:20:20"))]}
+        self.assertEqual(unseen_messages(inbox), {})
+
+    @patch("logging.info")
+    @patch("jobs.text_processor_job.Texter.read_inbox")
+    def test_text_answered_once_when_inbox_poll_overlaps_webhook(self, mocked_read_inbox, mocked_logger, mocked_send):
+        self.post(sender="911111111111", content="JOIN ROLAND 29/5/2017", rcvd="2017-08-01 15:20:20")
+        incoming = Message.objects.get(direction="Incoming")
+        # The poll read and stored the text before the webhook had finished answering it
+        stale = Message.objects.get(pk=incoming.pk)
+        stale.is_processed = False
+        mocked_read_inbox.return_value = {"911111111111": [("JOIN ROLAND 29/5/2017", incoming.received_at)]}
+        with patch("jobs.text_processor_job.unseen_messages", side_effect=lambda messages: messages), \
+             patch("modules.text_processor.TextProcessor.write_to_database", return_value=stale):
+            text_processor_job.check_and_process_registrations()
+        self.assertEqual(Message.objects.filter(direction="Outgoing").count(), 1)
+        self.assertEqual(mocked_send.call_count, 1)
+
+    def test_rejects_wrong_token(self, mocked_send):
+        response = self.post(token="wrong", sender="911111111111", content="END", rcvd="2017-08-01 15:20:20")
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Message.objects.exists())
+
+    def test_turned_off_without_a_token(self, mocked_send):
+        with patch("management.views.TEXTLOCAL_WEBHOOK_TOKEN", None):
+            response = self.post(token="None", sender="911111111111", content="END", rcvd="2017-08-01 15:20:20")
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Message.objects.exists())
+
+    def test_rejects_missing_fields(self, mocked_send):
+        response = self.post(content="END")
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_rejects_missing_or_malformed_received_time(self, mocked_send):
+        for params in [{}, {"rcvd": ""}, {"rcvd": "yesterday"}]:
+            response = self.post(sender="911111111111", content="END", **params)
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(Message.objects.exists())
+
+    def test_only_accepts_post(self, mocked_send):
+        response = self.client.get(reverse('management:textlocal_inbound', args=("travis",)))
+        self.assertEqual(response.status_code, 405)
@@ -0,0 +1,216 @@
+import json
+import socket
+import time
+from datetime import datetime, timedelta
+from unittest import skipUnless
+
+import six
+from django.test import TestCase
+
+from modules.rate_limiter import TokenBucket
+from tests.fixtures import FakeProviderServer
+
+if six.PY3:
+    import asyncio
+    from http.client import RemoteDisconnected
+    from modules.async_http_client import AsyncConnectionPool
+    from modules.async_textlocalwrapper import AsyncTextLocal
+    from modules.async_texter import AsyncTexter
+
+
+def run(coroutine, closing):
+    """Runs the coroutine on a new event loop, closing the pool or texter before the loop."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        closing.close()
+        # Let the transports finish closing their sockets
+        loop.run_until_complete(asyncio.sleep(0, loop=loop))
+        loop.close()
+
+
+def async_texter(server, concurrency=8):
+    return AsyncTexter(textlocal=AsyncTextLocal(apikey='mock_key',
+                                                primary_id='mock_id',
+                                                sendername='mock_sendername',
+                                                api_url=server.api_url),
+                       concurrency=concurrency)
+
+
+@skipUnless(six.PY3, "asyncio clients are Python 3 only")
+class AsyncConnectionPoolTests(TestCase):
+    def test_get_with_params(self):
+        with FakeProviderServer(response={'messages': []}) as server:
+            pool = AsyncConnectionPool()
+            response = run(pool.get(server.api_url + 'get_messages/?', {'apikey': 'mock_key'}), pool)
+        self.assertEqual(json.loads(response.decode('latin1')), {'messages': []})
+        self.assertEqual(server.requests, [('/get_messages/?apikey=mock_key', {'apikey': ['mock_key']})])
+
+    def test_post(self):
+        with FakeProviderServer() as server:
+            pool = AsyncConnectionPool()
+            run(pool.post(server.api_url + 'send/?', {'numbers': '911111111111', 'message': 'Test'}), pool)
+        self.assertEqual(server.requests, [('/send/', {'numbers': ['911111111111'], 'message': ['Test']})])
+
+    def test_connection_is_reused(self):
+        with FakeProviderServer() as server:
+            pool = AsyncConnectionPool()
+            loop = asyncio.new_event_loop()
+            for _ in range(5):
+                loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'Test'}))
+            pool.close()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            loop.close()
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(len(set(server.client_ports)), 1)
+        self.assertEqual(pool.connections_opened, 1)
+
+    def test_retries_when_idle_connection_was_closed(self):
+        with FakeProviderServer() as server:
+            pool = AsyncConnectionPool()
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'First'}))
+            _, writer = pool.idle_connections[('http', '127.0.0.1', server.server.server_address[1])][0]
+            # Writing to the shut down connection fails with a broken pipe, as when the provider has closed it
+            writer.get_extra_info('socket').shutdown(socket.SHUT_WR)
+            loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'Second'}))
+            pool.close()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            loop.close()
+        self.assertEqual([params['message'] for _, params in server.requests], [['First'], ['Second']])
+        self.assertEqual(pool.connections_opened, 2)
+
+    def close_without_response(self, pool, server):
+        """Makes the idle connection to the server read as closed once its next request is written."""
+        reader, _ = pool.idle_connections[('http', '127.0.0.1', server.server.server_address[1])][0]
+        async def closed():
+            return b''
+        reader.readline = closed
+
+    def test_retries_get_when_idle_connection_closed_without_a_response(self):
+        with FakeProviderServer(response={'messages': []}) as server:
+            pool = AsyncConnectionPool()
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(pool.get(server.api_url + 'get_messages/?', {'apikey': 'First'}))
+            self.close_without_response(pool, server)
+            response = loop.run_until_complete(pool.get(server.api_url + 'get_messages/?', {'apikey': 'Second'}))
+            pool.close()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            loop.close()
+        self.assertEqual(json.loads(response.decode('latin1')), {'messages': []})
+        self.assertEqual(pool.connections_opened, 2)
+
+    def test_does_not_retry_post_when_connection_closed_after_the_request_was_sent(self):
+        with FakeProviderServer() as server:
+            pool = AsyncConnectionPool()
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'First'}))
+            # The provider takes the send, then drops the connection without answering
+            self.close_without_response(pool, server)
+            with self.assertRaises(RemoteDisconnected):
+                loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'Second'}))
+            pool.close()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            loop.close()
+            # A retry would have been written before post() returned, so give the server time to read them all
+            deadline = time.time() + 5
+            while len(server.requests) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+        self.assertEqual([params['message'] for _, params in server.requests], [['First'], ['Second']])
+        self.assertEqual(pool.connections_opened, 1)
+
+    def test_does_not_retry_after_a_timeout(self):
+        with FakeProviderServer() as server:
+            pool = AsyncConnectionPool(timeout=0.5)
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'First'}))
+            server.server.delay = 1
+            with self.assertRaises(asyncio.TimeoutError):
+                loop.run_until_complete(pool.post(server.api_url + 'send/?', {'message': 'Second'}))
+            requests = list(server.requests)
+            pool.close()
+            loop.run_until_complete(asyncio.sleep(0, loop=loop))
+            loop.close()
+        self.assertEqual([params['message'] for _, params in requests], [['First'], ['Second']])
+
+    def test_read_chunked_response(self):
+        loop = asyncio.new_event_loop()
+        reader = asyncio.StreamReader(loop=loop)
+        reader.feed_data(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                         b'4\r\n{"a"\r\n3\r\n: 1\r\n1\r\n}\r\n0\r\n\r\n')
+        status, will_close, data = loop.run_until_complete(AsyncConnectionPool().read_response(reader))
+        loop.close()
+        self.assertEqual((status, will_close, data), (200, False, b'{"a": 1}'))
+
+    def test_error_status_raises(self):
+        with FakeProviderServer(status=500) as server:
+            pool = AsyncConnectionPool()
+            with self.assertRaises(IOError):
+                run(pool.post(server.api_url + 'send/?', {'message': 'Test'}), pool)
+
+
+@skipUnless(six.PY3, "asyncio clients are Python 3 only")
+class AsyncTexterTests(TestCase):
+    def test_read_inbox_and_outbox(self):
+        now = datetime.now()
+        recent = now.strftime("%Y-%m-%d %H:%M:%S")
+        old = (now - timedelta(days=3)).strftime("%Y-%m-%d %H:%M:%S")
+        response = {'messages': [{'number': '910987654321', 'message': 'New message', 'date': recent,
+                                  'content': 'New message', 'datetime': recent},
+                                 {'number': '910987654321', 'message': 'Old message', 'date': old,
+                                  'content': 'Old message', 'datetime': old}]}
+        with FakeProviderServer(response=response) as server:
+            texter = async_texter(server)
+            inbox, outbox = run(texter.read_inbox_and_outbox(), texter)
+        self.assertEqual([message for message, _ in inbox['910987654321']], ['New message'])
+        self.assertEqual([message for message, _ in outbox['910987654321']], ['New message'])
+        self.assertEqual(sorted(path for path, _ in server.requests),
+                         ['/get_history_api/?apikey=mock_key',
+                          '/get_messages/?apikey=mock_key&inbox_id=mock_id'])
+
+    def test_send(self):
+        with FakeProviderServer() as server:
+            texter = async_texter(server)
+            status = run(texter.send(message="Test", phone_number="911111111111"), texter)
+        self.assertEqual(status, {'status': 'success'})
+        self.assertEqual(server.requests[0][1]['numbers'], ['911111111111'])
+        self.assertEqual(server.requests[0][1]['unicode'], ['false'])
+
+    def test_send_many_overlaps_requests(self):
+        messages = [("Test {}".format(i), "91111111111{}".format(i)) for i in range(8)]
+        with FakeProviderServer(delay=0.2) as server:
+            texter = async_texter(server, concurrency=8)
+            start = time.time()
+            statuses = run(texter.send_many(messages), texter)
+            elapsed = time.time() - start
+        self.assertEqual(statuses, [{'status': 'success'}] * 8)
+        self.assertEqual(sorted(params['message'][0] for _, params in server.requests),
+                         ["Test {}".format(i) for i in range(8)])
+        # One after the other these would take at least 1.6 seconds
+        self.assertLess(elapsed, 1.2)
+
+    def test_send_many_limits_concurrency(self):
+        messages = [("Test", "91111111111{}".format(i)) for i in range(6)]
+        with FakeProviderServer() as server:
+            texter = async_texter(server, concurrency=2)
+            run(texter.send_many(messages), texter)
+        self.assertEqual(len(server.requests), 6)
+        self.assertEqual(texter.textlocal.http.connections_opened, 2)
+
+    def test_send_many_waits_for_rate_limit(self):
+        rate_limiter = TokenBucket(rate=20, burst=1)
+        messages = [("Test", "91111111111{}".format(i)) for i in range(3)]
+        with FakeProviderServer() as server:
+            texter = AsyncTexter(textlocal=AsyncTextLocal(apikey='mock_key',
+                                                          primary_id='mock_id',
+                                                          sendername='mock_sendername',
+                                                          api_url=server.api_url,
+                                                          rate_limiter=rate_limiter))
+            start = time.time()
+            run(texter.send_many(messages), texter)
+            elapsed = time.time() - start
+        self.assertEqual(len(server.requests), 3)
+        self.assertEqual(rate_limiter.waits, 2)
+        self.assertGreaterEqual(elapsed, 0.09)
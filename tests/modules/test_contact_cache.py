@@ -0,0 +1,143 @@
+from datetime import datetime
+from mock import patch
+
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection
+from django.utils import timezone
+
+from management.models import Contact, Group, Message
+from modules.contact_cache import ContactCache
+from modules.text_processor import TextProcessor
+
+
+class ContactCacheTests(TestCase):
+    def setUp(self):
+        self.roland = Contact.objects.create(name="Roland", phone_number="1-111-1111")
+        self.aaron = Contact.objects.create(name="Aaron", phone_number="1-111-1111")
+        self.marshall = Contact.objects.create(name="Marshall", phone_number="1-111-2222")
+
+    def test_loads_every_number_in_one_query(self):
+        with self.assertNumQueries(1):
+            cache = ContactCache(["1-111-1111", "1-111-2222", "1-111-3333"])
+        with self.assertNumQueries(0):
+            self.assertEqual([contact.name for contact in cache.for_number("1-111-1111")], ["Aaron", "Roland"])
+            self.assertEqual(cache.find("Marshall", "1-111-2222").pk, self.marshall.pk)
+            self.assertEqual(cache.for_number("1-111-3333"), [])
+            self.assertIsNone(cache.find("Roland", "1-111-3333"))
+
+    @patch("modules.contact_cache.PHONE_NUMBER_CHUNK_SIZE", 2)
+    def test_loads_numbers_in_chunks(self):
+        with self.assertNumQueries(2):
+            cache = ContactCache(["1-111-1111", "1-111-2222", "1-111-3333"])
+        self.assertEqual(len(cache.by_pk), 3)
+
+    def test_hands_out_the_same_instance(self):
+        cache = ContactCache(["1-111-1111"])
+        with self.assertNumQueries(0):
+            self.assertIs(cache.get(self.roland.pk), cache.find("Roland", "1-111-1111"))
+
+    def test_get_loads_a_missing_contact(self):
+        cache = ContactCache()
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get(self.marshall.pk).name, "Marshall")
+        with self.assertNumQueries(0):
+            cache.get(self.marshall.pk)
+
+    def test_added_contacts_are_found(self):
+        cache = ContactCache(["1-111-1111"])
+        contact = Contact.objects.create(name="Ben", phone_number="1-111-1111")
+        cache.add(contact)
+        with self.assertNumQueries(0):
+            self.assertEqual([cached.name for cached in cache.for_number("1-111-1111")], ["Aaron", "Ben", "Roland"])
+            self.assertIs(cache.find("Ben", "1-111-1111"), contact)
+
+    def test_reload_forgets_a_number(self):
+        cache = ContactCache(["1-111-1111"])
+        cache.find("Roland", "1-111-1111").cancelled = True
+        cache.reload("1-111-1111")
+        with self.assertNumQueries(1):
+            self.assertFalse(cache.find("Roland", "1-111-1111").cancelled)
+
+    def test_load_for_messages(self):
+        messages = [Message.objects.create(contact=self.roland, direction="Incoming", body="END"),
+                    Message.objects.create(contact=self.marshall, direction="Incoming", body="END")]
+        messages = list(Message.objects.filter(pk__in=[message.pk for message in messages]).order_by('id'))
+        cache = ContactCache()
+        with self.assertNumQueries(1):
+            cache.load_for_messages(messages)
+        with self.assertNumQueries(0):
+            self.assertIs(messages[0].contact, cache.find("Roland", "1-111-1111"))
+            self.assertEqual(len(cache.for_number("1-111-1111")), 2)
+            self.assertIs(messages[1].contact, cache.find("Marshall", "1-111-2222"))
+
+    def test_prefetches_groups_and_outgoing_messages(self):
+        Group.objects.create(name="Everyone - English").contacts.add(self.roland)
+        Message.objects.create(contact=self.roland, direction="Outgoing", body="Welcome")
+        Message.objects.create(contact=self.roland, direction="Incoming", body="JOIN")
+        with self.assertNumQueries(3):
+            cache = ContactCache(["1-111-1111", "1-111-2222"], prefetch=True)
+        roland = cache.find("Roland", "1-111-1111")
+        with self.assertNumQueries(0):
+            self.assertEqual([group.name for group in roland.cached_groups], ["Everyone - English"])
+            self.assertTrue(cache.was_sent(roland, "Welcome"))
+            self.assertFalse(cache.was_sent(roland, "JOIN"))
+            self.assertFalse(cache.was_sent(cache.find("Aaron", "1-111-1111"), "Welcome"))
+
+    def test_was_sent_without_prefetch(self):
+        Message.objects.create(contact=self.roland, direction="Outgoing", body="Welcome")
+        cache = ContactCache(["1-111-1111"])
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(cache.was_sent(cache.get(self.roland.pk), "Welcome"))
+            self.assertFalse(cache.was_sent(cache.get(self.roland.pk), "Goodbye"))
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertIn('"body_key" = ', context.captured_queries[0]['sql'])
+
+    def test_sent_keeps_prefetched_messages_current(self):
+        cache = ContactCache(["1-111-1111"], prefetch=True)
+        roland = cache.get(self.roland.pk)
+        cache.sent(Message.objects.create(contact=roland, direction="Outgoing", body="Welcome"))
+        with self.assertNumQueries(0):
+            self.assertTrue(cache.was_sent(roland, "Welcome"))
+
+    def test_add_to_groups_looks_each_group_up_once(self):
+        cache = ContactCache(["1-111-1111"], prefetch=True)
+        for contact in cache.for_number("1-111-1111"):
+            cache.add_to_groups(contact, ["Text Sign Ups", "Everyone - English"])
+        with self.assertNumQueries(0):
+            cache.add_to_groups(cache.get(self.roland.pk), ["Text Sign Ups"])
+        self.assertEqual(sorted(Group.objects.get(name="Text Sign Ups").contacts.values_list('name', flat=True)),
+                         ["Aaron", "Roland"])
+        self.assertEqual(Group.objects.get(name="Everyone - English").contacts.count(), 2)
+
+
+@patch("modules.text_processor.Texter.send")
+class TextProcessorContactCacheTests(TestCase):
+    def setUp(self):
+        self.received_at = datetime(2017, 8, 1, 15, 20, 20).replace(tzinfo=timezone.get_default_timezone())
+
+    def contact_queries(self, queries):
+        return [query['sql'] for query in queries
+                if query['sql'].startswith('SELECT') and 'FROM "management_contact"' in query['sql']]
+
+    def test_processing_loads_the_contacts_once(self, mocked_send):
+        Contact.objects.create(name="Roland", phone_number="1-111-1111")
+        with CaptureQueriesContext(connection) as context:
+            t = TextProcessor(phone_number="1-111-1111")
+            t.write_and_process(message="JOIN MARSHALL 29/5/2017", date=self.received_at)
+            t.write_and_process(message="END", date=self.received_at.replace(minute=30))
+        self.assertEqual(len(self.contact_queries(context.captured_queries)), 1)
+        self.assertEqual(sorted(t.get_contacts().values_list('name', 'cancelled')),
+                         [("Marshall", True), ("Roland", True)])
+
+    def test_processors_share_a_cache(self, mocked_send):
+        contacts = ContactCache(["1-111-1111", "1-111-2222"])
+        with CaptureQueriesContext(connection) as context:
+            TextProcessor("1-111-1111", contacts=contacts).write_and_process(message="JOIN ROLAND 29/5/2017",
+                                                                             date=self.received_at)
+            TextProcessor("1-111-2222", contacts=contacts).write_and_process(message="END",
+                                                                             date=self.received_at)
+            TextProcessor("1-111-1111", contacts=contacts).write_and_process(message="END",
+                                                                             date=self.received_at.replace(minute=30))
+        self.assertEqual(self.contact_queries(context.captured_queries), [])
+        self.assertTrue(Contact.objects.get(name="Roland", phone_number="1-111-1111").cancelled)
@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+from datetime import datetime
+from unittest import skipIf, skipUnless
+
+from django.db import connection
+from django.test import TestCase
+from freezegun import freeze_time
+from mock import patch
+
+from management.models import Contact, Group, ScheduledReminder
+from modules.contact_staging import copy_upsert, copy_value
+from modules.upload_contacts_from_file import csv_upload, make_contact_dict
+
+FAKE_NOW = datetime(2017, 8, 1, 12, 0)
+COLUMNS = ["Name", "Phone Number", "Date of Birth", "Language Preference", "Groups", "Date of Sign Up"]
+
+
+def entry(name, phone_number, date_of_birth, groups=""):
+    row = dict(zip(COLUMNS, [name, phone_number, date_of_birth, "English", groups, "2017-07-20"]))
+    return make_contact_dict(row, "TR"), groups
+
+
+def uploaded_contacts():
+    """Everything an upload writes, without the ids, which differ between engines."""
+    contacts = {}
+    for contact in Contact.objects.prefetch_related('group_set', 'scheduled_reminders'):
+        values = {field.attname: getattr(contact, field.attname) for field in Contact._meta.concrete_fields
+                  if not field.primary_key}
+        values["groups"] = sorted(group.name for group in contact.group_set.all())
+        values["reminders"] = sorted((reminder.due_date, reminder.kind)
+                                     for reminder in contact.scheduled_reminders.all())
+        contacts[(contact.name, contact.phone_number)] = values
+    return contacts
+
+
+class CopyValueTests(TestCase):
+    def test_escapes_text_format_specials(self):
+        self.assertEqual(copy_value(None), "\\N")
+        self.assertEqual(copy_value("a\tb\nc\\N\r"), "a\\tb\\nc\\\\N\\r")
+        self.assertEqual(copy_value(True), "True")
+        self.assertEqual(copy_value(datetime(2017, 1, 5).date()), "2017-01-05")
+        self.assertEqual(copy_value("आरव"), "आरव")
+
+
+class CsvUploadEngineTests(TestCase):
+    def test_unknown_engine(self):
+        with self.assertRaises(ValueError):
+            csv_upload("tests/data/example.csv", source="TR", engine="bulk")
+
+    @skipIf(connection.vendor == "postgresql", "COPY is used on PostgreSQL")
+    @patch("modules.upload_contacts_from_file.copy_upsert")
+    @patch("modules.upload_contacts_from_file.upsert_contacts")
+    def test_copy_falls_back_to_chunks(self, mocked_upsert, mocked_copy):
+        csv_upload("tests/data/example.csv", source="TR", engine="copy")
+        self.assertTrue(mocked_upsert.called)
+        self.assertFalse(mocked_copy.called)
+
+
+@skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL")
+class CopyUpsertTests(TestCase):
+    @freeze_time(FAKE_NOW)
+    def test_creates_and_updates_contacts(self):
+        existing = Contact.objects.create(name="Aaarsh", phone_number="911234567890",
+                                          date_of_birth=datetime(2017, 1, 5).date())
+        Group.objects.create(name="Everyone - English").contacts.add(existing)
+        staged = copy_upsert([entry("Aaarsh", "911234567890", "2017-06-10", "Everyone - English, Sample"),
+                              entry("Sai", "911234567891", "2017-07-10", "Everyone - English"),
+                              entry("Sai", "911234567891", "2017-07-11", "Sample"),
+                              entry("Tab\tName", "911234567892", "2017-07-12")])
+        self.assertEqual(staged, 4)
+        self.assertEqual(Contact.objects.count(), 3)
+        existing.refresh_from_db()
+        self.assertEqual(existing.date_of_birth, datetime(2017, 6, 10).date())
+        self.assertEqual(sorted(existing.group_set.values_list("name", flat=True)),
+                         ["Everyone - English", "Sample"])
+        sai = Contact.objects.get(name="Sai")
+        self.assertEqual(sai.date_of_birth, datetime(2017, 7, 11).date())
+        self.assertEqual(sorted(sai.group_set.values_list("name", flat=True)), ["Everyone - English", "Sample"])
+        self.assertTrue(Contact.objects.filter(name="Tab\tName").exists())
+        self.assertEqual(Contact.objects.create(name="Next", phone_number="911234567893").pk,
+                         Contact.objects.order_by("pk").values_list("pk", flat=True)[2] + 1)
+
+    @freeze_time(FAKE_NOW)
+    def test_reschedules_only_changed_dates_of_birth(self):
+        moved = Contact.objects.create(name="Aaarsh", phone_number="911234567890",
+                                       date_of_birth=datetime(2017, 1, 5).date())
+        kept = Contact.objects.create(name="Sai", phone_number="911234567891",
+                                      date_of_birth=datetime(2017, 7, 10).date())
+        kept_reminders = list(ScheduledReminder.objects.filter(contact=kept).values_list("pk", flat=True))
+        copy_upsert([entry("Aaarsh", "911234567890", "2017-06-10"), entry("Sai", "911234567891", "2017-07-10")])
+        self.assertFalse(ScheduledReminder.objects.filter(contact=moved,
+                                                          due_date__lt=datetime(2017, 6, 10).date()).exists())
+        self.assertEqual(ScheduledReminder.objects.filter(contact=moved).count(), len(kept_reminders))
+        self.assertEqual(list(ScheduledReminder.objects.filter(contact=kept).values_list("pk", flat=True)),
+                         kept_reminders)
+
+    @freeze_time(FAKE_NOW)
+    def test_matches_the_orm_engine_on_example_files(self):
+        for path, source in [("tests/data/example.csv", "TR"), ("tests/data/example-m.csv", "MAPS"),
+                             ("tests/data/example-h.csv", "HANSA"), ("tests/data/example-w.csv", "WARDHA")]:
+            csv_upload(path, source, engine="orm")
+            csv_upload(path, source, engine="orm")
+            by_orm = uploaded_contacts()
+            Contact.objects.all().delete()
+            csv_upload(path, source, engine="copy")
+            csv_upload(path, source, engine="copy")
+            self.assertEqual(uploaded_contacts(), by_orm)
+            Contact.objects.all().delete()
@@ -16,26 +16,31 @@ class HspsmsSendingTests(TestCase):
         self.assertIsInstance(hspsms, Hspsms)
 
 
-    @patch("modules.hspsmswrapper.request")
-    def test_send_transactional_message(self, mock_request):
-        class MockResponse():
-            def read(self):
-                return json.dumps({'message': 'yay'}).encode('latin1')
-        mock_request.urlopen.return_value = MockResponse()
+    @patch("modules.hspsmswrapper.shared_pool")
+    def test_send_transactional_message(self, mock_pool):
+        mock_pool.post.return_value = json.dumps({'message': 'yay'}).encode('latin1')
         hspsms = Hspsms(apikey='mock_key',
                         username='mock_user',
                         sendername='mock_sendername')
         response = hspsms.send_transactional_message(message='Test', phone_number='0000000')
         self.assertEqual(response['message'], 'yay')
 
-    @patch("modules.hspsmswrapper.request")
-    def test_send_transactional_message_hindi(self, mock_request):
-        class MockResponse():
-            def read(self):
-                return json.dumps({'message': hindi_remind()}).encode('latin1')
-        mock_request.urlopen.return_value = MockResponse()
+    @patch("modules.hspsmswrapper.shared_pool")
+    def test_send_transactional_message_hindi(self, mock_pool):
+        mock_pool.post.return_value = json.dumps({'message': hindi_remind()}).encode('latin1')
         hspsms = Hspsms(apikey='mock_key',
                         username='mock_user',
                         sendername='mock_sendername')
         response = hspsms.send_transactional_message(message='Test', phone_number='0000000')
         self.assertEqual(response['message'], hindi_remind())
+
+    @patch("modules.hspsmswrapper.shared_pool")
+    def test_send_transactional_message_takes_from_rate_limiter(self, mock_pool):
+        mock_pool.post.return_value = json.dumps({'message': 'yay'}).encode('latin1')
+        rate_limiter = mock.Mock()
+        hspsms = Hspsms(apikey='mock_key',
+                        username='mock_user',
+                        sendername='mock_sendername',
+                        rate_limiter=rate_limiter)
+        hspsms.send_transactional_message(message='Test', phone_number='0000000')
+        rate_limiter.acquire.assert_called_once_with()
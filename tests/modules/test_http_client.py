@@ -0,0 +1,109 @@
+import json
+import socket
+import time
+from django.test import TestCase
+from mock import patch
+from six.moves import http_client
+
+from modules.http_client import ConnectionPool
+from tests.fixtures import FakeProviderServer
+
+
+class ConnectionPoolTests(TestCase):
+    def test_get_with_params(self):
+        with FakeProviderServer(response={'messages': []}) as server:
+            pool = ConnectionPool()
+            response = pool.get(server.api_url + 'get_messages/?', {'apikey': 'mock_key'})
+            pool.close()
+        self.assertEqual(json.loads(response.decode('latin1')), {'messages': []})
+        self.assertEqual(server.requests, [('/get_messages/?apikey=mock_key', {'apikey': ['mock_key']})])
+
+    def test_post(self):
+        with FakeProviderServer() as server:
+            pool = ConnectionPool()
+            pool.post(server.api_url + 'send/?', {'numbers': '911111111111', 'message': 'Test'})
+            pool.close()
+        self.assertEqual(server.requests, [('/send/', {'numbers': ['911111111111'], 'message': ['Test']})])
+
+    def test_connection_is_reused(self):
+        with FakeProviderServer() as server:
+            pool = ConnectionPool()
+            for _ in range(5):
+                pool.post(server.api_url + 'send/?', {'message': 'Test'})
+            pool.close()
+        self.assertEqual(len(server.requests), 5)
+        self.assertEqual(len(set(server.client_ports)), 1)
+
+    def test_pool_size_limits_idle_connections(self):
+        with FakeProviderServer() as server:
+            pool = ConnectionPool(pool_size=1)
+            host = ('http', '127.0.0.1', server.server.server_address[1])
+            first, _ = pool.take_connection(host)
+            second, _ = pool.take_connection(host)
+            pool.return_connection(host, first)
+            pool.return_connection(host, second)
+            self.assertEqual(pool.idle_connections[host], [first])
+            pool.close()
+
+    def test_timeout_is_passed_to_connections(self):
+        pool = ConnectionPool(timeout=5)
+        self.assertEqual(pool.new_connection(('https', 'api.textlocal.in', None)).timeout, 5)
+
+    def test_retries_when_idle_connection_was_closed(self):
+        with FakeProviderServer() as server:
+            pool = ConnectionPool()
+            pool.post(server.api_url + 'send/?', {'message': 'First'})
+            host = ('http', '127.0.0.1', server.server.server_address[1])
+            # Writing to the shut down connection fails with a broken pipe, as when the provider has closed it
+            pool.idle_connections[host][0].sock.shutdown(socket.SHUT_WR)
+            pool.post(server.api_url + 'send/?', {'message': 'Second'})
+            pool.close()
+        self.assertEqual([params['message'] for _, params in server.requests], [['First'], ['Second']])
+
+    def test_retries_get_when_idle_connection_closed_without_a_response(self):
+        with FakeProviderServer(response={'messages': []}) as server:
+            pool = ConnectionPool()
+            pool.get(server.api_url + 'get_messages/?', {'apikey': 'First'})
+            host = ('http', '127.0.0.1', server.server.server_address[1])
+            idle = pool.idle_connections[host][0]
+            with patch.object(idle, "request"), \
+                 patch.object(idle, "getresponse", side_effect=http_client.BadStatusLine("''")):
+                pool.get(server.api_url + 'get_messages/?', {'apikey': 'Second'})
+            pool.close()
+        self.assertEqual([params['apikey'] for _, params in server.requests], [['First'], ['Second']])
+
+    def test_does_not_retry_post_when_connection_closed_after_the_request_was_sent(self):
+        with FakeProviderServer() as server:
+            pool = ConnectionPool()
+            pool.post(server.api_url + 'send/?', {'message': 'First'})
+            host = ('http', '127.0.0.1', server.server.server_address[1])
+            idle = pool.idle_connections[host][0]
+            # The provider takes the send, then drops the connection without answering
+            with patch.object(idle, "getresponse", side_effect=http_client.BadStatusLine("''")):
+                with self.assertRaises(http_client.BadStatusLine):
+                    pool.post(server.api_url + 'send/?', {'message': 'Second'})
+            pool.close()
+            # A retry would have been written before post() returned, so give the server time to read them all
+            deadline = time.time() + 5
+            while len(server.requests) < 2 and time.time() < deadline:
+                time.sleep(0.01)
+            time.sleep(0.1)
+        self.assertEqual([params['message'] for _, params in server.requests], [['First'], ['Second']])
+
+    def test_does_not_retry_after_a_timeout(self):
+        with FakeProviderServer() as server:
+            pool = ConnectionPool(timeout=0.5)
+            pool.post(server.api_url + 'send/?', {'message': 'First'})
+            server.server.delay = 1
+            with self.assertRaises(socket.timeout):
+                pool.post(server.api_url + 'send/?', {'message': 'Second'})
+            requests = list(server.requests)
+            pool.close()
+        self.assertEqual([params['message'] for _, params in requests], [['First'], ['Second']])
+
+    def test_error_status_raises(self):
+        with FakeProviderServer(status=500) as server:
+            pool = ConnectionPool()
+            with self.assertRaises(IOError):
+                pool.post(server.api_url + 'send/?', {'message': 'Test'})
+            pool.close()
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta
+from mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils import timezone
+
+from management.models import Contact, Message
+from modules.i18n import msg_subscribe, msg_unsubscribe
+from modules.inbound_queue import process_batch, run_worker
+from modules.text_processor import TextProcessor
+
+
+@patch("modules.text_processor.Texter.send")
+class InboundQueueTests(TestCase):
+    def setUp(self):
+        self.received_at = datetime(2017, 8, 1, 15, 20, 20).replace(tzinfo=timezone.get_default_timezone())
+        # Inside the test's transaction this would close the connection on PostgreSQL
+        close_old_connections = patch("modules.inbound_queue.close_old_connections")
+        close_old_connections.start()
+        self.addCleanup(close_old_connections.stop)
+
+    def store(self, phone_number, body, minutes=0):
+        return TextProcessor(phone_number).write_to_database(message=body,
+                                                             date=self.received_at + timedelta(minutes=minutes))
+
+    def test_process_batch_processes_oldest_first(self, mocked_send):
+        self.store("1-111-1111", "END", minutes=5)
+        self.store("1-111-1111", "JOIN ROLAND 29/5/2017")
+        self.assertEqual(process_batch(), 2)
+        self.assertFalse(Message.objects.filter(direction="Incoming", is_processed=False).exists())
+        self.assertEqual([kwargs['message'] for _, kwargs in mocked_send.call_args_list],
+                         [msg_subscribe("English").format(name="Roland"), msg_unsubscribe("English")])
+        self.assertTrue(Contact.objects.get(name="Roland").cancelled)
+
+    def test_process_batch_claims_at_most_batch_size(self, mocked_send):
+        for minutes in range(3):
+            self.store("1-111-111{}".format(minutes), "JOIN ROLAND 29/5/2017", minutes=minutes)
+        self.assertEqual(process_batch(batch_size=2), 2)
+        self.assertEqual(Message.objects.filter(direction="Incoming", is_processed=False).count(), 1)
+
+    def test_processed_messages_are_not_claimed_again(self, mocked_send):
+        self.store("1-111-1111", "JOIN ROLAND 29/5/2017")
+        process_batch()
+        self.assertEqual(process_batch(), 0)
+        self.assertEqual(mocked_send.call_count, 1)
+
+    def test_failures_are_retried_then_left(self, mocked_send):
+        mocked_send.side_effect = IOError("Provider unavailable")
+        message = self.store("1-111-1111", "JOIN ROLAND 29/5/2017")
+        with patch("logging.error") as mocked_error:
+            self.assertEqual(run_worker(once=True), 3)
+        message.refresh_from_db()
+        self.assertFalse(message.is_processed)
+        self.assertEqual(message.processing_attempts, 3)
+        self.assertEqual(mocked_error.call_count, 3)
+        # The failed attempts are rolled back, so no reply is recorded
+        self.assertFalse(Message.objects.filter(direction="Outgoing").exists())
+
+    def test_later_texts_wait_for_a_failing_earlier_one(self, mocked_send):
+        mocked_send.side_effect = [IOError("Provider unavailable"), None, None]
+        self.store("1-111-1111", "JOIN ROLAND 29/5/2017")
+        end = self.store("1-111-1111", "END", minutes=5)
+        with patch("logging.error"):
+            self.assertEqual(process_batch(), 1)
+            end.refresh_from_db()
+            self.assertFalse(end.is_processed)
+            self.assertEqual(process_batch(), 2)
+        end.refresh_from_db()
+        self.assertTrue(end.is_processed)
+        self.assertTrue(Contact.objects.get(name="Roland").cancelled)
+
+    def test_receive_leaves_processing_to_workers(self, mocked_send):
+        with patch("modules.text_processor.PROCESS_INBOUND_IN_WORKERS", True):
+            message = TextProcessor("1-111-1111").receive(message="JOIN ROLAND 29/5/2017", date=self.received_at)
+        self.assertFalse(message.is_processed)
+        self.assertFalse(mocked_send.called)
+        call_command('process_inbound', once=True)
+        message.refresh_from_db()
+        self.assertTrue(message.is_processed)
+        self.assertEqual(mocked_send.call_count, 1)
+
+    def test_several_workers_need_skip_locked(self, mocked_send):
+        with patch("django.db.connection.features.has_select_for_update_skip_locked", False):
+            with self.assertRaises(CommandError):
+                call_command('process_inbound', workers=2, once=True)
@@ -0,0 +1,99 @@
+from datetime import datetime
+from mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+from freezegun import freeze_time
+
+from management.models import ArchivedMessage, Contact, Message, MessageSummary
+from modules.contact_cache import ContactCache
+from modules.i18n import msg_already_sub, msg_subscribe
+from modules.message_archive import archive_messages
+from modules.text_processor import TextProcessor
+
+OLD = datetime(2017, 1, 10, 12, 0)
+RECENT = datetime(2017, 8, 1, 12, 0)
+FAKE_NOW = datetime(2017, 8, 2, 12, 0)
+
+
+class MessageArchiveTests(TestCase):
+    def setUp(self):
+        self.contact = Contact.objects.create(name="Roland", phone_number="1-111-1111")
+
+    def message(self, created_at, direction="Outgoing", body="Hello", is_processed=True, contact=None):
+        with freeze_time(created_at):
+            return Message.objects.create(contact=contact or self.contact, direction=direction,
+                                          body=body, is_processed=is_processed)
+
+    @freeze_time(FAKE_NOW)
+    def test_moves_old_messages(self):
+        old = self.message(OLD, body="Old")
+        recent = self.message(RECENT, body="Recent")
+        self.assertEqual(archive_messages(days=180), 1)
+        self.assertEqual(list(Message.objects.values_list('id', flat=True)), [recent.id])
+        archived = ArchivedMessage.objects.get()
+        self.assertEqual((archived.id, archived.body, archived.body_key, archived.direction),
+                         (old.id, "Old", old.body_key, "Outgoing"))
+        self.assertEqual(archived.created_at, timezone.make_aware(OLD, timezone.utc))
+
+    @freeze_time(FAKE_NOW)
+    def test_leaves_unprocessed_incoming_messages(self):
+        self.message(OLD, direction="Incoming", body="END", is_processed=False)
+        self.assertEqual(archive_messages(days=180), 0)
+        self.assertEqual(Message.objects.count(), 1)
+
+    @freeze_time(FAKE_NOW)
+    def test_summarises_archived_messages(self):
+        self.message(OLD, direction="Incoming", body="JOIN")
+        self.message(OLD.replace(day=11))
+        archive_messages(days=180, batch_size=1)
+        self.message(OLD.replace(day=20))
+        archive_messages(days=180)
+        summary = MessageSummary.objects.get(contact=self.contact)
+        self.assertEqual((summary.incoming_count, summary.outgoing_count), (1, 2))
+        self.assertEqual(summary.first_message_at, timezone.make_aware(OLD, timezone.utc))
+        self.assertEqual(summary.last_message_at, timezone.make_aware(OLD.replace(day=20), timezone.utc))
+
+    @freeze_time(FAKE_NOW)
+    def test_archives_in_batches(self):
+        for day in range(1, 6):
+            self.message(OLD.replace(day=day))
+        # Each batch is a savepoint, read, insert, summary read and write, and delete, plus a last empty read
+        with self.assertNumQueries(3 * 8 + 3):
+            self.assertEqual(archive_messages(days=180, batch_size=2), 5)
+        self.assertEqual(ArchivedMessage.objects.count(), 5)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    def test_command(self, mocked_logger):
+        self.message(OLD)
+        self.message(RECENT)
+        call_command('archive_messages', days=0)
+        self.assertEqual(ArchivedMessage.objects.count(), 2)
+        mocked_logger.assert_called_with("Archived 2 messages")
+
+    @freeze_time(FAKE_NOW)
+    def test_was_sent_reads_the_archive(self):
+        self.message(OLD, body="Welcome")
+        archive_messages(days=180)
+        cache = ContactCache(["1-111-1111"], prefetch=True)
+        roland = cache.get(self.contact.pk)
+        self.assertTrue(cache.was_sent(roland, "Welcome"))
+        self.assertFalse(cache.was_sent(roland, "Goodbye"))
+
+    def test_was_sent_skips_the_archive_without_archived_messages(self):
+        cache = ContactCache(["1-111-1111"], prefetch=True)
+        roland = cache.get(self.contact.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(cache.was_sent(roland, "Welcome"))
+
+    @freeze_time(FAKE_NOW)
+    @patch("modules.text_processor.Texter.send")
+    def test_archived_subscription_is_still_a_duplicate(self, mocked_send):
+        self.message(OLD, body=msg_subscribe("English").format(name="Roland"))
+        archive_messages(days=180)
+        response = TextProcessor("1-111-1111").process(self.message(RECENT, direction="Incoming",
+                                                                    body="JOIN ROLAND 29/5/2017",
+                                                                    is_processed=False))
+        self.assertEqual(response, msg_already_sub("English"))
@@ -0,0 +1,62 @@
+import time
+from mock import patch
+from django.test import TestCase
+
+from modules import providers
+from modules.texter import Texter
+from modules.textlocalwrapper import TextLocal
+from modules.hspsmswrapper import Hspsms
+from tests.fixtures import FakeProviderServer
+
+
+class ProvidersTests(TestCase):
+    def setUp(self):
+        providers.close_all()
+
+    def tearDown(self):
+        providers.close_all()
+
+    def test_clients_are_created_once(self):
+        self.assertIsInstance(providers.textlocal(), TextLocal)
+        self.assertIsInstance(providers.hspsms(), Hspsms)
+        self.assertIs(providers.textlocal(), providers.textlocal())
+        self.assertIs(providers.hspsms(), providers.hspsms())
+        self.assertIsNot(providers.textlocal().http, providers.hspsms().http)
+
+    def test_each_provider_has_its_own_rate_limiter(self):
+        self.assertIs(providers.textlocal().rate_limiter, providers.rate_limiter("textlocal"))
+        self.assertIs(providers.hspsms().rate_limiter, providers.rate_limiter("hspsms"))
+        self.assertIsNot(providers.textlocal().rate_limiter, providers.hspsms().rate_limiter)
+
+    def test_texters_share_the_client(self):
+        self.assertIs(Texter().textlocal, Texter().textlocal)
+        self.assertIs(Texter().textlocal, providers.textlocal())
+
+    def test_close_all_replaces_clients(self):
+        textlocal = providers.textlocal()
+        providers.close_all()
+        self.assertIsNot(providers.textlocal(), textlocal)
+
+    def test_stats_count_requests_and_connections(self):
+        with FakeProviderServer() as server:
+            providers.textlocal().api_url = server.api_url
+            for _ in range(3):
+                Texter().send(message="Test", phone_number="911111111111")
+        self.assertEqual(providers.stats(), {"textlocal": {"requests_made": 3,
+                                                           "connections_opened": 1,
+                                                           "rate_limit_waits": 0,
+                                                           "seconds_waited_for_rate_limit": 0}})
+
+    @patch("modules.providers.SMS_RATE_LIMITS", {"textlocal": {"rate": 20, "burst": 2}})
+    def test_sends_wait_for_the_rate_limit(self):
+        with FakeProviderServer() as server:
+            providers.textlocal().api_url = server.api_url
+            start = time.time()
+            for _ in range(4):
+                Texter().send(message="Test", phone_number="911111111111")
+            elapsed = time.time() - start
+        usage = providers.stats()["textlocal"]
+        self.assertEqual(usage["rate_limit_waits"], 2)
+        self.assertGreater(usage["seconds_waited_for_rate_limit"], 0)
+        # Two sends come out of the burst, the next two wait about 0.05 seconds each
+        self.assertGreaterEqual(elapsed, 0.09)
@@ -0,0 +1,69 @@
+import threading
+
+from django.test import TestCase
+
+from modules.rate_limiter import TokenBucket
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+    def bucket(self, rate, burst=None):
+        return TokenBucket(rate=rate, burst=burst, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_burst_goes_out_without_waiting(self):
+        bucket = self.bucket(rate=5)
+        for _ in range(5):
+            self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(self.clock.sleeps, [])
+        self.assertEqual(bucket.waits, 0)
+
+    def test_waits_for_the_next_token_once_empty(self):
+        bucket = self.bucket(rate=5)
+        for _ in range(5):
+            bucket.acquire()
+        self.assertAlmostEqual(bucket.acquire(), 0.2)
+        self.assertAlmostEqual(bucket.acquire(), 0.2)
+        self.assertEqual(bucket.waits, 2)
+        self.assertAlmostEqual(bucket.seconds_waited, 0.4)
+
+    def test_refills_over_time_up_to_burst(self):
+        bucket = self.bucket(rate=10, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.clock.now += 60
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertEqual(bucket.acquire(), 0)
+        self.assertAlmostEqual(bucket.acquire(), 0.1)
+
+    def test_reservations_queue_up(self):
+        bucket = self.bucket(rate=10, burst=1)
+        waits = [bucket.reserve() for _ in range(4)]
+        for wait, expected in zip(waits, [0, 0.1, 0.2, 0.3]):
+            self.assertAlmostEqual(wait, expected)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_limits_concurrent_senders_together(self):
+        bucket = self.bucket(rate=10, burst=1)
+        threads = [threading.Thread(target=bucket.reserve) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # Twenty requests at ten a second: the last has to wait for nineteen tokens to refill
+        self.assertAlmostEqual(bucket.tokens, -19)
+        self.assertEqual(bucket.waits, 19)
@@ -0,0 +1,106 @@
+from __future__ import unicode_literals
+import csv
+import os
+import tempfile
+from datetime import datetime
+
+from django.core.management import call_command
+from django.test import TestCase
+from freezegun import freeze_time
+from mock import patch
+
+from management.models import Contact, UploadCheckpoint
+from modules.resumable_upload import UploadProgress, count_rows, file_hash, resumable_upload
+from modules.upload_contacts_from_file import upsert_contacts
+
+FAKE_NOW = datetime(2017, 8, 1, 12, 0)
+COLUMNS = ["Name", "Phone Number", "Date of Birth", "Date of Sign Up"]
+
+
+class FailingUpsert(object):
+    """Stands in for upsert_contacts, failing on the `fail_on`th call."""
+    def __init__(self, fail_on):
+        self.fail_on = fail_on
+        self.calls = []
+
+    def __call__(self, entries):
+        self.calls.append([new_dict["name"] for new_dict, _ in entries])
+        if len(self.calls) == self.fail_on:
+            raise KeyboardInterrupt()
+        upsert_contacts(entries)
+
+
+class ResumableUploadTests(TestCase):
+    def write_csv(self, rows):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+        return path
+
+    def contact_rows(self, count):
+        return [["Child {}".format(i), "9112345678{:02d}".format(i), "2017-07-10", "2017-07-20"] for i in range(count)]
+
+    def test_file_hash_and_count_rows(self):
+        path = self.write_csv([["Roland", "911234567890", "2017-07-10\nor so", "2017-07-20"], [],
+                               ["Sai", "911234567891", "2017-07-10", "2017-07-20"]])
+        self.assertEqual(count_rows(path), 2)
+        self.assertEqual(file_hash(path), file_hash(path))
+        self.assertNotEqual(file_hash(path), file_hash(self.write_csv([])))
+
+    @freeze_time(FAKE_NOW)
+    def test_uploads_and_marks_the_file_finished(self):
+        path = self.write_csv(self.contact_rows(5))
+        self.assertEqual(resumable_upload(path, "TR", chunk_size=2), 5)
+        self.assertEqual(Contact.objects.count(), 5)
+        checkpoint = UploadCheckpoint.objects.get()
+        self.assertEqual((checkpoint.file_hash, checkpoint.source, checkpoint.rows_done),
+                         (file_hash(path), "TR", 5))
+        self.assertIsNotNone(checkpoint.finished_at)
+
+    @freeze_time(FAKE_NOW)
+    def test_resumes_after_the_last_committed_chunk(self):
+        path = self.write_csv(self.contact_rows(5))
+        interrupted = FailingUpsert(fail_on=2)
+        with patch("modules.upload_contacts_from_file.upsert_contacts", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                resumable_upload(path, "TR", chunk_size=2)
+        self.assertEqual(Contact.objects.count(), 2)
+        self.assertEqual(UploadCheckpoint.objects.get().rows_done, 2)
+
+        resumed = FailingUpsert(fail_on=None)
+        with patch("modules.upload_contacts_from_file.upsert_contacts", resumed), patch("logging.info") as mocked_info:
+            self.assertEqual(resumable_upload(path, "TR", chunk_size=2), 3)
+        self.assertEqual(resumed.calls, [["Child 2", "Child 3"], ["Child 4"]])
+        mocked_info.assert_any_call("Resuming {} at row 2 of 5".format(path))
+        self.assertEqual(Contact.objects.count(), 5)
+
+    @freeze_time(FAKE_NOW)
+    def test_finished_files_are_skipped_unless_restarted(self):
+        path = self.write_csv(self.contact_rows(3))
+        resumable_upload(path, "TR")
+        self.assertEqual(resumable_upload(path, "TR"), 0)
+        self.assertEqual(resumable_upload(path, "MAPS"), 3)
+        self.assertEqual(resumable_upload(path, "TR", restart=True), 3)
+        self.assertEqual(UploadCheckpoint.objects.count(), 2)
+
+    @patch("logging.info")
+    def test_progress_reports_rate_and_time_left(self, mocked_info):
+        now = [100.0]
+        progress = UploadProgress(total=1000, start_row=200, interval=10, clock=lambda: now[0])
+        now[0] = 105.0
+        progress.report(400)
+        self.assertFalse(mocked_info.called)
+        now[0] = 110.0
+        progress.report(600)
+        mocked_info.assert_called_with("Uploaded 600 of 1000 rows (60.0%), 40 rows/s, 0:00:10 left")
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    def test_command(self, mocked_info):
+        path = self.write_csv(self.contact_rows(3))
+        call_command('upload_contacts', path, "TR", chunk_size=2)
+        self.assertEqual(Contact.objects.count(), 3)
+        mocked_info.assert_called_with("Uploaded 3 rows from {}".format(path))
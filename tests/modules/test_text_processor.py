@@ -4,9 +4,9 @@ from django.test import TestCase
 from django.utils import timezone
 from freezegun import freeze_time
 
-from management.models import Contact, Message
+from management.models import Contact, Group, Message
 from modules.utils import quote
-from modules.text_processor import TextProcessor
+from modules.text_processor import TextProcessor, incoming_message_key, unseen_messages
 from modules.i18n import hindi_remind, hindi_information, msg_placeholder_child, \
                          msg_subscribe, msg_unsubscribe, msg_failure, msg_failed_date, \
                          msg_already_sub, hindi_born
@@ -1999,4 +1999,79 @@ class TextProcessorProcessTests(TestCase):
         end_key_eng = t.get_language(language="English",
                                         inferred_language="English",
                                         keyword="end")
-        self.assertEqual("English", end_key_eng)
\ No newline at end of file
+        self.assertEqual("English", end_key_eng)
+
+
+class IncomingMessageDedupTests(TestCase):
+    def setUp(self):
+        self.received_at = datetime(2018, 3, 15, 1, 2, 2).replace(tzinfo=timezone.get_default_timezone())
+
+    def test_write_to_database_stores_a_text_once(self):
+        t = TextProcessor(phone_number="1-111-1111")
+        first = t.write_to_database(message="JOIN Marshall 20-10-2017", date=self.received_at)
+        second = t.write_to_database(message="JOIN Marshall 20-10-2017", date=self.received_at)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(Message.objects.filter(direction="Incoming").count(), 1)
+        self.assertEqual(first.provider_key, incoming_message_key("1-111-1111", "JOIN Marshall 20-10-2017", self.received_at))
+
+    def test_same_text_at_another_time_is_stored_again(self):
+        t = TextProcessor(phone_number="1-111-1111")
+        t.write_to_database(message="END", date=self.received_at)
+        t.write_to_database(message="END", date=self.received_at.replace(hour=2))
+        self.assertEqual(Message.objects.filter(direction="Incoming", body="END").count(), 2)
+
+    def test_unseen_messages_drops_processed_texts(self):
+        incoming = TextProcessor(phone_number="1-111-1111").write_to_database(message="END", date=self.received_at)
+        Message.objects.filter(pk=incoming.pk).update(is_processed=True)
+        later = self.received_at.replace(hour=2)
+        inbox = {"1-111-1111": [("END", self.received_at), ("JOIN Marshall 20-10-2017", later)],
+                 "1-111-2222": [("END", self.received_at)]}
+        with self.assertNumQueries(1):
+            unseen = unseen_messages(inbox)
+        self.assertEqual(unseen, {"1-111-1111": [("JOIN Marshall 20-10-2017", later)],
+                                  "1-111-2222": [("END", self.received_at)]})
+
+    def test_unseen_messages_keeps_stored_texts_that_were_not_processed(self):
+        TextProcessor(phone_number="1-111-1111").write_to_database(message="END", date=self.received_at)
+        inbox = {"1-111-1111": [("END", self.received_at)]}
+        self.assertEqual(unseen_messages(inbox), inbox)
+
+    @patch("modules.text_processor.PROVIDER_KEY_CHUNK_SIZE", 2)
+    def test_unseen_messages_looks_up_keys_in_chunks(self):
+        inbox = {"1-111-1111": [("END", self.received_at.replace(minute=minute)) for minute in range(5)]}
+        with self.assertNumQueries(3):
+            unseen = unseen_messages(inbox)
+        self.assertEqual(len(unseen["1-111-1111"]), 5)
+
+
+@patch("logging.info")
+@patch("modules.text_processor.Texter.send")
+class TextProcessorQueryTests(TestCase):
+    def setUp(self):
+        for name in ["Text Sign Ups", "Text Sign Ups - English", "Everyone - English"]:
+            Group.objects.create(name=name)
+
+    def receive(self, body, minute):
+        received_at = datetime(2018, 3, 15, 1, minute, 2).replace(tzinfo=timezone.get_default_timezone())
+        TextProcessor(phone_number="1-111-1111").write_and_process(message=body, date=received_at)
+
+    def test_join_from_a_new_number(self, mocked_send, mocked_logger):
+        # Storing the text creates the contact and schedules its reminders. Answering it writes the contact's
+        # changes once, reschedules its reminders and adds it to its groups
+        with self.assertNumQueries(23):
+            self.receive("JOIN Marshall 20-10-2017", 1)
+        contact = Contact.objects.get(phone_number="1-111-1111")
+        self.assertEqual(contact.date_of_birth, datetime(2017, 10, 20).date())
+        self.assertEqual(contact.group_set.count(), 3)
+        self.assertEqual(contact.last_contacted, Message.objects.get(direction="Outgoing").created_at)
+
+    def test_repeated_join_and_end(self, mocked_send, mocked_logger):
+        self.receive("JOIN Marshall 20-10-2017", 1)
+        with self.assertNumQueries(13), patch("logging.error"):
+            self.receive("JOIN Marshall 20-10-2017", 2)
+        with self.assertNumQueries(12):
+            self.receive("END", 3)
+        contact = Contact.objects.get(phone_number="1-111-1111")
+        self.assertTrue(contact.cancelled)
+        self.assertEqual(contact.last_heard_from, Message.objects.get(body="END").created_at)
+
@@ -1,3 +1,4 @@
+import threading
 import mock
 from mock import patch
 from freezegun import freeze_time
@@ -5,11 +6,13 @@ from django.test import TestCase
 from django.utils import timezone
 
 from datetime import datetime
+from dateutil.relativedelta import relativedelta
 
 from tests.fixtures import contact_object, text_reminder_object
-from management.models import Message, Contact
+from management.models import Message, Contact, ScheduledReminder, message_body_key
 from modules.text_processor import TextProcessor
-from modules.text_reminder import TextReminder
+from modules.text_reminder import TextReminder, reminder_due_dates, reminder_targets, contacts_due_reminders, \
+                                  send_reminders
 from modules.i18n import six_week_reminder_seven_days, six_week_reminder_one_day, \
                          ten_week_reminder_seven_days, ten_week_reminder_one_day, \
                          fourteen_week_reminder_seven_days, fourteen_week_reminder_one_day, \
@@ -922,4 +925,275 @@ class TextReminderTests(TestCase):
         self.assertNotEqual(datetime.now().replace(tzinfo=timezone.get_default_timezone()), sixteen_months_message1.sent_at)
         self.assertNotEqual(datetime.now().replace(tzinfo=timezone.get_default_timezone()), sixteen_months_message2.sent_at)
         self.assertNotEqual(datetime.now().replace(tzinfo=timezone.get_default_timezone()), five_years_message1.sent_at)
-        self.assertNotEqual(datetime.now().replace(tzinfo=timezone.get_default_timezone()), five_years_message2.sent_at)
\ No newline at end of file
+        self.assertNotEqual(datetime.now().replace(tzinfo=timezone.get_default_timezone()), five_years_message2.sent_at)
+
+
+class ScheduledReminderTests(TestCase):
+    def test_reminder_due_dates(self):
+        due_dates = dict(reminder_due_dates(datetime(2017, 6, 12).date()))
+        self.assertEqual(len(due_dates), 12)
+        self.assertEqual(due_dates["six_week_reminder_seven_days"], datetime(2017, 7, 17).date())
+        self.assertEqual(due_dates["six_week_reminder_one_day"], datetime(2017, 7, 23).date())
+        self.assertEqual(due_dates["nine_month_reminder_seven_days"], datetime(2018, 3, 5).date())
+        self.assertEqual(due_dates["five_year_reminder_one_day"], datetime(2022, 6, 11).date())
+        self.assertFalse("verify_pregnant_signup_birthdate" in due_dates)
+
+    def test_reminder_due_dates_for_pregnancy_signups(self):
+        due_dates = reminder_due_dates(datetime(2017, 6, 12).date(), preg_signup=True)
+        self.assertEqual(len(due_dates), 14)
+        self.assertTrue(("verify_pregnant_signup_birthdate", datetime(2017, 6, 26).date()) in due_dates)
+        self.assertTrue(("verify_pregnant_signup_birthdate", datetime(2017, 7, 10).date()) in due_dates)
+
+    def test_reminder_due_dates_across_month_ends(self):
+        due_dates = reminder_due_dates(datetime(2020, 1, 1).date())
+        self.assertTrue(("nine_month_reminder_seven_days", datetime(2020, 9, 25).date()) in due_dates)
+        # Neither 2020-09-30 nor 2020-10-01 less nine months and a day is 2020-01-01
+        self.assertFalse("nine_month_reminder_one_day" in dict(due_dates))
+        due_dates = reminder_due_dates(datetime(2020, 3, 7).date())
+        self.assertTrue(("nine_month_reminder_seven_days", datetime(2020, 11, 29).date()) in due_dates)
+        self.assertTrue(("nine_month_reminder_seven_days", datetime(2020, 11, 30).date()) in due_dates)
+
+    def test_reminder_due_dates_agree_with_reminder_targets(self):
+        first_birthday, last_birthday = datetime(2019, 12, 1).date(), datetime(2020, 3, 31).date()
+        expected = {False: set(), True: set()}
+        day = first_birthday
+        while day <= last_birthday + relativedelta(years=5):
+            reminders, pregnancy_checks = reminder_targets(day)
+            for date_of_birth, reminder in reminders.items():
+                expected[False].add((date_of_birth, reminder.__name__, day))
+                expected[True].add((date_of_birth, reminder.__name__, day))
+            for date_of_birth, reminder in pregnancy_checks.items():
+                if date_of_birth not in reminders:
+                    expected[True].add((date_of_birth, reminder.__name__, day))
+            day += relativedelta(days=1)
+        date_of_birth = first_birthday
+        while date_of_birth <= last_birthday:
+            for preg_signup in [False, True]:
+                self.assertEqual(set((date_of_birth, kind, due_date) for kind, due_date
+                                     in reminder_due_dates(date_of_birth, preg_signup)),
+                                 set(due for due in expected[preg_signup] if due[0] == date_of_birth))
+            date_of_birth += relativedelta(days=1)
+
+    def test_schedule_created_with_contact(self):
+        contact = contact_object(date_of_birth="12/6/2017")
+        self.assertEqual(ScheduledReminder.objects.filter(contact=contact).count(), 12)
+        self.assertTrue(ScheduledReminder.objects.filter(contact=contact,
+                                                         due_date=datetime(2017, 7, 17).date(),
+                                                         kind="six_week_reminder_seven_days").exists())
+
+    def test_schedule_rebuilt_when_date_of_birth_changes(self):
+        contact = contact_object(date_of_birth="12/6/2017")
+        contact.date_of_birth = datetime(2017, 6, 19).date()
+        contact.save()
+        self.assertEqual(ScheduledReminder.objects.filter(contact=contact).count(), 12)
+        self.assertFalse(ScheduledReminder.objects.filter(due_date=datetime(2017, 7, 17).date()).exists())
+        self.assertTrue(ScheduledReminder.objects.filter(contact=contact,
+                                                         due_date=datetime(2017, 7, 24).date(),
+                                                         kind="six_week_reminder_seven_days").exists())
+
+    def test_schedule_rebuilt_when_loaded_contact_changes(self):
+        contact_object(date_of_birth="12/6/2017")
+        contact = Contact.objects.get(name="Roland")
+        contact.preg_signup = True
+        contact.save()
+        self.assertEqual(ScheduledReminder.objects.filter(contact=contact).count(), 14)
+
+    def test_schedule_untouched_by_unrelated_saves(self):
+        contact = contact_object(date_of_birth="12/6/2017")
+        ids = set(ScheduledReminder.objects.filter(contact=contact).values_list("id", flat=True))
+        contact = Contact.objects.get(pk=contact.pk)
+        contact.last_contacted = datetime(2017, 7, 17).replace(tzinfo=timezone.get_default_timezone())
+        contact.save()
+        self.assertEqual(ids, set(ScheduledReminder.objects.filter(contact=contact).values_list("id", flat=True)))
+
+    def test_contacts_due_reminders(self):
+        due = contact_object(name="Due", date_of_birth="12/6/2017")
+        contact_object(name="Not due", date_of_birth="13/6/2017")
+        cancelled = contact_object(name="Cancelled", date_of_birth="12/6/2017")
+        cancelled.cancelled = True
+        cancelled.save()
+        self.assertEqual(list(contacts_due_reminders(datetime(2017, 7, 17).date())), [due])
+
+
+class TextReminderDueOnTests(TestCase):
+    def test_reminder_targets(self):
+        reminders, pregnancy_checks = reminder_targets(FAKE_NOW.date())
+        self.assertEqual(len(reminders), 12)
+        self.assertEqual(reminders[datetime(2017, 6, 12).date()], six_week_reminder_seven_days)
+        self.assertEqual(reminders[datetime(2016, 10, 24).date()], nine_month_reminder_seven_days)
+        self.assertEqual(reminders[datetime(2012, 7, 18).date()], five_year_reminder_one_day)
+        self.assertEqual(pregnancy_checks, {datetime(2017, 7, 3).date(): verify_pregnant_signup_birthdate,
+                                            datetime(2017, 6, 19).date(): verify_pregnant_signup_birthdate})
+
+    def test_due_on(self):
+        six_weeks = contact_object(name="Six", phone_number="1-111-1111", date_of_birth="12/6/2017")
+        ten_weeks = contact_object(name="Ten", phone_number="1-111-1112", date_of_birth="15/5/2017")
+        contact_object(name="Not due", phone_number="1-111-1113", date_of_birth="13/6/2017")
+        cancelled = contact_object(name="Cancelled", phone_number="1-111-1114", date_of_birth="12/6/2017")
+        cancelled.cancelled = True
+        cancelled.save()
+        due = TextReminder.due_on(FAKE_NOW.date())
+        self.assertEqual(sorted(due, key=lambda pair: pair[0].name),
+                         [(six_weeks, six_week_reminder_seven_days), (ten_weeks, ten_week_reminder_seven_days)])
+
+    def test_due_on_pregnancy_checks(self):
+        unconfirmed = contact_object(name="Unconfirmed", phone_number="1-111-1111",
+                                     date_of_birth="3/7/2017", preg_signup=True)
+        contact_object(name="Confirmed", phone_number="1-111-1112", date_of_birth="3/7/2017",
+                       preg_signup=True, preg_update=True)
+        contact_object(name="Not pregnant", phone_number="1-111-1113", date_of_birth="3/7/2017")
+        self.assertEqual(TextReminder.due_on(FAKE_NOW.date()),
+                         [(unconfirmed, verify_pregnant_signup_birthdate)])
+
+    def test_due_on_within_given_contacts(self):
+        contact_object(name="Roland", phone_number="1-111-1111", date_of_birth="12/6/2017")
+        contact_object(name="Sai", phone_number="1-111-1112", date_of_birth="12/6/2017")
+        due = TextReminder.due_on(FAKE_NOW.date(), contacts=Contact.objects.filter(name="Sai"))
+        self.assertEqual([contact.name for contact, _ in due], ["Sai"])
+
+    def test_due_on_loads_contacts_in_one_query(self):
+        for i in range(5):
+            contact_object(name="Roland", phone_number="1-111-111" + str(i), date_of_birth="12/6/2017")
+        with self.assertNumQueries(1):
+            self.assertEqual(len(TextReminder.due_on(FAKE_NOW.date())), 5)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_remind_with_precomputed_reminder(self, mocked_send_text, mocked_logger):
+        contact = contact_object(date_of_birth="12/6/2017")
+        tr = TextReminder(contact, reminder=six_week_reminder_seven_days)
+        self.assertTrue(tr.remind())
+        mocked_send_text.assert_called_once_with(message=six_week_reminder_seven_days("English").format(name="Roland"),
+                                                 phone_number="1-111-1111")
+
+
+class SendRemindersTests(TestCase):
+    def due_contacts(self, count):
+        for i in range(count):
+            contact_object(name="Roland", phone_number="1-111-111" + str(i), date_of_birth="12/6/2017")
+        return TextReminder.due_on(FAKE_NOW.date())
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_records_messages(self, mocked_send_text, mocked_logger):
+        due_reminders = self.due_contacts(3)
+        self.assertEqual(send_reminders(due_reminders), 3)
+        # Identical reminders go out in one request
+        mocked_send_text.assert_called_once_with(message=six_week_reminder_seven_days("English").format(name="Roland"),
+                                                 phone_number="1-111-1110,1-111-1111,1-111-1112")
+        now = datetime.now().replace(tzinfo=timezone.get_default_timezone())
+        for contact, _ in due_reminders:
+            message = Message.objects.get(contact=contact, direction="Outgoing")
+            self.assertEqual(message.body, six_week_reminder_seven_days("English").format(name="Roland"))
+            self.assertEqual(message.body_key, message_body_key(message.body))
+            self.assertEqual(message.sent_at, now)
+            self.assertEqual(Contact.objects.get(pk=contact.pk).last_contacted, message.created_at)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_writes_in_chunks(self, mocked_send_text, mocked_logger):
+        due_reminders = self.due_contacts(6)
+        # Each chunk is one insert and one update, plus the transaction savepoints
+        with self.assertNumQueries(3 * 4):
+            self.assertEqual(send_reminders(due_reminders, chunk_size=2), 6)
+        self.assertEqual(Message.objects.filter(direction="Outgoing").count(), 6)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send_bulk")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_groups_by_message(self, mocked_send_text, mocked_send_bulk, mocked_logger):
+        contact_object(name="Roland", phone_number="1-111-1111", date_of_birth="12/6/2017")
+        contact_object(name="Sai", phone_number="1-111-1112", date_of_birth="12/6/2017")
+        contact_object(name="Roland", phone_number="1-111-1113", date_of_birth="12/6/2017")
+        contact_object(name="Roland", phone_number="1-111-1114", date_of_birth="15/5/2017")
+        self.assertEqual(send_reminders(TextReminder.due_on(FAKE_NOW.date())), 4)
+        mocked_send_text.assert_called_once_with(message=six_week_reminder_seven_days("English").format(name="Roland"),
+                                                 phone_number="1-111-1111,1-111-1113")
+        # The personalised reminders go out together
+        self.assertEqual(mocked_send_bulk.call_count, 1)
+        self.assertEqual(sorted(mocked_send_bulk.call_args[1]["messages"]),
+                         sorted([(six_week_reminder_seven_days("English").format(name="Sai"), "1-111-1112"),
+                                 (ten_week_reminder_seven_days("English").format(name="Roland"), "1-111-1114")]))
+        self.assertEqual(Message.objects.filter(direction="Outgoing").count(), 4)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send_bulk")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_records_reminders_sent_before_a_failure(self, mocked_send_text, mocked_send_bulk, mocked_logger):
+        for i, name in enumerate(["Roland", "Roland", "Sai", "Nathan"]):
+            contact_object(name=name, phone_number="1-111-111" + str(i), date_of_birth="12/6/2017")
+        mocked_send_bulk.side_effect = IOError("Provider down")
+        with self.assertRaises(IOError), patch("logging.error"):
+            send_reminders(TextReminder.due_on(FAKE_NOW.date()))
+        self.assertEqual(Message.objects.filter(direction="Outgoing").count(), 2)
+        self.assertEqual(set(Message.objects.values_list("contact__name", flat=True)), {"Roland"})
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_sends_concurrently(self, mocked_send_text, mocked_logger):
+        due_reminders = self.due_contacts(4)
+        in_flight = []
+        both_in_flight = threading.Event()
+        lock = threading.Lock()
+        def send(message, phone_number):
+            with lock:
+                in_flight.append(phone_number)
+                if len(in_flight) == 2:
+                    both_in_flight.set()
+            # Only returns early if a second request is sent while this one is still in flight
+            both_in_flight.wait(timeout=5)
+        mocked_send_text.side_effect = send
+        self.assertEqual(send_reminders(due_reminders, chunk_size=2, concurrency=2), 4)
+        self.assertTrue(both_in_flight.is_set())
+        self.assertEqual(Message.objects.filter(direction="Outgoing").count(), 4)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.error")
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_keeps_sending_after_a_failed_request(self, mocked_send_text, mocked_logger, mocked_error):
+        due_reminders = self.due_contacts(6)
+        def send(message, phone_number):
+            if "1-111-1112" in phone_number:
+                raise IOError("Provider down")
+        mocked_send_text.side_effect = send
+        with self.assertRaises(IOError):
+            send_reminders(due_reminders, chunk_size=2, concurrency=3)
+        self.assertEqual(mocked_send_text.call_count, 3)
+        sent = Message.objects.filter(direction="Outgoing")
+        self.assertEqual(sent.count(), 4)
+        self.assertFalse(sent.filter(contact__phone_number="1-111-1112").exists())
+        self.assertTrue(all(message.sent_at for message in sent))
+        self.assertEqual(Contact.objects.filter(last_contacted__isnull=False).count(), 4)
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.error")
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send")
+    def test_send_reminders_treats_a_rejected_send_as_failed(self, mocked_send_text, mocked_logger, mocked_error):
+        due_reminders = self.due_contacts(2)
+        mocked_send_text.return_value = {"status": "failure", "errors": [{"code": 192, "message": "Insufficient credit"}]}
+        with self.assertRaises(IOError):
+            send_reminders(due_reminders)
+        self.assertFalse(Message.objects.filter(direction="Outgoing").exists())
+        self.assertFalse(Contact.objects.filter(last_contacted__isnull=False).exists())
+
+    @freeze_time(FAKE_NOW)
+    @patch("logging.error")
+    @patch("logging.info")
+    @patch("modules.text_reminder.Texter.send_bulk")
+    def test_send_reminders_treats_rejected_bulk_messages_as_failed(self, mocked_send_bulk, mocked_logger, mocked_error):
+        contact_object(name="Roland", phone_number="1-111-1111", date_of_birth="12/6/2017")
+        contact_object(name="Sai", phone_number="1-111-1112", date_of_birth="12/6/2017")
+        mocked_send_bulk.return_value = [{"status": "success",
+                                          "messages": [{"status": "success"},
+                                                       {"status": "failure", "errors": [{"code": 4}]}]}]
+        with self.assertRaises(IOError):
+            send_reminders(TextReminder.due_on(FAKE_NOW.date()))
+        self.assertFalse(Message.objects.filter(direction="Outgoing").exists())
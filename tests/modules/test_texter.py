@@ -0,0 +1,30 @@
+import mock
+from mock import patch, call
+from django.test import TestCase
+
+from modules.texter import Texter
+
+
+class TexterSendTests(TestCase):
+    @patch("modules.texter.Texter.send")
+    def test_send_to_many_joins_numbers(self, mocked_send):
+        Texter().send_to_many(message="Test", phone_numbers=["911111111111", "912222222222"])
+        mocked_send.assert_called_once_with(message="Test", phone_number="911111111111,912222222222")
+
+    @patch("modules.texter.MAX_NUMBERS_PER_SEND", 2)
+    @patch("modules.texter.Texter.send")
+    def test_send_to_many_splits_at_provider_limit(self, mocked_send):
+        mocked_send.return_value = {'status': 'success'}
+        statuses = Texter().send_to_many(message="Test", phone_numbers=["1", "2", "3", "4", "5"])
+        mocked_send.assert_has_calls([call(message="Test", phone_number="1,2"),
+                                      call(message="Test", phone_number="3,4"),
+                                      call(message="Test", phone_number="5")])
+        self.assertEqual(statuses, [{'status': 'success'}] * 3)
+
+    @patch("modules.texter.MAX_NUMBERS_PER_SEND", 2)
+    @patch("modules.textlocalwrapper.TextLocal.send_bulk_messages")
+    def test_send_bulk_splits_at_provider_limit(self, mocked_send_bulk):
+        messages = [("Hi Roland", "1"), ("Hi Sai", "2"), ("Hi Nathan", "3")]
+        Texter().send_bulk(messages=messages)
+        mocked_send_bulk.assert_has_calls([call(messages=messages[0:2]),
+                                           call(messages=messages[2:3])])
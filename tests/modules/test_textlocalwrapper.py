@@ -1,3 +1,4 @@
+import calendar
 import mock
 import json
 from mock import patch
@@ -6,19 +7,14 @@ from django.test import TestCase
 from datetime import datetime
 from django.utils import timezone
 
+from management.models import InboxCursor
 from modules.textlocalwrapper import TextLocal
 from modules.i18n import hindi_remind, hindi_information, msg_subscribe, msg_unsubscribe, \
                             msg_already_sub, six_week_reminder_one_day
 from modules.date_helper import datetime_from_date_string
+from tests.fixtures import FakeProviderServer
 import six
 
-class MockResponse():
-    def __init__(self, read_value):
-        self.read_value = read_value
-
-    def read(self):
-        return self.read_value
-
 
 class TextLocalInboxesTests(TestCase):
     def test_create_object(self):
@@ -115,13 +111,13 @@ class TextLocalInboxesTests(TestCase):
         self.assertFalse(textlocal.is_message_new(message=one_year_before, date_key_name="date"))
 
     @freeze_time(datetime(2017, 9, 6, 22, 0, 0))
-    @patch("modules.textlocalwrapper.request")
-    def test_new_messages_by_number_returns_message_and_datetime(self, mock_request):
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_new_messages_by_number_returns_message_and_datetime(self, mock_pool):
         textlocal = TextLocal(apikey='mock_key', primary_id='mock_id', sendername='mock_sendername')
         old_message = {'number': '910987654321', 'message': 'Old message', 'date': '2017-08-05 21:12:07', 'isNew': None}
         new_message = {'number': '910987654321', 'message': 'New message', 'date': '2017-09-06 12:12:07', 'isNew': True}
         new_message2 = {'number': '910987654321', 'message': 'Newer message', 'date': '2017-09-06 21:12:07', 'isNew': True}
-        mock_request.urlopen.return_value = MockResponse(read_value=json.dumps({'messages': [new_message, new_message2, old_message]}).encode('latin1'))
+        mock_pool.get.return_value = json.dumps({'messages': [new_message, new_message2, old_message]}).encode('latin1')
         fake_num_message_dict = textlocal.new_messages_by_number()
         self.assertIsInstance(fake_num_message_dict, dict)
         self.assertIsInstance(fake_num_message_dict['910987654321'], list)
@@ -135,13 +131,13 @@ class TextLocalInboxesTests(TestCase):
         self.assertTrue((new_message2['message'], new_message2_datetime) in fake_num_message_dict['910987654321'])
 
     @freeze_time(datetime(2017, 9, 6, 22, 0, 0))
-    @patch("modules.textlocalwrapper.request")
-    def test_new_api_send_messages_by_number_returns_message_and_datetime(self, mock_request):
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_new_api_send_messages_by_number_returns_message_and_datetime(self, mock_pool):
         textlocal = TextLocal(apikey='mock_key', primary_id='mock_id', sendername='mock_sendername')
         old_message = {'number': '910987654321', 'content': 'Old message', 'datetime': '2017-08-05 21:12:07', 'isNew': None}
         new_message = {'number': '910987654321', 'content': 'New message', 'datetime': '2017-09-06 12:12:07', 'isNew': True}
         new_message2 = {'number': '910987654321', 'content': 'Newer message', 'datetime': '2017-09-06 21:12:07', 'isNew': True}
-        mock_request.urlopen.return_value = MockResponse(read_value=json.dumps({'messages': [new_message, new_message2, old_message]}).encode('latin1'))
+        mock_pool.get.return_value = json.dumps({'messages': [new_message, new_message2, old_message]}).encode('latin1')
         fake_num_message_dict = textlocal.new_api_send_messages_by_number()
         self.assertIsInstance(fake_num_message_dict, dict)
         self.assertIsInstance(fake_num_message_dict['910987654321'], list)
@@ -211,19 +207,19 @@ class TextLocalInboxesTests(TestCase):
         num_message_dict2 = {'910987654321': [('Newer message', datetime(2017, 9, 6, 21, 12, 7).replace(tzinfo=timezone.get_default_timezone()))]}
         self.assertEqual(content_datetime_result, num_message_dict2)
 
-    @patch("modules.textlocalwrapper.request")
-    def test_get_primary_inbox_messages(self, mock_request):
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_get_primary_inbox_messages(self, mock_pool):
         textlocal = TextLocal(apikey='mock_key', primary_id='mock_id', sendername='mock_sendername')
-        mock_request.urlopen.return_value = MockResponse(read_value=json.dumps({'messages': [{'id': '000000024', 'number': 1112223334,
+        mock_pool.get.return_value = json.dumps({'messages': [{'id': '000000024', 'number': 1112223334,
             'message': 'Testy test', 'date': '2017-07-30 06:52:09', 'isNew': None, 'status': '?'},
-            {'id': '00000449', 'number': 0, 'message': 'Example message testy', 'date': '2017-08-05 21:12:07', 'isNew': None, 'status': '?'}]}).encode('latin1'))
+            {'id': '00000449', 'number': 0, 'message': 'Example message testy', 'date': '2017-08-05 21:12:07', 'isNew': None, 'status': '?'}]}).encode('latin1')
         self.assertEqual(textlocal.get_primary_inbox_messages(), [{'id': '000000024', 'number': 1112223334,
             'message': 'Testy test', 'date': '2017-07-30 06:52:09', 'isNew': None, 'status': '?'},
             {'id': '00000449', 'number': 0, 'message': 'Example message testy', 'date': '2017-08-05 21:12:07', 'isNew': None, 'status': '?'}])
-        mock_request.urlopen.return_value = MockResponse(read_value=json.dumps({'inbox_id': 10001, 'num_messages': 1, 'min_time': 1010101101, 'max_time': 101010101101, 'sort_order': 'asc', 'sort_field': 'date', 'start': 0, 'limit': 1000,
-            'messages': [{'id': '000000024', 'number': 1112223334, 'message': 'Testy test', 'date': '2017-07-30 06:52:09', 'isNew': None, 'status': '?'}]}).encode('latin1'))
+        mock_pool.get.return_value = json.dumps({'inbox_id': 10001, 'num_messages': 1, 'min_time': 1010101101, 'max_time': 101010101101, 'sort_order': 'asc', 'sort_field': 'date', 'start': 0, 'limit': 1000,
+            'messages': [{'id': '000000024', 'number': 1112223334, 'message': 'Testy test', 'date': '2017-07-30 06:52:09', 'isNew': None, 'status': '?'}]}).encode('latin1')
         self.assertEqual(textlocal.get_primary_inbox_messages(), [{'id': '000000024', 'number': 1112223334, 'message': 'Testy test', 'date': '2017-07-30 06:52:09', 'isNew': None, 'status': '?'}])
-        mock_request.urlopen.return_value = MockResponse(read_value=json.dumps({'inbox_id': 10001, 'num_messages': 0, 'min_time': 1010101101, 'max_time': 101010101101, 'sort_order': 'asc', 'sort_field': 'date', 'start': 0, 'limit': 1000, 'messages': []}).encode('latin1'))
+        mock_pool.get.return_value = json.dumps({'inbox_id': 10001, 'num_messages': 0, 'min_time': 1010101101, 'max_time': 101010101101, 'sort_order': 'asc', 'sort_field': 'date', 'start': 0, 'limit': 1000, 'messages': []}).encode('latin1')
         self.assertEqual(textlocal.get_primary_inbox_messages(), [])
 
     def test_doesnt_correct_corrupted_unicode_matches_english(self):
@@ -331,12 +327,9 @@ class TextLocalInboxesTests(TestCase):
         six_week_one_day_response = textlocal.response_unicode_encoder(hindi_six_week_one_day_response_name_erin)
         self.assertEqual(six_week_reminder_one_day("Hindi").format(name="Erin"), six_week_one_day_response)
 
-    @patch("modules.textlocalwrapper.request")
-    def test_send_message(self, mock_request):
-        class MockResponse():
-            def read(self):
-                return json.dumps({'message': 'yay'}).encode('latin1')
-        mock_request.urlopen.return_value = MockResponse()
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_send_message(self, mock_pool):
+        mock_pool.post.return_value = json.dumps({'message': 'yay'}).encode('latin1')
         tl = TextLocal(apikey='mock_key',
                         primary_id='mock_id',
                         sendername='mock_sendername')
@@ -344,15 +337,93 @@ class TextLocalInboxesTests(TestCase):
                                     phone_numbers='0000000')
         self.assertEqual(response['message'], 'yay')
 
-    @patch("modules.textlocalwrapper.request")
-    def test_send_message_hindi(self, mock_request):
-        class MockResponse():
-            def read(self):
-                return json.dumps({'message': hindi_remind()}).encode('latin1')
-        mock_request.urlopen.return_value = MockResponse()
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_send_message_hindi(self, mock_pool):
+        mock_pool.post.return_value = json.dumps({'message': hindi_remind()}).encode('latin1')
         tl = TextLocal(apikey='mock_key',
                         primary_id='mock_id',
                         sendername='mock_sendername')
         response = tl.send_message(message='Test',
                                     phone_numbers='0000000')
-        self.assertEqual(response['message'], hindi_remind())
\ No newline at end of file
+        self.assertEqual(response['message'], hindi_remind())
+
+    @freeze_time(datetime(2017, 9, 6, 22, 0, 0))
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_new_messages_by_number_after_cursor(self, mock_pool):
+        textlocal = TextLocal(apikey='mock_key', primary_id='mock_id', sendername='mock_sendername')
+        cursor = InboxCursor(name="inbox")
+        old_message = {'id': '1', 'number': '910987654321', 'message': 'Old message', 'date': '2017-08-05 21:12:07'}
+        new_message = {'id': '2', 'number': '910987654321', 'message': 'New message', 'date': '2017-09-06 12:12:07'}
+        newer_message = {'id': '3', 'number': '910987654322', 'message': 'Newer message', 'date': '2017-09-06 21:12:07'}
+        mock_pool.get.return_value = json.dumps({'messages': [newer_message, new_message, old_message]}).encode('latin1')
+        first_read = textlocal.new_messages_by_number_after(cursor)
+        self.assertEqual({number: [text for text, _ in texts] for number, texts in first_read.items()},
+                         {'910987654321': ['New message'], '910987654322': ['Newer message']})
+        # The first read goes back 24 hours
+        self.assertEqual(mock_pool.get.call_args[0][1]['min_time'], 1504648800)
+        self.assertEqual(cursor.last_message_id, 3)
+        first_high_water_mark = cursor.last_received_at
+
+        newest_message = {'id': '4', 'number': '910987654321', 'message': 'Newest message', 'date': '2017-09-06 21:12:07'}
+        mock_pool.get.return_value = json.dumps({'messages': [newest_message, newer_message]}).encode('latin1')
+        second_read = textlocal.new_messages_by_number_after(cursor)
+        self.assertEqual({number: [text for text, _ in texts] for number, texts in second_read.items()},
+                         {'910987654321': ['Newest message']})
+        self.assertEqual(mock_pool.get.call_args[0][1]['min_time'], calendar.timegm(first_high_water_mark.utctimetuple()))
+        self.assertEqual(cursor.last_message_id, 4)
+
+    @patch("modules.textlocalwrapper.shared_pool")
+    def test_send_message_takes_from_rate_limiter(self, mock_pool):
+        mock_pool.post.return_value = json.dumps({'message': 'yay'}).encode('latin1')
+        rate_limiter = mock.Mock()
+        tl = TextLocal(apikey='mock_key',
+                        primary_id='mock_id',
+                        sendername='mock_sendername',
+                        rate_limiter=rate_limiter)
+        tl.send_message(message='Test', phone_numbers='0000000')
+        tl.send_bulk_messages(messages=[('Test', '0000000')])
+        self.assertEqual(rate_limiter.acquire.call_count, 2)
+
+class TextLocalBulkSendingTests(TestCase):
+    def test_send_bulk_messages(self):
+        with FakeProviderServer() as server:
+            tl = TextLocal(apikey='mock_key',
+                            primary_id='mock_id',
+                            sendername='mock_sendername',
+                            api_url=server.api_url)
+            response = tl.send_bulk_messages(messages=[(six_week_reminder_one_day("English").format(name="Roland"), '911111111111'),
+                                                       (six_week_reminder_one_day("English").format(name="Sai"), '912222222222')])
+        self.assertEqual(response['status'], 'success')
+        self.assertEqual(len(server.requests), 1)
+        path, params = server.requests[0]
+        self.assertEqual(path, '/bulk_json/')
+        self.assertEqual(params['apikey'], ['mock_key'])
+        data = json.loads(params['data'][0])
+        self.assertEqual(data['sender'], 'mock_sendername')
+        self.assertFalse(data['unicode'])
+        self.assertEqual(data['messages'],
+                         [{'number': '911111111111', 'text': six_week_reminder_one_day("English").format(name="Roland")},
+                          {'number': '912222222222', 'text': six_week_reminder_one_day("English").format(name="Sai")}])
+
+    def test_send_bulk_messages_hindi(self):
+        with FakeProviderServer() as server:
+            tl = TextLocal(apikey='mock_key',
+                            primary_id='mock_id',
+                            sendername='mock_sendername',
+                            api_url=server.api_url)
+            tl.send_bulk_messages(messages=[(six_week_reminder_one_day("Hindi").format(name=hindi_remind()), '911111111111')])
+        data = json.loads(server.requests[0][1]['data'][0])
+        self.assertTrue(data['unicode'])
+        self.assertEqual(data['messages'][0]['text'], six_week_reminder_one_day("Hindi").format(name=hindi_remind()))
+
+    def test_send_message_to_many_numbers(self):
+        with FakeProviderServer() as server:
+            tl = TextLocal(apikey='mock_key',
+                            primary_id='mock_id',
+                            sendername='mock_sendername',
+                            api_url=server.api_url)
+            tl.send_message(message='Test', phone_numbers=['911111111111', '912222222222'])
+        path, params = server.requests[0]
+        self.assertEqual(path, '/send/')
+        self.assertEqual(params['numbers'], ['911111111111,912222222222'])
+        self.assertEqual(params['message'], ['Test'])
@@ -2,13 +2,15 @@ from __future__ import unicode_literals
 import os
 import csv
 import tempfile
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from mock import patch
 from freezegun import freeze_time
 from datetime import datetime
 from django.utils import timezone
-from management.models import Contact, Group
+from management.models import Contact, Group, ScheduledReminder
 from modules.utils import phone_number_is_valid
 from modules.upload_contacts_from_file import csv_upload, make_contact_dict, assign_groups_to_contact, \
                                               previous_vaccination, monthly_income, parse_or_create_delay_num, \
@@ -18,7 +20,9 @@ from modules.upload_contacts_from_file import csv_upload, make_contact_dict, ass
                                               determine_mother_tongue, language_selector, replace_blank_name, \
                                               determine_name, matching_permutation, check_all_headers, \
                                               assign_org_signup, assign_method_of_signup, assign_hospital_name, \
-                                              entry_or_empty_string, determine_date_of_birth, time_reference_or_none 
+                                              entry_or_empty_string, determine_date_of_birth, time_reference_or_none, \
+                                              resolve_columns, upsert_contacts, contact_entries, \
+                                              parse_in_processes
 from modules.date_helper import add_or_subtract_days, add_or_subtract_months
 from modules.i18n import hindi_placeholder_name, gujarati_placeholder_name
 from dateutil.relativedelta import relativedelta
@@ -1314,4 +1318,121 @@ class UploadContactsInputParserTests(TestCase):
         headers_mock.return_value = datetime(2016, 1, 1)
         self.assertEqual(datetime(2016, 1, 1), entry_or_empty_string(row=row, headers=headers))
         headers_mock.return_value = 10
-        self.assertEqual(10, entry_or_empty_string(row=row, headers=headers))
\ No newline at end of file
+        self.assertEqual(10, entry_or_empty_string(row=row, headers=headers))
+
+
+class UploadContactsColumnResolverTests(TestCase):
+    def test_resolves_permutations_in_check_order(self):
+        columns = resolve_columns(["NAME", " Phone Number ", "Date of Birth", "The Date Of Birth", "Other"],
+                                  headers={"name": ["Name"], "phone_number": ["Phone Number"],
+                                           "date_of_birth": ["Date Of Birth Of The Child", "Date of Birth"],
+                                           "gender": ["Gender"]})
+        self.assertEqual(columns, {"name": ["NAME"], "phone_number": [" Phone Number "],
+                                   "date_of_birth": ["Date of Birth", "The Date Of Birth"], "gender": []})
+
+    def test_skips_blank_entries_like_check_all_headers(self):
+        row = {"Date of Birth": "", "The Date Of Birth": "10/10/2016"}
+        columns = resolve_columns(row.keys(), headers={"date_of_birth": ["Date of Birth"]})
+        self.assertEqual(check_all_headers(row=row, headers=columns["date_of_birth"]), "10/10/2016")
+        self.assertEqual(check_all_headers(row=row, headers=["Date of Birth"]), "10/10/2016")
+        self.assertIsNone(check_all_headers(row={"Date of Birth": ""}, headers=columns["date_of_birth"]))
+
+    @freeze_time(datetime(2017, 8, 1, 12, 0))
+    def test_matches_unresolved_headers_on_example_files(self):
+        for path, source in [("tests/data/example.csv", "TR"), ("tests/data/example-m.csv", "MAPS"),
+                             ("tests/data/example-h.csv", "HANSA"), ("tests/data/example-w.csv", "WARDHA")]:
+            with open(path) as csvfile:
+                reader = csv.DictReader(csvfile)
+                headers = resolve_columns(reader.fieldnames)
+                for row in reader:
+                    self.assertEqual(make_contact_dict(row, source, headers=headers), make_contact_dict(row, source))
+
+
+class UploadContactsBulkUpsertTests(TestCase):
+    COLUMNS = ["Name", "Phone Number", "Date of Birth", "Language Preference", "Groups", "Date of Sign Up"]
+
+    def write_csv(self, rows):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, "w") as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(self.COLUMNS)
+            writer.writerows([row + ["2017-07-20"] for row in rows])
+        return path
+
+    @freeze_time(datetime(2017, 8, 1, 12, 0))
+    def test_creates_and_updates_contacts(self):
+        existing = create_sample_contact(name="Aaarsh", phone_number="911234567890",
+                                         date_of_birth=datetime(2017, 1, 5).date())
+        csv_upload(self.write_csv([["Aaarsh", "911234567890", "2017-06-10", "Hindi", "Everyone - Hindi"],
+                                   ["Sai", "911234567891", "2017-07-10", "English", "Everyone - English, Sample"],
+                                   ["Sai", "911234567891", "2017-07-11", "English", "Everyone - English"],
+                                   ["Bad", "12", "2017-07-10", "English", ""]]), source="TR", chunk_size=2)
+        self.assertEqual(Contact.objects.count(), 2)
+        existing.refresh_from_db()
+        self.assertEqual((existing.date_of_birth, existing.language_preference),
+                         (datetime(2017, 6, 10).date(), "Hindi"))
+        sai = Contact.objects.get(name="Sai")
+        self.assertEqual(sai.date_of_birth, datetime(2017, 7, 11).date())
+        self.assertEqual(sorted(sai.group_set.values_list("name", flat=True)), ["Everyone - English", "Sample"])
+        self.assertEqual(list(existing.group_set.values_list("name", flat=True)), ["Everyone - Hindi"])
+
+    @freeze_time(datetime(2017, 8, 1, 12, 0))
+    def test_schedules_reminders_for_created_and_updated_contacts(self):
+        existing = create_sample_contact(name="Aaarsh", phone_number="911234567890",
+                                         date_of_birth=datetime(2017, 1, 5).date())
+        csv_upload(self.write_csv([["Aaarsh", "911234567890", "2017-06-10", "Hindi", ""],
+                                   ["Sai", "911234567891", "2017-07-10", "English", ""]]), source="TR")
+        for contact in Contact.objects.all():
+            reminders = ScheduledReminder.objects.filter(contact=contact)
+            self.assertTrue(reminders.exists())
+            self.assertFalse(reminders.exclude(due_date__gt=contact.date_of_birth).exists())
+
+    @freeze_time(datetime(2017, 8, 1, 12, 0))
+    def test_unchanged_contacts_are_not_saved(self):
+        path = self.write_csv([["Sai", "911234567891", "2017-07-10", "English", "Everyone - English"]])
+        csv_upload(path, source="TR")
+        with patch("management.models.Contact.save") as mocked_save:
+            csv_upload(path, source="TR")
+        self.assertFalse(mocked_save.called)
+
+    @freeze_time(datetime(2017, 8, 1, 12, 0))
+    def test_queries_per_chunk_do_not_grow_with_rows(self):
+        rows = [["Child {}".format(i), "9112345678{:02d}".format(i), "2017-07-10", "English", "Everyone"]
+                for i in range(20)]
+        entries = [(make_contact_dict(dict(zip(self.COLUMNS, row + ["2017-07-20"])), "TR"), row[4]) for row in rows]
+        create_sample_group(name="Everyone")
+        with CaptureQueriesContext(connection) as small:
+            upsert_contacts(entries[:2])
+        Contact.objects.all().delete()
+        with CaptureQueriesContext(connection) as large:
+            upsert_contacts(entries[2:])
+        self.assertEqual(len(large), len(small))
+
+
+class UploadContactsParsingProcessesTests(TestCase):
+    @freeze_time(datetime(2017, 8, 1, 12, 0))
+    def test_processes_parse_like_this_process(self):
+        for path, source in [("tests/data/example.csv", "TR"), ("tests/data/example-m.csv", "MAPS"),
+                             ("tests/data/example-h.csv", "HANSA"), ("tests/data/example-w.csv", "WARDHA")]:
+            with open(path) as csvfile:
+                reader = csv.DictReader(csvfile)
+                headers = resolve_columns(reader.fieldnames)
+                rows = list(reader)
+            with patch("logging.error") as in_process_errors:
+                in_process = list(contact_entries(rows, source, headers=headers))
+            with patch("logging.error") as pooled_errors:
+                pooled = list(contact_entries(rows, source, headers=headers, processes=2))
+            self.assertEqual(pooled, in_process)
+            self.assertEqual(pooled_errors.call_args_list, in_process_errors.call_args_list)
+
+    def test_batches_come_back_in_file_order(self):
+        rows = [{"Name": "Child {}".format(i), "Phone Number": "9112345678{:02d}".format(i),
+                 "Date of Birth": "2017-07-10", "Date of Sign Up": "2017-07-20"} for i in range(25)]
+        parsed = list(parse_in_processes(rows, "TR", resolve_columns(rows[0].keys()), processes=3, batch_size=2))
+        self.assertEqual([new_dict["name"] for new_dict, _ in parsed], [row["Name"] for row in rows])
+
+    def test_parsing_errors_reach_the_uploader(self):
+        rows = [{"Name": "Roland", "Phone Number": "911234567890"}]
+        with self.assertRaises(AttributeError):
+            list(parse_in_processes(rows, "TR", resolve_columns(rows[0].keys()), processes=2))
@@ -4,9 +4,11 @@ from django.utils import timezone
 from freezegun import freeze_time
 from mock import patch
 
+from management.models import Contact, Group
 from modules.utils import quote, phone_number_is_valid, remove_nondigit_characters, \
                                 add_country_code_to_phone_number, prepare_phone_number, \
-                                keywords_without_word, is_not_ascii
+                                keywords_without_word, is_not_ascii, add_contact_to_group, \
+                                add_contacts_to_groups
 from modules.date_helper import date_string_to_date, date_is_valid, \
                                 date_to_date_string, date_string_dmy_to_date, \
                                 date_string_mdy_to_date, date_string_ymd_to_date, \
@@ -904,3 +906,31 @@ class AsciiMessageTests(TestCase):
         self.assertTrue(is_not_ascii(sixteen_month_reminder_one_day("Gujarati")))
         self.assertTrue(is_not_ascii(five_year_reminder_seven_days("Gujarati")))
         self.assertTrue(is_not_ascii(five_year_reminder_one_day("Gujarati")))
+
+
+class GroupMembershipTests(TestCase):
+    def setUp(self):
+        self.contacts = [Contact.objects.create(name="Roland", phone_number="1-111-111" + str(i)) for i in range(20)]
+        Group.objects.create(name="Everyone - English").contacts.add(self.contacts[0])
+
+    def test_add_contact_to_group(self):
+        group = add_contact_to_group(self.contacts[1], "Text Sign Ups")
+        self.assertEqual(group.name, "Text Sign Ups")
+        self.assertEqual(list(group.contacts.all()), [self.contacts[1]])
+
+    def test_add_contacts_to_groups_takes_a_few_queries(self):
+        memberships = [(contact, group_name) for contact in self.contacts
+                       for group_name in ["Everyone - English", "Text Sign Ups", "Text Sign Ups - English"]]
+        # Read the groups, create the missing ones and read them back, then read the
+        # existing memberships and insert the rest, with a savepoint around each insert
+        with self.assertNumQueries(1 + 3 + 1 + 1 + 3):
+            groups = add_contacts_to_groups(memberships)
+        self.assertEqual(sorted(groups), ["Everyone - English", "Text Sign Ups", "Text Sign Ups - English"])
+        for group in Group.objects.all():
+            self.assertEqual(group.contacts.count(), 20)
+
+    def test_adding_again_changes_nothing(self):
+        add_contacts_to_groups([(self.contacts[0], "Everyone - English"), (self.contacts[1], "Everyone - English")])
+        with self.assertNumQueries(2):
+            add_contacts_to_groups([(self.contacts[0], "Everyone - English"), (self.contacts[1], "Everyone - English")])
+        self.assertEqual(Group.objects.get(name="Everyone - English").contacts.count(), 2)